@@ -1,7 +1,10 @@
-from fastapi import FastAPI
+import asyncio
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from config import settings
 from src.rag_architecture.graph_constructor import GraphConstructor
+from src.rag_architecture.components.answer_stream import stream_events, format_sse
 from langchain_core.messages import convert_to_messages
 from typing_extensions import Literal
 
@@ -12,10 +15,68 @@ graph_constructor = GraphConstructor(
     rerank_config=settings.rerank_config,
     generator_config=settings.generator_config,
     lexicalstore_config=settings.lexicalstore_config,
-    ensemble_config=settings.ensemble_config
+    ensemble_config=settings.ensemble_config,
+    chunkstore_path=settings.chunkstore_path,
+    filter_config=settings.filter_config,
+    cache_config=settings.cache_config,
+    manifest_path=settings.ingestion_config.manifest_path,
+    depth_config=settings.depth_config,
+    context_config=settings.context_config,
+    max_concurrent_searches=settings.serving_config.max_concurrent_chats
 )
 graph = graph_constructor.compile()
 
+
+class ConcurrencyLimiter:
+    """
+    Class to cap the number of graph executions running at the same time in a worker. Requests beyond the cap wait
+    in a bounded queue, and requests arriving when the queue is full are rejected so clients can back off.
+    """
+
+    def __init__(self, max_running : int, max_queued : int):
+        """
+        Initializes the ConcurrencyLimiter.
+
+        Args:
+            max_running (int): Maximum number of graph executions running at the same time.
+            max_queued (int): Maximum number of requests waiting for a running slot.
+        """
+        self.semaphore = asyncio.Semaphore(max_running)
+        self.max_pending = max_running + max_queued
+        self.pending = 0
+        self.running = 0
+        self.rejected = 0
+
+    def try_acquire(self) -> bool:
+        """
+        Takes a running slot or queue place for a request, in the same step as checking that one is free so concurrent
+        requests cannot all pass the check. Every successful call must be followed by `release`.
+
+        Returns:
+            bool: Whether the request was accepted, otherwise it is counted as rejected.
+        """
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            return False
+        self.pending += 1
+        return True
+
+    def release(self):
+        """ Frees the running slot or queue place taken by `try_acquire`. """
+        self.pending -= 1
+
+    def get_stats(self) -> dict:
+        """
+        Returns the concurrency statistics.
+
+        Returns:
+            dict: Number of running and queued graph executions, and number of rejected requests.
+        """
+        return {"running" : self.running, "queued" : self.pending - self.running, "rejected" : self.rejected}
+
+
+chat_limiter = ConcurrencyLimiter(settings.serving_config.max_concurrent_chats, settings.serving_config.max_queued_chats)
+
 class Message(BaseModel):
     role : Literal['user', 'ai']
     content: str
@@ -24,27 +85,107 @@ class ChatInput(BaseModel):
     messages: list[Message]
 
 @app.post("/chat/", response_model=tuple)
-def chat(chat_input: ChatInput):
+async def chat(chat_input: ChatInput):
     """
 
-    Fast API endpoint to chat with the RAG chatbot
+    Fast API endpoint to chat with the RAG chatbot. The graph runs asynchronously, so waiting on the LLM and
+    retrieval calls does not hold a worker thread.
 
     Args:
         chat_input (ChatInput): Conversation history with the chatbot
 
+    Raises:
+        HTTPException: 429 when the worker already runs and queues as many conversations as it accepts
+
     Returns:
         tuple: Chatbot response , citations and classified user intention
     """
-    messages = convert_to_messages([message.model_dump() for message in chat_input.messages])
+    # Reject instead of queueing without limit, so an overloaded worker answers immediately and clients can retry later
+    if not chat_limiter.try_acquire():
+        raise HTTPException(status_code = 429, detail = "Too many concurrent conversations, please retry later", headers = {"Retry-After" : "1"})
+
+    try:
+        messages = convert_to_messages([message.model_dump() for message in chat_input.messages])
+        async with chat_limiter.semaphore:
+            chat_limiter.running += 1
+            try:
+                response = await graph.ainvoke({"messages" : messages})
+                answer = response["answer"]
+                user_intention = response["user_intention"]
+                citations = response["citations"]
+            except Exception as e:
+                answer = f"API ERROR : {e}"
+                user_intention = None
+                citations = []
+            finally:
+                chat_limiter.running -= 1
+    finally:
+        chat_limiter.release()
+
+    return answer, user_intention, citations
+
+@app.post("/chat/stream/")
+async def chat_stream(chat_input: ChatInput) -> StreamingResponse:
+    """
+    Fast API endpoint to chat with the RAG chatbot, streaming server-sent events as the graph runs: 'rewrite' with the
+    rewritten question, 'sources' with the retrieved chunks, 'tool_call' and 'tool_result' for the calculator calls,
+    'token' with the answer text as it is generated, and finally 'citations' with the full answer, citations and
+    classified user intention, or 'error' if the graph failed.
+
+    Args:
+        chat_input (ChatInput): Conversation history with the chatbot
+
+    Raises:
+        HTTPException: 429 when the worker already runs and queues as many conversations as it accepts
+
+    Returns:
+        StreamingResponse: The text/event-stream of the conversation turn
+    """
+    # The place is taken before the response is returned, the generator only starts once the response is sent
+    if not chat_limiter.try_acquire():
+        raise HTTPException(status_code = 429, detail = "Too many concurrent conversations, please retry later", headers = {"Retry-After" : "1"})
 
     try:
-        response = graph.invoke({"messages" : messages})
-        answer = response["answer"]
-        user_intention = response["user_intention"]
-        citations = response["citations"]
-    except Exception as e:
-        answer = f"API ERROR : {e}"
-        user_intention = None
-        citations = []
-
-    return answer, user_intention, citations
\ No newline at end of file
+        messages = convert_to_messages([message.model_dump() for message in chat_input.messages])
+    except Exception:
+        chat_limiter.release()
+        raise
+
+    async def event_stream():
+        try:
+            async with chat_limiter.semaphore:
+                chat_limiter.running += 1
+                try:
+                    async for event, data in stream_events(graph, messages):
+                        yield format_sse(event, data)
+                except Exception as e:
+                    yield format_sse("error", {"answer" : f"API ERROR : {e}", "user_intention" : None, "citations" : []})
+                finally:
+                    chat_limiter.running -= 1
+        finally:
+            chat_limiter.release()
+
+    # Proxies must not buffer the stream, otherwise the events only reach the client once the answer is complete
+    return StreamingResponse(event_stream(), media_type = "text/event-stream", headers = {"Cache-Control" : "no-cache", "X-Accel-Buffering" : "no"})
+
+@app.get("/stats/")
+def stats() -> dict:
+    """
+    Fast API endpoint reporting the retrieval statistics of the worker
+
+    Returns:
+        dict: Latency, timeouts and errors of the lexical and dense retrievers over the recent searches, the retrieval and answer cache statistics, the chosen retrieval depths, the size and latency of the vector shards, and the running, queued and rejected conversations
+    """
+    retrieval_cache = graph_constructor.retrieval_cache
+    answer_cache = graph_constructor.answer_cache
+    adaptive_depth = graph_constructor.adaptive_depth
+    vectorstore = graph_constructor.vectorstore
+
+    return {
+        "retriever_latency" : graph_constructor.hybrid_retriever.get_latency_stats(),
+        "retrieval_cache" : retrieval_cache.get_stats() if retrieval_cache is not None else None,
+        "answer_cache" : answer_cache.get_stats() if answer_cache is not None else None,
+        "retrieval_depth" : adaptive_depth.get_stats() if adaptive_depth is not None else None,
+        "vector_shards" : vectorstore.get_shard_stats() if hasattr(vectorstore, 'get_shard_stats') else None,
+        "chat_concurrency" : chat_limiter.get_stats()
+    }
@@ -0,0 +1,42 @@
+import argparse
+import time
+import tracemalloc
+from config import settings
+from src.index_ingestion.markdown_chunker import MarkdownChunker
+from src.index_ingestion.report_store import load_report_pages, PARSED_REPORT_EXT
+from src.index_ingestion.utils import get_file_paths
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description = "Measures the chunking throughput and peak memory on the parsed report corpus.")
+    arg_parser.add_argument("--parsed-dir", default = f"{settings.base_input_dir}/parsed_reports", help = "Directory containing the parsed reports")
+    args = arg_parser.parse_args()
+
+    chunker = MarkdownChunker(
+        chunker_method=settings.chunker_config.chunker_method, 
+        chunk_size=settings.chunker_config.chunk_size,
+        chunk_overlap=settings.chunker_config.chunk_overlap, 
+        chunker_params=settings.chunker_config.chunker_params
+    )
+
+    reports = {}
+    for parsed_file in get_file_paths(args.parsed_dir, PARSED_REPORT_EXT):
+        reports[parsed_file] = load_report_pages(parsed_file)
+
+    num_chars = sum(len(page_data['page_content']) for report_pages in reports.values() for page_data in report_pages)
+    num_chunks = 0
+    peak_memory = 0
+    elapsed_time = 0.0
+
+    # Chunk one report at a time and track the peak memory allocated while chunking each report
+    for parsed_file, report_pages in reports.items():
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        num_chunks += len(chunker.chunk(report_pages = report_pages, parsed_file = parsed_file))
+        elapsed_time += time.perf_counter() - t0
+        peak_memory = max(peak_memory, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    print(f"Chunked {len(reports)} reports into {num_chunks} chunks in {elapsed_time:.2f}s")
+    print(f"Throughput: {num_chars / elapsed_time / 1e6:.2f} MB/sec, {num_chunks / elapsed_time:.0f} chunks/sec")
+    print(f"Peak memory per report: {peak_memory / 1024 ** 2:.1f} MiB")
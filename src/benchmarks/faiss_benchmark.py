@@ -0,0 +1,177 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import numpy as np
+from config import settings
+from src.index_ingestion.faiss_store import CompressedFAISS, ADD_BATCH_SIZE
+
+
+def read_rss_mb() -> float:
+    """
+    Reads the resident memory of the current process.
+
+    Returns:
+        float: The resident memory in MB.
+    """
+    with open('/proc/self/status', 'r') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+
+    return 0.0
+
+
+def load_base_vectors(cache_dir : str) -> np.ndarray:
+    """
+    Loads real chunk embeddings from the embedding cache, used as centres of the synthetic corpus.
+
+    Args:
+        cache_dir (str): Directory of the embedding cache.
+
+    Returns:
+        np.ndarray: The cached embeddings, or None if the cache is empty.
+    """
+    for meta_path in glob.glob(os.path.join(cache_dir, '*', 'meta.json')):
+        with open(meta_path, 'r') as f:
+            dim = json.load(f)['dim']
+
+        vectors_path = os.path.join(os.path.dirname(meta_path), 'vectors.f32')
+        if os.path.exists(vectors_path) and os.path.getsize(vectors_path) >= 4 * dim:
+            return np.fromfile(vectors_path, dtype = np.float32).reshape(-1, dim)
+
+    return None
+
+
+def sample_vectors(base_vectors : np.ndarray, num_vectors : int, noise : float, rng : np.random.Generator) -> np.ndarray:
+    """
+    Samples unit vectors around the base vectors.
+
+    Args:
+        base_vectors (np.ndarray): The base vectors.
+        num_vectors (int): Number of vectors to sample.
+        noise (float): Standard deviation of the noise added to every dimension, relative to a unit vector.
+        rng (np.random.Generator): The random generator.
+
+    Returns:
+        np.ndarray: The sampled unit vectors.
+    """
+    vectors = base_vectors[rng.integers(0, len(base_vectors), num_vectors)]
+    vectors = vectors + rng.normal(0, noise / np.sqrt(base_vectors.shape[1]), vectors.shape).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis = 1, keepdims = True)
+
+
+def exact_search(corpus : np.ndarray, queries : np.ndarray, k : int) -> np.ndarray:
+    """
+    Finds the exact k nearest vectors of every query by cosine similarity, scanning the corpus by blocks.
+
+    Args:
+        corpus (np.ndarray): The unit corpus vectors.
+        queries (np.ndarray): The unit query vectors.
+        k (int): Number of neighbours.
+
+    Returns:
+        np.ndarray: The positions of the k nearest vectors of every query.
+    """
+    best_scores = np.full((len(queries), k), -np.inf, dtype = np.float32)
+    best_positions = np.zeros((len(queries), k), dtype = np.int64)
+
+    for start in range(0, len(corpus), ADD_BATCH_SIZE):
+        scores = queries @ np.asarray(corpus[start : start + ADD_BATCH_SIZE]).T
+        scores = np.concatenate([best_scores, scores], axis = 1)
+        positions = np.concatenate([best_positions, np.broadcast_to(np.arange(start, start + scores.shape[1] - k), (len(queries), scores.shape[1] - k))], axis = 1)
+        top = np.argpartition(-scores, k - 1, axis = 1)[:, :k]
+        best_scores, best_positions = np.take_along_axis(scores, top, axis = 1), np.take_along_axis(positions, top, axis = 1)
+
+    return best_positions
+
+
+def search_worker(store_dir : str, store_params : dict, queries : np.ndarray, k : int, connection):
+    """
+    Loads the index in a fresh process and searches it, so the resident memory only covers the loaded index.
+
+    Args:
+        store_dir (str): Directory of the CompressedFAISS.
+        store_params (dict): Parameters of the CompressedFAISS.
+        queries (np.ndarray): The query vectors.
+        k (int): Number of chunks returned per query.
+        connection: Pipe end the results are sent to.
+    """
+    rss_before = read_rss_mb()
+    vectorstore = CompressedFAISS(embedding_function = None, persist_directory = store_dir, read_only = True, **store_params)
+    latencies, results = [], []
+
+    for query in queries:
+        t0 = time.perf_counter()
+        docs = vectorstore.search_by_vector(query, k)
+        latencies.append(time.perf_counter() - t0)
+        results.append([int(doc.metadata['chunk_id']) for doc, _ in docs])
+
+    connection.send({"latencies" : latencies, "results" : results, "rss_mb" : read_rss_mb() - rss_before})
+    connection.close()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description = "Measures the recall@k against exact search, query latency and resident memory of compressed FAISS indexes.")
+    arg_parser.add_argument("--sizes", type = int, nargs = "+", default = [100000, 1000000], help = "Number of chunks of the synthetic corpora")
+    arg_parser.add_argument("--factories", nargs = "+", default = ["IVF1024,PQ64", "IVF1024,SQ8", "HNSW32,SQ8"], help = "FAISS index factory strings")
+    arg_parser.add_argument("--nprobe", type = int, default = 16, help = "Number of inverted lists searched by IVF indexes")
+    arg_parser.add_argument("--ef-search", type = int, default = 64, help = "Size of the candidate list searched by HNSW indexes")
+    arg_parser.add_argument("--k", type = int, default = 15, help = "Number of chunks returned per query")
+    arg_parser.add_argument("--num-queries", type = int, default = 200, help = "Number of queries")
+    arg_parser.add_argument("--noise", type = float, default = 0.5, help = "Noise added around the cached embeddings to synthesise the corpus")
+    arg_parser.add_argument("--dim", type = int, default = 3072, help = "Dimension of random vectors, used when the embedding cache is empty")
+    args = arg_parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    base_vectors = load_base_vectors(settings.vectorstore_config.embedding_cache_dir)
+    if base_vectors is None:
+        print("WARNING: The embedding cache is empty, the corpus is made of random vectors")
+        base_vectors = rng.normal(size = (1000, args.dim)).astype(np.float32)
+
+    queries = sample_vectors(base_vectors, args.num_queries, args.noise, rng)
+    ctx = multiprocessing.get_context('spawn')
+
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # The corpus is written by blocks to a memory-mapped file, so 1M chunks never sit in memory at once
+            corpus = np.memmap(os.path.join(tmp_dir, 'corpus.f32'), dtype = np.float32, mode = 'w+', shape = (size, base_vectors.shape[1]))
+            for start in range(0, size, ADD_BATCH_SIZE):
+                corpus[start : start + ADD_BATCH_SIZE] = sample_vectors(base_vectors, min(ADD_BATCH_SIZE, size - start), args.noise, rng)
+
+            t0 = time.perf_counter()
+            ground_truth = exact_search(corpus, queries, args.k)
+            exact_time = (time.perf_counter() - t0) / len(queries)
+            print(f"{size} chunks of dimension {base_vectors.shape[1]}, {len(queries)} queries, k = {args.k}, exact search {1000 * exact_time:.1f}ms/query")
+
+            for factory in args.factories:
+                store_dir = os.path.join(tmp_dir, factory.replace(',', '_'))
+                store_params = {"index_factory" : factory, "nprobe" : args.nprobe, "ef_search" : args.ef_search}
+                vectorstore = CompressedFAISS(embedding_function = None, persist_directory = store_dir, **store_params)
+
+                t0 = time.perf_counter()
+                # Chunk ids are the corpus positions, so the results can be compared with the exact search
+                for start in range(0, size, ADD_BATCH_SIZE):
+                    end = min(start + ADD_BATCH_SIZE, size)
+                    vectorstore.upsert_embeddings([str(position) for position in range(start, end)], corpus[start : end], [{"company_symbol" : "BENCH", "report_year" : "0"}] * (end - start))
+                vectorstore.build()
+                build_time = time.perf_counter() - t0
+                index_size = os.path.getsize(vectorstore.build_paths(vectorstore.current_build()['build'])['index'])
+                del vectorstore
+
+                parent_connection, child_connection = ctx.Pipe(duplex = False)
+                process = ctx.Process(target = search_worker, args = (store_dir, store_params, queries, args.k, child_connection))
+                process.start()
+                output = parent_connection.recv()
+                process.join()
+
+                recall = np.mean([len(set(result) & set(truth)) / args.k for result, truth in zip(output["results"], ground_truth.tolist())])
+                latencies = sorted(output["latencies"])
+                print(
+                    f"  {factory:<16} recall@{args.k} {recall:.3f}, mean latency {1000 * np.mean(latencies):.2f}ms, "
+                    f"p95 latency {1000 * latencies[int(0.95 * (len(latencies) - 1))]:.2f}ms, RSS {output['rss_mb']:.0f}MB, "
+                    f"index {index_size / 2 ** 20:.0f}MB, build {build_time:.0f}s"
+                )
@@ -0,0 +1,59 @@
+import argparse
+import string
+import time
+from nltk.tokenize import word_tokenize
+from nltk.stem import PorterStemmer
+from nltk.corpus import stopwords
+from config import settings
+from src.index_ingestion.keyword_preprocessor import KeywordPreprocessor
+from src.index_ingestion.report_store import load_report_pages, PARSED_REPORT_EXT
+from src.index_ingestion.utils import get_file_paths, clean_text
+
+stemmer = PorterStemmer()
+stop_words = set(stopwords.words('english'))
+
+def reference_preprocess_text(text : str) -> list[str]:
+    """
+    The original keyword preprocessing, which rebuilds the translation table on every call and does not memoise stems.
+
+    Args:
+        text (str): The input text to be preprocessed.
+
+    Returns:
+        list[str]: A list of preprocessed keywords from the input text.
+    """
+    text = text.strip()
+    text = text.lower()
+    text = text.translate(str.maketrans('', '', string.punctuation))
+    tokens = word_tokenize(text)
+    filtered_tokens = [token for token in tokens if token not in stop_words]
+
+    return [stemmer.stem(token) for token in filtered_tokens]
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description = "Measures the keyword preprocessing throughput on the parsed report corpus.")
+    arg_parser.add_argument("--parsed-dir", default = f"{settings.base_input_dir}/parsed_reports", help = "Directory containing the parsed reports")
+    args = arg_parser.parse_args()
+
+    # Use the cleaned page contents of every parsed report as the corpus
+    texts = []
+    for parsed_file in get_file_paths(args.parsed_dir, PARSED_REPORT_EXT):
+        texts += [clean_text(page_data['page_content']) for page_data in load_report_pages(parsed_file)]
+
+    preprocessors = {
+        "reference" : reference_preprocess_text,
+        "engine (nltk)" : KeywordPreprocessor(tokenizer = 'nltk', nltk_data_dir = settings.get('nltk_data_dir')),
+        "engine (regex)" : KeywordPreprocessor(tokenizer = 'regex', nltk_data_dir = settings.get('nltk_data_dir')),
+    }
+    reference_keywords = None
+
+    for name, preprocess_func in preprocessors.items():
+        t0 = time.perf_counter()
+        keywords = [preprocess_func(text) for text in texts]
+        elapsed_time = time.perf_counter() - t0
+        num_tokens = sum(len(text_keywords) for text_keywords in keywords)
+
+        reference_keywords = reference_keywords or keywords
+        num_identical = sum(text_keywords == ref_keywords for text_keywords, ref_keywords in zip(keywords, reference_keywords))
+        print(f"{name:<16} {num_tokens / elapsed_time:>12,.0f} tokens/sec, {num_identical}/{len(texts)} texts identical to the reference")
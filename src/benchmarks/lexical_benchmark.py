@@ -0,0 +1,68 @@
+import argparse
+import os
+import pickle
+import tempfile
+import time
+import pandas as pd
+from config import settings
+from langchain_community.retrievers import BM25Retriever
+from src.index_ingestion.markdown_chunker import MarkdownChunker
+from src.index_ingestion.report_store import load_report_pages, PARSED_REPORT_EXT
+from src.index_ingestion.sparse_bm25 import SparseBM25Retriever
+from src.index_ingestion.utils import get_file_paths
+from src.index_ingestion.text_utils import preprocess_text
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description = "Compares the pickled BM25Retriever with the SparseBM25Retriever on the parsed report corpus.")
+    arg_parser.add_argument("--parsed-dir", default = f"{settings.base_input_dir}/parsed_reports", help = "Directory containing the parsed reports")
+    arg_parser.add_argument("--num-workers", type = int, default = settings.ingestion_config.num_workers, help = "Number of processes tokenising the chunks")
+    arg_parser.add_argument("--queries", default = "data/evaluation_qa/qa_dataset_v1.csv", help = "Evaluation dataset whose questions are used as queries")
+    args = arg_parser.parse_args()
+
+    chunker = MarkdownChunker(
+        chunker_method=settings.chunker_config.chunker_method,
+        chunk_size=settings.chunker_config.chunk_size,
+        chunk_overlap=settings.chunker_config.chunk_overlap,
+        chunker_params=settings.chunker_config.chunker_params
+    )
+
+    chunks = []
+    for parsed_file in get_file_paths(args.parsed_dir, PARSED_REPORT_EXT):
+        chunks += chunker.chunk(report_pages = load_report_pages(parsed_file), parsed_file = parsed_file)
+
+    queries = pd.read_csv(args.queries)['question'].astype(str).tolist()
+    k = settings.lexicalstore_config.lexicalstore_params.k
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        t0 = time.perf_counter()
+        reference = BM25Retriever.from_documents(documents = chunks, preprocess_func = preprocess_text, k = k)
+        reference_build = time.perf_counter() - t0
+        with open(os.path.join(tmp_dir, 'bm25.pkl'), 'wb') as f:
+            pickle.dump(reference, f)
+
+        t0 = time.perf_counter()
+        sparse = SparseBM25Retriever.from_documents(documents = chunks, preprocess_func = preprocess_text, num_workers = args.num_workers, k = k)
+        sparse_build = time.perf_counter() - t0
+        sparse.save(os.path.join(tmp_dir, 'sparse_bm25'))
+
+        t0 = time.perf_counter()
+        with open(os.path.join(tmp_dir, 'bm25.pkl'), 'rb') as f:
+            reference = pickle.load(f)
+        reference_load = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        sparse = SparseBM25Retriever.load(os.path.join(tmp_dir, 'sparse_bm25'), preprocess_func = preprocess_text, k = k)
+        sparse_load = time.perf_counter() - t0
+
+    results = {}
+    for name, retriever in {"BM25Retriever" : reference, "SparseBM25Retriever" : sparse}.items():
+        t0 = time.perf_counter()
+        results[name] = [[doc.id for doc in retriever.invoke(query)] for query in queries]
+        results[name + " time"] = time.perf_counter() - t0
+
+    num_identical = sum(ref_ids == sparse_ids for ref_ids, sparse_ids in zip(results["BM25Retriever"], results["SparseBM25Retriever"]))
+    print(f"Corpus: {len(chunks)} chunks, {len(queries)} queries, k = {k}")
+    print(f"{'BM25Retriever':<20} build {reference_build:.2f}s, load {reference_load:.3f}s, {len(queries) / results['BM25Retriever time']:.1f} queries/sec")
+    print(f"{'SparseBM25Retriever':<20} build {sparse_build:.2f}s, load {sparse_load:.3f}s, {len(queries) / results['SparseBM25Retriever time']:.1f} queries/sec")
+    print(f"Identical rankings: {num_identical}/{len(queries)}")
@@ -0,0 +1,48 @@
+import argparse
+import time
+import fitz
+from config import settings
+from src.index_ingestion.marker_parser import MarkerParser
+
+
+def benchmark_parser(parser : MarkerParser, input_path : str) -> tuple[int, float]:
+    """
+    Parses a PDF document with the given parser and measures the elapsed time.
+
+    Args:
+        parser (MarkerParser): The parser to benchmark.
+        input_path (str): Path to the PDF document to be parsed.
+
+    Returns:
+        tuple[int, float]: The number of parsed pages and the elapsed time in seconds.
+    """
+    t0 = time.perf_counter()
+    md_pages = parser.parse(input_path)
+    elapsed_time = time.perf_counter() - t0
+
+    return len(md_pages), elapsed_time
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description = "Compares the throughput of per-page and model pool Marker parsing.")
+    arg_parser.add_argument("input_path", help = "Path to the PDF document to be parsed")
+    arg_parser.add_argument("--max-pages", type = int, default = 20, help = "Only parse the first N pages of the document")
+    args = arg_parser.parse_args()
+
+    # Truncate the document so that the per-page baseline finishes in a reasonable time
+    document = fitz.open(args.input_path)
+    num_pages = min(len(document), args.max_pages)
+    sample_path = f"/tmp/parser_benchmark_{num_pages}.pdf"
+    sample = fitz.open()
+    sample.insert_pdf(document, from_page = 0, to_page = num_pages - 1)
+    sample.save(sample_path)
+
+    modes = {
+        "per-page" : {**settings.parser_config, "use_model_pool" : False},
+        "model pool" : {**settings.parser_config, "use_model_pool" : True},
+    }
+
+    for mode, parser_config in modes.items():
+        parser = MarkerParser(parser_config)
+        parsed_pages, elapsed_time = benchmark_parser(parser, sample_path)
+        print(f"{mode:<12} {parsed_pages} pages in {elapsed_time:.2f}s ({parsed_pages / elapsed_time:.2f} pages/sec)")
@@ -0,0 +1,69 @@
+import argparse
+import time
+import pandas as pd
+from config import settings
+from langchain_cohere import CohereRerank
+from src.company_registry import get_report_symbols
+from src.index_ingestion.chunk_store import CHUNK_ID_KEY
+from src.rag_architecture.components.search_filters import build_search_filters
+from src.rag_architecture.graph_constructor import GraphConstructor
+from src.utils import correct_page_retrieved
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description = "Compares the recall and latency of the local EmbeddingRerank with CohereRerank on the evaluation dataset.")
+    arg_parser.add_argument("--eval-path", default = "data/evaluation_qa/qa_dataset_v1.csv", help = "Evaluation dataset with the question and ground truth page of every row")
+    arg_parser.add_argument("--top-n", type = int, default = 10, help = "Number of chunks kept by the rerankers")
+    arg_parser.add_argument("--cohere-model", default = "rerank-v3.5", help = "Cohere rerank model")
+    arg_parser.add_argument("--bm25-weights", type = float, nargs = "+", default = [0.0, 0.3], help = "BM25 weights of the EmbeddingRerank variants")
+    args = arg_parser.parse_args()
+
+    # The candidates are retrieved once without reranking and given to every reranker
+    graph_constructor = GraphConstructor(
+        base_input_dir=settings.base_input_dir,
+        vectorstore_config=settings.vectorstore_config,
+        rerank_config=None,
+        generator_config=settings.generator_config,
+        lexicalstore_config=settings.lexicalstore_config,
+        ensemble_config=settings.ensemble_config,
+        chunkstore_path=settings.chunkstore_path,
+        filter_config=settings.filter_config,
+        manifest_path=settings.ingestion_config.manifest_path
+    )
+
+    rerankers = {"CohereRerank" : CohereRerank(model = args.cohere_model, top_n = args.top_n)}
+    for bm25_weight in args.bm25_weights:
+        rerankers[f"EmbeddingRerank (bm25 {bm25_weight})"] = graph_constructor.init_reranker("EmbeddingRerank", {"top_n" : args.top_n, "bm25_weight" : bm25_weight})
+
+    eval_dataset = pd.read_csv(args.eval_path).dropna(subset = ['question', 'page_number'])
+    company_symbols = get_report_symbols(settings.base_input_dir)
+    results = {name : {"recall" : [], "latency" : []} for name in ["Candidates"] + list(rerankers)}
+    top_n_overlap = {name : [] for name in rerankers if name != "CohereRerank"}
+
+    for _, row in eval_dataset.iterrows():
+        # Ground truth filters stand in for the filters extracted by the query rewriting
+        filters = build_search_filters([row['company_symbol']], [int(row['report_year'])], company_symbols, settings.filter_config.year_window)
+        candidates = graph_constructor.candidate_retriever.invoke(row['question'], filters = filters)
+        results["Candidates"]["recall"].append(correct_page_retrieved({**row, "retrieved_context" : candidates or None}))
+
+        reranked = {}
+        for name, reranker in rerankers.items():
+            t0 = time.perf_counter()
+            reranked[name] = reranker.compress_documents(candidates, row['question'])
+            results[name]["latency"].append(time.perf_counter() - t0)
+            results[name]["recall"].append(correct_page_retrieved({**row, "retrieved_context" : reranked[name] or None}))
+
+        # CohereRerank copies the documents without their id, the chunk id is kept in the metadata
+        cohere_ids = {doc.metadata[CHUNK_ID_KEY] for doc in reranked["CohereRerank"]}
+        for name in top_n_overlap:
+            top_n_overlap[name].append(len(cohere_ids & {doc.metadata[CHUNK_ID_KEY] for doc in reranked[name]}) / max(len(cohere_ids), 1))
+
+    print(f"{len(eval_dataset)} questions, top_n = {args.top_n}")
+    for name, result in results.items():
+        recall = [hit for hit in result["recall"] if hit is not None]
+        line = f"{name:<32} recall {sum(recall) / max(len(recall), 1):.3f}"
+        if len(result["latency"]) > 0:
+            line += f", mean latency {1000 * sum(result['latency']) / len(result['latency']):.1f}ms"
+        if name in top_n_overlap:
+            line += f", top_n overlap with Cohere {sum(top_n_overlap[name]) / max(len(top_n_overlap[name]), 1):.3f}"
+        print(line)
@@ -0,0 +1,143 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+import requests
+from config import settings
+
+SERVING_MODES = {
+    # Every worker is spawned by uvicorn and imports the app, loading its own indexes
+    "spawn" : lambda port, num_workers : [sys.executable, "-m", "uvicorn", "src.app:app", "--host", "127.0.0.1", "--port", str(port), "--workers", str(num_workers)],
+    # The indexes are loaded once and the workers are forked from the loaded process
+    "prefork" : lambda port, num_workers : [sys.executable, "-m", "src.serve", "--host", "127.0.0.1", "--port", str(port), "--workers", str(num_workers)]
+}
+
+
+def read_memory(pid : int) -> dict:
+    """
+    Reads the memory of a process from /proc.
+
+    Args:
+        pid (int): The process id.
+
+    Returns:
+        dict: The resident (rss), proportional (pss, shared pages divided between the processes sharing them), shared and private memory in MB.
+    """
+    memory = {}
+    with open(f"/proc/{pid}/smaps_rollup", 'r') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if value.strip().endswith('kB'):
+                memory[name] = int(value.split()[0]) / 1024
+
+    return {
+        "rss" : memory.get('Rss', 0.0),
+        "pss" : memory.get('Pss', 0.0),
+        "shared" : memory.get('Shared_Clean', 0.0) + memory.get('Shared_Dirty', 0.0),
+        "private" : memory.get('Private_Clean', 0.0) + memory.get('Private_Dirty', 0.0)
+    }
+
+
+def find_workers(parent_pid : int) -> list[int]:
+    """
+    Finds the worker processes of a server.
+
+    Args:
+        parent_pid (int): Process id of the server.
+
+    Returns:
+        list[int]: Process ids of the children of the server, without the multiprocessing resource tracker.
+    """
+    workers = []
+
+    for pid in filter(str.isdigit, os.listdir('/proc')):
+        try:
+            with open(f"/proc/{pid}/stat", 'r') as f:
+                # The command name is in parentheses and may contain spaces, the parent pid is the second field after it
+                ppid = int(f.read().rpartition(')')[2].split()[1])
+            with open(f"/proc/{pid}/cmdline", 'rb') as f:
+                cmdline = f.read()
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+
+        if ppid == parent_pid and b'resource_tracker' not in cmdline:
+            workers.append(int(pid))
+
+    return sorted(workers)
+
+
+def wait_until_loaded(process : subprocess.Popen, port : int, num_workers : int, timeout : float) -> list[int]:
+    """
+    Waits until the server answers and its workers stopped loading, i.e. their memory is stable.
+
+    Args:
+        process (subprocess.Popen): The server process.
+        port (int): Port of the server.
+        num_workers (int): Number of workers of the server.
+        timeout (float): Maximum waiting time in seconds.
+
+    Returns:
+        list[int]: Process ids of the workers.
+    """
+    deadline = time.time() + timeout
+    previous_rss = None
+
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise Exception(f'ERROR: The server exited with status {process.returncode}')
+
+        time.sleep(1)
+        workers = find_workers(process.pid)
+        if len(workers) < num_workers:
+            continue
+
+        try:
+            requests.get(f"http://127.0.0.1:{port}/stats/", timeout = 5).raise_for_status()
+            rss = sum(read_memory(pid)['rss'] for pid in workers)
+        except (requests.exceptions.RequestException, FileNotFoundError):
+            continue
+
+        if previous_rss is not None and abs(rss - previous_rss) < 1:
+            return workers
+        previous_rss = rss
+
+    raise Exception('ERROR: The server did not finish loading in time')
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description = "Reports the memory of every API worker when each worker loads its own indexes and when the workers are forked from a process which loaded them once.")
+    arg_parser.add_argument("--workers", type = int, default = 4, help = "Number of workers")
+    arg_parser.add_argument("--port", type = int, default = 8100, help = "Port of the servers")
+    arg_parser.add_argument("--modes", nargs = "+", default = list(SERVING_MODES), choices = list(SERVING_MODES), help = "Serving modes to compare")
+    arg_parser.add_argument("--questions", nargs = "*", default = [], help = "Questions sent to every server before measuring, so the pages touched by searches are counted (calls the providers)")
+    arg_parser.add_argument("--timeout", type = float, default = 600, help = "Maximum loading time of a server in seconds")
+    args = arg_parser.parse_args()
+
+    print(f"Vector store {settings.vectorstore_config.vectorstore_class}, lexical store {settings.lexicalstore_config.lexicalstore_class}, {args.workers} workers")
+
+    for mode in args.modes:
+        process = subprocess.Popen(SERVING_MODES[mode](args.port, args.workers), stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+
+        try:
+            workers = wait_until_loaded(process, args.port, args.workers, args.timeout)
+
+            for question in args.questions:
+                for _ in range(args.workers):
+                    requests.post(f"http://127.0.0.1:{args.port}/chat/", json = {"messages" : [{"role" : "user", "content" : question}]}, timeout = 60)
+
+            print(f"\n{mode}")
+            print(f"  {'process':<16} {'rss':>8} {'pss':>8} {'shared':>8} {'private':>8}")
+            totals = {"rss" : 0.0, "pss" : 0.0}
+
+            for pid in [process.pid] + workers:
+                memory = read_memory(pid)
+                totals = {key : totals[key] + memory[key] for key in totals}
+                name = "parent" if pid == process.pid else f"worker {pid}"
+                print(f"  {name:<16} {memory['rss']:>6.0f}MB {memory['pss']:>6.0f}MB {memory['shared']:>6.0f}MB {memory['private']:>6.0f}MB")
+
+            # The sum of the RSS counts the shared pages once per process, the sum of the PSS counts them once
+            print(f"  {'total':<16} {totals['rss']:>6.0f}MB {totals['pss']:>6.0f}MB")
+        finally:
+            process.terminate()
+            process.wait()
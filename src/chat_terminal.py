@@ -1,17 +1,107 @@
+import json
+import re
 import requests
 from dotenv import load_dotenv
 from config import settings
+from src.index_ingestion.report_store import read_parsed_page
 
 load_dotenv()
 
+def iter_events(response : requests.Response):
+    """
+    Reads the server-sent events of a streamed response as they arrive.
+
+    Args:
+        response (requests.Response): The streamed response.
+
+    Yields:
+        tuple[str, dict]: The event type and its payload.
+    """
+    event, data = None, []
+
+    for line in response.iter_lines(decode_unicode = True):
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+        elif line == "" and event is not None:
+            yield event, json.loads("\n".join(data))
+            event, data = None, []
+
+def print_cited_page(citation : str):
+    """
+    Prints the parsed content of a cited page, reading only that page of the parsed report.
+
+    Args:
+        citation (str): The citation, of the form 'pdf/{symbol}/{year}/page_{page_num}.pdf'.
+    """
+    match = re.fullmatch(r"pdf/([^/]+)/([^/]+)/page_(\d+)\.pdf", citation)
+    if match is None:
+        print(f"Invalid citation: {citation}\n")
+        return
+
+    symbol, year, page_num = match.group(1), match.group(2), int(match.group(3))
+    try:
+        page_data = read_parsed_page(settings.base_input_dir, symbol, year, page_num)
+    except Exception as e:
+        print(f"The parsed page of {citation} is not available locally: {e}\n")
+        return
+
+    print(f"--- {symbol} {year} page {page_num} ---\n{page_data['page_content']}\n")
+
+def render_stream(response : requests.Response) -> tuple[str, list]:
+    """
+    Prints the progress and the answer of the chatbot as they are streamed.
+
+    Args:
+        response (requests.Response): The streamed response of the chat endpoint.
+
+    Returns:
+        tuple[str, list]: The answer of the chatbot and its citations.
+    """
+    answer, citations, answer_started = "", [], False
+
+    for event, data in iter_events(response):
+
+        if event == "rewrite" and data["user_intention"] == "relevant":
+            print(f"[searching: {data['user_question']}]")
+        elif event == "sources":
+            sources = ", ".join(f"{source['company_symbol']} {source['report_year']} p.{source['page_num']}" for source in data["sources"])
+            print(f"[sources: {sources}]")
+        elif event == "tool_call":
+            print(f"[{data['name']}: {data['args']}]")
+        elif event == "tool_result":
+            print(f"[{data['name']} result: {data['content']}]")
+        elif event == "token":
+            if not answer_started:
+                print("AYF-CHATBOT: ", end = "", flush = True)
+                answer_started = True
+            print(data["text"], end = "", flush = True)
+        elif event in ("citations", "error"):
+            answer, citations = data["answer"], data["citations"]
+            # Cached answers and answers to irrelevant questions are not generated, so they arrive whole
+            if not answer_started:
+                print(f"AYF-CHATBOT: {answer}", end = "")
+            elif event == "error":
+                print(f"\nAYF-CHATBOT: {answer}", end = "")
+
+            # Printing citations depending on the classified user intention
+            if data["user_intention"] == "relevant":
+                print(f"\ncitations: {citations}\n")
+            else:
+                print("\n")
+
+    return answer, citations
+
 def main():
     """
     Initialise chat terminal to talk to the RAG chatbot
     """
     conversation_history = []
-    fastapi_url = f"{settings.fastapi_endpoint}:{settings.fastapi_port}/chat"
+    citations = []
+    fastapi_url = f"{settings.fastapi_endpoint}:{settings.fastapi_port}/chat/stream"
 
-    print("\nWelcome to the Ask-Your-Files Chat Terminal\n")
+    print("\nWelcome to the Ask-Your-Files Chat Terminal (type 'source <n>' to read the n-th cited page of the last answer)\n")
 
     # Infinite loop to keep the chat terminal alive
     while True:
@@ -22,25 +112,37 @@ def main():
             print("Goodbye!")
             break
 
+        # Shows a cited page of the last answer without sending anything to the chatbot
+        if re.fullmatch(r"source \d+", user_input.strip().lower()):
+            citation_idx = int(user_input.split()[1]) - 1
+            if 0 <= citation_idx < len(citations):
+                print_cited_page(citations[citation_idx])
+            else:
+                print(f"The last answer has {len(citations)} citations\n")
+            continue
+
         conversation_history.append({"role" : "user", "content" : user_input})
 
         try:
 
+            # The answer is streamed, so the timeout bounds the wait between two events instead of the whole answer
             response = requests.post(
                 fastapi_url, 
                 json={"messages" : conversation_history}, 
-                timeout = 20
+                timeout = 20,
+                stream = True
             )
 
-            if response.ok:
+            if response.status_code == 429:
+                answer = "The chatbot is busy, please try again in a moment."
+                print(f"AYF-CHATBOT: {answer}\n")
+                # The unanswered question is not kept in the conversation history
+                conversation_history.pop()
+                continue
 
-                answer, user_intention, citations = response.json()
+            if response.ok:
 
-                # Printing response from chatbot depending on the classified user intention
-                if user_intention == "relevant":
-                    print(f"AYF-CHATBOT: {answer}\ncitations: {citations}\n") 
-                else:
-                    print(f"AYF-CHATBOT: {answer}\n")
+                answer, citations = render_stream(response)
             else:
                 response.raise_for_status()
 
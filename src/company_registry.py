@@ -0,0 +1,150 @@
+import argparse
+import csv
+import json
+import os
+import tempfile
+from functools import lru_cache
+from config import settings
+
+
+class CompanyRegistry:
+    """ Class to map company symbols to their long names using a local JSON file instead of per-lookup network calls. """
+
+    def __init__(self, registry_path : str):
+        """
+        Initializes the CompanyRegistry, loading the registry file if it exists.
+
+        Args:
+            registry_path (str): Path to the JSON file mapping company symbols to long names.
+        """
+        self.registry_path = registry_path
+        self.companies = {}
+
+        if os.path.exists(registry_path):
+            with open(registry_path, 'r') as f:
+                self.companies = json.load(f)
+
+    def get_name(self, symbol : str) -> str:
+        """
+        Returns the long name of a company.
+
+        Args:
+            symbol (str): The company ticker symbol.
+
+        Returns:
+            str: The long name of the company, or the symbol itself if the company is not in the registry.
+        """
+        if symbol not in self.companies:
+            print(f"WARNING: {symbol} is not in the company registry, run `python -m src.company_registry refresh` to add it")
+            return symbol
+
+        return self.companies[symbol]
+
+    def missing_symbols(self, symbols : list[str]) -> list[str]:
+        """
+        Returns the symbols that are not in the registry.
+
+        Args:
+            symbols (list[str]): The company ticker symbols to check.
+
+        Returns:
+            list[str]: The symbols without a registered long name.
+        """
+        return [symbol for symbol in symbols if symbol not in self.companies]
+
+    def bulk_load(self, companies : dict):
+        """
+        Adds or overwrites the long names of several companies and saves the registry.
+
+        Args:
+            companies (dict): Mapping of company symbols to long names.
+        """
+        self.companies.update(companies)
+        self.save()
+
+    def refresh(self, symbols : list[str]) -> list[str]:
+        """
+        Fetches the long names of the given companies from Yahoo Finance and saves them in the registry.
+        Symbols that cannot be fetched (e.g. without network access) keep their current entry.
+
+        Args:
+            symbols (list[str]): The company ticker symbols to refresh.
+
+        Returns:
+            list[str]: The symbols that were refreshed successfully.
+        """
+        import yfinance as yf
+        companies = {}
+
+        for symbol in symbols:
+            try:
+                company_name = yf.Ticker(symbol).info.get("longName")
+            except Exception as e:
+                print(f"WARNING: Failed to fetch the company name of {symbol}: {e}")
+                continue
+
+            if company_name: companies[symbol] = company_name
+
+        self.bulk_load(companies)
+        return list(companies)
+
+    def save(self):
+        """ Atomically writes the registry to disk. """
+        registry_dir = os.path.dirname(self.registry_path) or '.'
+        os.makedirs(registry_dir, exist_ok=True)
+
+        with tempfile.NamedTemporaryFile('w', dir = registry_dir, suffix = '.tmp', delete = False) as f:
+            json.dump(self.companies, f, indent=4, sort_keys=True)
+
+        os.replace(f.name, self.registry_path)
+
+
+@lru_cache
+def get_company_registry(registry_path : str = None) -> CompanyRegistry:
+    """
+    Returns the company registry, loaded once and cached for the life of the process.
+
+    Args:
+        registry_path (str, optional): Path to the registry file. Defaults to the configured company_registry_path.
+
+    Returns:
+        CompanyRegistry: The cached company registry.
+    """
+    return CompanyRegistry(registry_path or settings.company_registry_path)
+
+
+def get_report_symbols(base_input_dir : str) -> list[str]:
+    """
+    Returns the symbols of the companies whose reports have been uploaded.
+
+    Args:
+        base_input_dir (str): Base directory for input data.
+
+    Returns:
+        list[str]: The company symbols, one per folder under the reports directory.
+    """
+    report_dir = os.path.join(base_input_dir, 'reports')
+    return [name for name in os.listdir(report_dir) if os.path.isdir(os.path.join(report_dir, name))]
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description = "Manages the local registry of company symbols and long names.")
+    sub_parsers = arg_parser.add_subparsers(dest = "command", required = True)
+    refresh_parser = sub_parsers.add_parser("refresh", help = "Fetch company names from Yahoo Finance")
+    refresh_parser.add_argument("symbols", nargs = "*", help = "Symbols to refresh. Defaults to every company under the reports directory")
+    load_parser = sub_parsers.add_parser("load", help = "Bulk-load company names from a JSON mapping or a CSV file with symbol,name rows")
+    load_parser.add_argument("input_path")
+    args = arg_parser.parse_args()
+
+    registry = get_company_registry()
+
+    if args.command == "refresh":
+        symbols = args.symbols or get_report_symbols(settings.base_input_dir)
+        refreshed_symbols = registry.refresh(symbols)
+        print(f"Refreshed {len(refreshed_symbols)}/{len(symbols)} companies in {registry.registry_path}")
+    else:
+        with open(args.input_path, 'r') as f:
+            companies = json.load(f) if args.input_path.endswith('.json') else {row[0] : row[1] for row in csv.reader(f) if len(row) >= 2}
+
+        registry.bulk_load(companies)
+        print(f"Loaded {len(companies)} companies into {registry.registry_path}")
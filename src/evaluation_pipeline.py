@@ -218,7 +218,13 @@ if __name__ == "__main__":
         rerank_config=settings.rerank_config,
         generator_config=settings.generator_config,
         lexicalstore_config=settings.lexicalstore_config,
-        ensemble_config=settings.ensemble_config
+        ensemble_config=settings.ensemble_config,
+        chunkstore_path=settings.chunkstore_path,
+        filter_config=settings.filter_config,
+        cache_config=settings.cache_config,
+        manifest_path=settings.ingestion_config.manifest_path,
+        depth_config=settings.depth_config,
+        context_config=settings.context_config
     )
     graph = graph_constructor.compile()
 
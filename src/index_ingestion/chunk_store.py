@@ -0,0 +1,170 @@
+import json
+import os
+import sqlite3
+import threading
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables.config import run_in_executor
+from typing_extensions import Any
+
+# Metadata key holding the chunk id in the documents returned by the retrievers
+CHUNK_ID_KEY = 'chunk_id'
+# Number of chunk ids read per query, below the SQLite limit on bound variables
+READ_BATCH_SIZE = 4096
+
+
+class ChunkStore:
+    """
+    Class to store the text and metadata of every chunk once, in a SQLite database keyed by chunk id. The vector and
+    lexical stores only index chunk ids, and the retrieved chunks are read from here.
+    """
+
+    def __init__(self, chunkstore_path : str, read_only : bool = False):
+        """
+        Initializes the ChunkStore, creating the database if it does not exist.
+
+        Args:
+            chunkstore_path (str): Path to the SQLite database.
+            read_only (bool, optional): Whether to open the database read-only, e.g. in the API workers. Defaults to False.
+        """
+        self.chunkstore_path = chunkstore_path
+        self.read_only = read_only
+        # Each thread gets its own connection, SQLite connections cannot be shared between threads
+        self.local = threading.local()
+
+        if not read_only:
+            os.makedirs(os.path.dirname(chunkstore_path) or '.', exist_ok=True)
+            with self.connect() as connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, page_content TEXT NOT NULL, metadata TEXT NOT NULL)")
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Returns the connection of the current thread, opening it on first use.
+
+        Returns:
+            sqlite3.Connection: The database connection.
+        """
+        connection = getattr(self.local, 'connection', None)
+
+        if connection is None:
+            if self.read_only:
+                connection = sqlite3.connect(f"file:{self.chunkstore_path}?mode=ro", uri = True)
+            else:
+                connection = sqlite3.connect(self.chunkstore_path)
+                # Write-ahead logging lets the API workers read while the ingestion writes
+                connection.execute("PRAGMA journal_mode=WAL")
+            self.local.connection = connection
+
+        return connection
+
+    def add(self, documents : list[Document]):
+        """
+        Adds or replaces chunks.
+
+        Args:
+            documents (list[Document]): The chunks, with their chunk id as document id.
+        """
+        with self.connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO chunks (id, page_content, metadata) VALUES (?, ?, ?)",
+                [(doc.id, doc.page_content, json.dumps(doc.metadata)) for doc in documents]
+            )
+
+    def delete(self, chunk_ids : list[str]):
+        """
+        Deletes chunks.
+
+        Args:
+            chunk_ids (list[str]): Ids of the chunks to delete.
+        """
+        with self.connect() as connection:
+            connection.executemany("DELETE FROM chunks WHERE id = ?", [(chunk_id,) for chunk_id in chunk_ids])
+
+    def clear(self):
+        """ Deletes every chunk. """
+        with self.connect() as connection:
+            connection.execute("DELETE FROM chunks")
+
+    def get(self, chunk_ids : list[str]) -> list[Document]:
+        """
+        Reads chunks by id.
+
+        Args:
+            chunk_ids (list[str]): Ids of the chunks to read.
+
+        Returns:
+            list[Document]: The chunks in the order of the given ids. Unknown ids are skipped.
+        """
+        if len(chunk_ids) == 0: return []
+
+        chunk_ids = list(chunk_ids)
+        docs = {}
+
+        for start in range(0, len(chunk_ids), READ_BATCH_SIZE):
+            batch_ids = chunk_ids[start : start + READ_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch_ids))
+            rows = self.connect().execute(f"SELECT id, page_content, metadata FROM chunks WHERE id IN ({placeholders})", batch_ids).fetchall()
+            docs.update((chunk_id, Document(id = chunk_id, page_content = page_content, metadata = json.loads(metadata))) for chunk_id, page_content, metadata in rows)
+
+        return [docs[chunk_id] for chunk_id in chunk_ids if chunk_id in docs]
+
+    def __len__(self) -> int:
+        return self.connect().execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def close(self):
+        """ Closes the connection of the current thread, e.g. before forking, the next call opens a new one. """
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None: connection.close()
+        self.local = threading.local()
+
+
+def chunk_reference(chunk_id : str, metadata : dict = None) -> Document:
+    """
+    Creates a document referencing a chunk by id, without its text.
+
+    Args:
+        chunk_id (str): The chunk id.
+        metadata (dict, optional): Extra metadata to keep. Defaults to None.
+
+    Returns:
+        Document: A document with an empty content and the chunk id in its metadata.
+    """
+    return Document(id = chunk_id, page_content = "", metadata = {**(metadata or {}), CHUNK_ID_KEY : chunk_id})
+
+
+class ChunkStoreRetriever(BaseRetriever):
+    """ Retriever reading the text and metadata of the chunks returned by a retriever of chunk ids from the chunk store. """
+
+    base_retriever : BaseRetriever
+    """ Retriever returning chunk references. """
+    chunk_store : Any
+    """ The ChunkStore holding the chunks. """
+
+    def _get_relevant_documents(self, query : str, *, run_manager : CallbackManagerForRetrieverRun, **kwargs) -> list[Document]:
+        docs = self.base_retriever.invoke(query, config = {"callbacks" : run_manager.get_child()}, **kwargs)
+        return self.read_chunks(docs)
+
+    async def _aget_relevant_documents(self, query : str, *, run_manager : AsyncCallbackManagerForRetrieverRun, **kwargs) -> list[Document]:
+        # The base async implementation drops the search arguments, e.g. the filters
+        docs = await self.base_retriever.ainvoke(query, config = {"callbacks" : run_manager.get_child()}, **kwargs)
+        return await run_in_executor(None, self.read_chunks, docs)
+
+    def read_chunks(self, docs : list[Document]) -> list[Document]:
+        """
+        Reads the chunks referenced by the documents of the base retriever.
+
+        Args:
+            docs (list[Document]): The chunk references.
+
+        Returns:
+            list[Document]: The chunks, in the order of the references, with the metadata added by the base retriever.
+        """
+        references = {doc.metadata.get(CHUNK_ID_KEY, doc.id) : doc for doc in docs}
+        chunks = self.chunk_store.get(list(references))
+
+        # Metadata added by the retriever, e.g. the fused score, is kept on the chunks
+        for chunk in chunks:
+            chunk.metadata = {**references[chunk.id].metadata, **chunk.metadata}
+
+        return chunks
@@ -0,0 +1,236 @@
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from src.mapper import get_class
+
+# Embedding parameters changing the vectors of a model, included in the cache namespace
+VECTOR_PARAMS = ('dimensions', 'output_dimensionality', 'task_type')
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Class to wrap an embedding model with a persistent, content-addressed cache. Document embeddings are keyed by the
+    embedding model and the hash of the text, and stored as an append-only float32 array file with a key index file.
+    Query embeddings are only kept in a bounded in-memory LRU cache, so serving traffic neither writes to disk nor
+    grows the cache without bound.
+    """
+
+    def __init__(self, embedding : Embeddings, cache_dir : str, namespace : str, query_cache_size : int = 1024):
+        """
+        Initializes the CachedEmbeddings, loading the key index of the cache.
+
+        Args:
+            embedding (Embeddings): The embedding model to call on cache misses.
+            cache_dir (str): Directory of the embedding cache.
+            namespace (str): Name of the embedding model and of its parameters changing the vectors, each is cached in its own sub-directory.
+            query_cache_size (int, optional): Maximum number of query embeddings kept in memory. Defaults to 1024.
+        """
+        self.embedding = embedding
+        self.query_cache_size = query_cache_size
+        self.query_cache = OrderedDict()
+        self.cache_dir = os.path.join(cache_dir, re.sub(r"[^\w.-]+", "_", namespace))
+        self.vectors_path = os.path.join(self.cache_dir, 'vectors.f32')
+        self.keys_path = os.path.join(self.cache_dir, 'keys.txt')
+        self.meta_path = os.path.join(self.cache_dir, 'meta.json')
+        self.hits = self.misses = self.provider_calls = self.saved_calls = 0
+        self.key_index = {}
+        self.dim = None
+        self.vectors = None
+        # Number of bytes of the keys file already read into the key index
+        self.keys_offset = 0
+        # The key index and the vectors are updated together, so a lookup never pairs a new row with the old vectors
+        self.lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.load()
+
+    def load(self):
+        """ Adds the keys appended to the cache since the last load to the key index and memory-maps the cached vectors. """
+        if not os.path.exists(self.meta_path): return
+
+        if self.dim is None:
+            with open(self.meta_path, 'r') as f:
+                self.dim = json.load(f)['dim']
+
+        # Keys are only ever appended, so only the tail of the keys file is read
+        with open(self.keys_path, 'rb') as f:
+            f.seek(self.keys_offset)
+            tail = f.read()
+
+        # A key without its newline is still being written
+        new_keys = tail[:tail.rfind(b'\n') + 1].decode('ascii').split()
+
+        # Vectors are appended before their keys, so rows past the last key belong to an interrupted write and are ignored
+        vectors_size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        num_rows = min(len(self.key_index) + len(new_keys), vectors_size // (4 * self.dim))
+        new_keys = new_keys[:max(0, num_rows - len(self.key_index))]
+        if len(new_keys) == 0 and self.vectors is not None: return
+
+        vectors = np.memmap(self.vectors_path, dtype = np.float32, mode = 'r', shape = (num_rows, self.dim)) if num_rows > 0 else None
+
+        with self.lock:
+            self.key_index.update({key : row for row, key in enumerate(new_keys, start = len(self.key_index))})
+            self.vectors = vectors
+            self.keys_offset += sum(len(key) + 1 for key in new_keys)
+
+    def hash_text(self, text : str, kind : str) -> str:
+        """
+        Computes the cache key of a text.
+
+        Args:
+            text (str): The text to embed.
+            kind (str): 'document' or 'query', since some providers embed documents and queries differently.
+
+        Returns:
+            str: The hexadecimal SHA-256 digest of the kind and text.
+        """
+        return hashlib.sha256(f"{kind}\0{text}".encode('utf-8')).hexdigest()
+
+    def append(self, keys : list[str], vectors : list[list[float]]):
+        """
+        Appends new embeddings to the cache files, locking them so concurrent processes do not interleave their writes.
+
+        Args:
+            keys (list[str]): Cache keys of the embeddings.
+            vectors (list[list[float]]): The embeddings.
+        """
+        vectors = np.asarray(vectors, dtype = np.float32)
+
+        with open(self.keys_path, 'a') as keys_file:
+            fcntl.flock(keys_file, fcntl.LOCK_EX)
+
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self.meta_path, 'w') as f:
+                    json.dump({"dim" : self.dim}, f)
+
+            # Reload the index to pick up the entries other processes appended in the meantime
+            self.load()
+            new_rows = [row for row, key in enumerate(keys) if key not in self.key_index]
+            keys, vectors = [keys[row] for row in new_rows], vectors[new_rows]
+
+            with open(self.vectors_path, 'ab') as vectors_file:
+                # Drop rows of an interrupted write so the new rows line up with their keys
+                vectors_file.truncate(len(self.key_index) * 4 * self.dim)
+                vectors_file.write(vectors.tobytes())
+
+            keys_file.truncate(self.keys_offset)
+            keys_file.write("".join(f"{key}\n" for key in keys))
+            keys_file.flush()
+            self.load()
+
+    def embed_cached_query(self, text : str) -> list[float]:
+        """
+        Embeds a query through the in-memory LRU cache.
+
+        Args:
+            text (str): The query.
+
+        Returns:
+            list[float]: The embedding of the query.
+        """
+        key = self.hash_text(text, 'query')
+
+        with self.lock:
+            vector = self.query_cache.get(key)
+            if vector is not None: self.query_cache.move_to_end(key)
+
+        if vector is not None:
+            self.hits += 1
+            self.saved_calls += 1
+            return list(vector)
+
+        self.misses += 1
+        self.provider_calls += 1
+        vector = self.embedding.embed_query(text)
+
+        with self.lock:
+            self.query_cache[key] = vector
+            if len(self.query_cache) > self.query_cache_size:
+                self.query_cache.popitem(last = False)
+
+        return vector
+
+    def embed(self, texts : list[str], kind : str) -> list[list[float]]:
+        """
+        Embeds documents, only calling the embedding model for the texts that are not cached yet.
+
+        Args:
+            texts (list[str]): The texts to embed.
+            kind (str): 'document', the kind of text keying the cache.
+
+        Returns:
+            list[list[float]]: The embeddings of the texts.
+        """
+        keys = [self.hash_text(text, kind) for text in texts]
+        # Deduplicate the missing texts so each distinct text is only sent to the provider once
+        with self.lock:
+            missing = {key : text for key, text in zip(keys, texts) if key not in self.key_index}
+        num_misses = sum(1 for key in keys if key in missing)
+        self.hits += len(keys) - num_misses
+        self.misses += num_misses
+
+        if len(missing) > 0:
+            self.provider_calls += 1
+            self.append(list(missing), self.embedding.embed_documents(list(missing.values())))
+        else:
+            self.saved_calls += 1
+
+        with self.lock:
+            return [self.vectors[self.key_index[key]].tolist() for key in keys]
+
+    def embed_documents(self, texts : list[str]) -> list[list[float]]:
+        return self.embed(texts, 'document')
+
+    def embed_query(self, text : str) -> list[float]:
+        return self.embed_cached_query(text)
+
+    def get_stats(self) -> dict:
+        """
+        Returns the cache statistics since the cache was loaded.
+
+        Returns:
+            dict: Number of hits, misses, hit rate, embedding provider calls, calls served entirely from the cache, and number of cached document and query embeddings.
+        """
+        lookups = self.hits + self.misses
+
+        return {
+            "hits" : self.hits,
+            "misses" : self.misses,
+            "hit_rate" : self.hits / lookups if lookups > 0 else 0.0,
+            "provider_calls" : self.provider_calls,
+            "saved_calls" : self.saved_calls,
+            "cached_embeddings" : len(self.key_index),
+            "cached_queries" : len(self.query_cache),
+        }
+
+
+def create_embedding(vectorstore_config : dict) -> Embeddings:
+    """
+    Initializes the configured embedding model, wrapped with the embedding cache if an embedding_cache_dir is configured.
+
+    Args:
+        vectorstore_config (dict): Configuration for the vector store.
+
+    Returns:
+        Embeddings: The embedding model.
+    """
+    embedding = get_class('embedding', vectorstore_config.embedding_class)(**vectorstore_config.embedding_params)
+    cache_dir = vectorstore_config.get('embedding_cache_dir')
+
+    if cache_dir is None:
+        return embedding
+
+    # Parameters changing the size or values of the vectors get their own cache, a configuration change never serves stale vectors
+    embedding_params = vectorstore_config.embedding_params
+    namespace = "-".join(
+        [vectorstore_config.embedding_class, str(embedding_params.get('model', 'default'))]
+        + [f"{param}={embedding_params[param]}" for param in VECTOR_PARAMS if embedding_params.get(param) is not None]
+    )
+    return CachedEmbeddings(embedding, cache_dir, namespace, query_cache_size = vectorstore_config.get('query_cache_size', 1024))
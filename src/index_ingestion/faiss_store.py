@@ -0,0 +1,503 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from typing_extensions import Any, Iterable, Optional
+from src.index_ingestion.chunk_store import chunk_reference
+
+# Chunk metadata the search filters apply to, kept for every vector of the index
+FILTER_KEYS = ('company_symbol', 'report_year')
+# Number of vectors added to the index at a time, so the raw vectors are never read into memory at once
+ADD_BATCH_SIZE = 65536
+
+
+def import_faiss():
+    """
+    Imports faiss, which is an optional dependency.
+
+    Raises:
+        Exception: faiss is not installed
+
+    Returns:
+        module: The faiss module.
+    """
+    try:
+        import faiss
+    except ImportError:
+        raise Exception('ERROR: CompressedFAISS requires faiss, install it with `uv sync --extra faiss`')
+
+    return faiss
+
+
+class CompressedFAISS(VectorStore):
+    """
+    Vector store keeping a compressed FAISS index (e.g. IVF or HNSW with product or int8 scalar quantization) on disk,
+    memory-mapped when loaded. The full precision vectors are appended to a raw file as the chunks are ingested and
+    the index is trained and built from them by `build`, since quantizers must be trained before vectors are added.
+    Only the compressed index is read when searching, the raw vectors stay on disk. Every build writes the index
+    and the chunk id and raw vector row of every index position to a new directory, published by atomically replacing
+    a pointer file, so a loaded index never pairs with the ids or vectors of another build. Compacting the raw vectors
+    writes a new raw file, so the rows of the published build stay valid.
+    """
+
+    # Search filters are given as they are, not as a Chroma where clause
+    accepts_search_filters = True
+    # The index is memory-mapped and the SQLite connections are reopened per process, so a loaded store can be shared by forked workers
+    fork_safe = True
+
+    def __init__(self, embedding_function : Embeddings, persist_directory : str, index_factory : str = 'IVF1024,PQ64', metric : str = 'cosine',
+                 nprobe : int = 16, ef_search : int = 64, train_size : int = 100000, compact_ratio : float = 0.2, read_only : bool = False):
+        """
+        Initializes the CompressedFAISS, loading the index if it was built.
+
+        Args:
+            embedding_function (Embeddings): The embedding model of the queries.
+            persist_directory (str): Directory of the builds of the index, raw vectors and chunk ids.
+            index_factory (str, optional): FAISS index factory string, e.g. 'IVF1024,PQ64', 'IVF1024,SQ8' or 'HNSW32,SQ8'. Defaults to 'IVF1024,PQ64'.
+            metric (str, optional): 'cosine' or 'l2'. Defaults to 'cosine'.
+            nprobe (int, optional): Number of inverted lists searched by IVF indexes. Defaults to 16.
+            ef_search (int, optional): Size of the candidate list searched by HNSW indexes. Defaults to 64.
+            train_size (int, optional): Maximum number of vectors sampled to train the index. Defaults to 100000.
+            compact_ratio (float, optional): Fraction of deleted or replaced raw vectors above which the raw file is compacted when building. Defaults to 0.2.
+            read_only (bool, optional): Whether to open the chunk ids read-only, e.g. in the API workers. Defaults to False.
+        """
+        if metric not in ('cosine', 'l2'):
+            raise Exception('ERROR: metric must be cosine or l2')
+
+        self.embedding_function = embedding_function
+        self.persist_directory = persist_directory
+        self.index_factory = index_factory
+        self.metric = metric
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.train_size = train_size
+        self.compact_ratio = compact_ratio
+        self.read_only = read_only
+        self.db_path = os.path.join(persist_directory, 'rows.db')
+        self.vectors_file = 'vectors.f32'
+        self.meta_path = os.path.join(persist_directory, 'meta.json')
+        self.current_path = os.path.join(persist_directory, 'current.json')
+        # Each thread gets its own connection, SQLite connections cannot be shared between threads
+        self.local = threading.local()
+        self.dim = None
+        self.index = None
+        self.position_codes = None
+        self.position_ids = None
+        self.partitions = []
+        # Chunk ids of the published build in sorted order, with their rows in the raw vectors of the build
+        self.sorted_ids = self.sorted_rows = self.build_vectors = None
+
+        if not read_only:
+            os.makedirs(persist_directory, exist_ok = True)
+            with self.connect() as connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS rows (id TEXT PRIMARY KEY, row INTEGER NOT NULL, company_symbol TEXT, report_year TEXT)")
+
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r') as f:
+                meta = json.load(f)
+            self.dim, self.vectors_file = meta['dim'], meta.get('vectors_file', self.vectors_file)
+
+        self.load_index()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding_function
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Returns the connection of the current thread, opening it on first use.
+
+        Returns:
+            sqlite3.Connection: The database connection.
+        """
+        connection = getattr(self.local, 'connection', None)
+
+        if connection is None:
+            if self.read_only:
+                connection = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri = True)
+            else:
+                connection = sqlite3.connect(self.db_path)
+                connection.execute("PRAGMA journal_mode=WAL")
+            self.local.connection = connection
+
+        return connection
+
+    @property
+    def vectors_path(self) -> str:
+        """ Path of the raw vectors file the chunks are appended to. """
+        return os.path.join(self.persist_directory, self.vectors_file)
+
+    def write_meta(self):
+        """ Writes the dimension and the name of the raw vectors file. """
+        with open(f"{self.meta_path}.tmp", 'w') as f:
+            json.dump({"dim" : self.dim, "vectors_file" : self.vectors_file}, f)
+        os.replace(f"{self.meta_path}.tmp", self.meta_path)
+
+    def normalize(self, vectors : np.ndarray) -> np.ndarray:
+        """
+        Normalises vectors to unit length for the cosine metric, which is searched as an inner product.
+
+        Args:
+            vectors (np.ndarray): The vectors.
+
+        Returns:
+            np.ndarray: The float32 vectors, normalised for the cosine metric.
+        """
+        vectors = np.asarray(vectors, dtype = np.float32)
+        if self.metric == 'l2': return vectors
+
+        return vectors / np.maximum(np.linalg.norm(vectors, axis = 1, keepdims = True), 1e-12)
+
+    def raw_vectors(self) -> np.ndarray:
+        """
+        Memory-maps the raw vectors.
+
+        Returns:
+            np.ndarray: The raw vectors, or None if there are none.
+        """
+        num_rows = os.path.getsize(self.vectors_path) // (4 * self.dim) if self.dim is not None and os.path.exists(self.vectors_path) else 0
+        return np.memmap(self.vectors_path, dtype = np.float32, mode = 'r', shape = (num_rows, self.dim)) if num_rows > 0 else None
+
+    def upsert_embeddings(self, ids : list[str], embeddings : list[list[float]], metadatas : list[dict]):
+        """
+        Adds or replaces the raw vectors of chunks. They are searchable once the index is rebuilt with `build`.
+
+        Args:
+            ids (list[str]): The chunk ids.
+            embeddings (list[list[float]]): The chunk embeddings.
+            metadatas (list[dict]): The chunk metadata, holding at least the FILTER_KEYS.
+        """
+        vectors = self.normalize(embeddings)
+
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self.write_meta()
+
+        raw_vectors = self.raw_vectors()
+        start_row = len(raw_vectors) if raw_vectors is not None else 0
+
+        with open(self.vectors_path, 'ab') as f:
+            f.write(vectors.tobytes())
+
+        # A replaced chunk points to its new row, its old row is dropped when the raw file is compacted
+        with self.connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO rows (id, row, company_symbol, report_year) VALUES (?, ?, ?, ?)",
+                [(chunk_id, start_row + offset, *(str(metadata.get(key)) for key in FILTER_KEYS)) for offset, (chunk_id, metadata) in enumerate(zip(ids, metadatas))]
+            )
+
+    def add_texts(self, texts : Iterable[str], metadatas : Optional[list[dict]] = None, ids : Optional[list[str]] = None, **kwargs : Any) -> list[str]:
+        texts = list(texts)
+        ids = ids or [str(row) for row in range(len(texts))]
+        self.upsert_embeddings(ids, self.embedding_function.embed_documents(texts), metadatas or [{}] * len(texts))
+        return ids
+
+    def delete(self, ids : Optional[list[str]] = None, **kwargs : Any):
+        """
+        Deletes chunks. They are removed from the index when it is rebuilt with `build`.
+
+        Args:
+            ids (list[str], optional): Ids of the chunks to delete. Defaults to None.
+        """
+        with self.connect() as connection:
+            connection.executemany("DELETE FROM rows WHERE id = ?", [(chunk_id,) for chunk_id in ids or []])
+
+    def close(self):
+        """ Closes the connection of the current thread, e.g. before forking, the next call opens a new one. """
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None: connection.close()
+        self.local = threading.local()
+
+    def delete_collection(self):
+        """ Deletes the index, the raw vectors and the chunk ids. """
+        self.close()
+        shutil.rmtree(self.persist_directory, ignore_errors = True)
+        self.dim = self.index = self.position_codes = self.position_ids = None
+        self.sorted_ids = self.sorted_rows = self.build_vectors = None
+        self.vectors_file = 'vectors.f32'
+        self.partitions = []
+
+    def compact(self, rows : list[tuple], version : int) -> list[tuple]:
+        """
+        Writes the raw vectors without the rows of deleted or replaced chunks to a new raw file. The previous file is
+        kept while a published build reads from it.
+
+        Args:
+            rows (list[tuple]): The (id, row, company_symbol, report_year) of the live chunks, by row.
+            version (int): Version of the build compacting the raw vectors, naming the new raw file.
+
+        Returns:
+            list[tuple]: The live chunks with their new rows.
+        """
+        raw_vectors = self.raw_vectors()
+        vectors_file = f"vectors_{version}.f32"
+
+        with open(os.path.join(self.persist_directory, vectors_file), 'wb') as f:
+            for start in range(0, len(rows), ADD_BATCH_SIZE):
+                f.write(np.ascontiguousarray(raw_vectors[[row[1] for row in rows[start : start + ADD_BATCH_SIZE]]]).tobytes())
+
+        rows = [(chunk_id, new_row, company_symbol, report_year) for new_row, (chunk_id, _, company_symbol, report_year) in enumerate(rows)]
+
+        with self.connect() as connection:
+            connection.executemany("UPDATE rows SET row = ? WHERE id = ?", [(row, chunk_id) for chunk_id, row, _, _ in rows])
+
+        self.vectors_file = vectors_file
+        self.write_meta()
+        return rows
+
+    def build_paths(self, build_name : str) -> dict:
+        """
+        Returns the paths of the files of a build.
+
+        Args:
+            build_name (str): Name of the build directory.
+
+        Returns:
+            dict: Paths of the index, the partition code and chunk id of every index position, the partitions, and the
+                sorted chunk ids with their raw vector rows.
+        """
+        build_dir = os.path.join(self.persist_directory, build_name)
+        return {
+            "index" : os.path.join(build_dir, 'index.faiss'),
+            "codes" : os.path.join(build_dir, 'position_codes.npy'),
+            "ids" : os.path.join(build_dir, 'position_ids.npy'),
+            "partitions" : os.path.join(build_dir, 'partitions.json'),
+            "sorted_ids" : os.path.join(build_dir, 'sorted_ids.npy'),
+            "sorted_rows" : os.path.join(build_dir, 'sorted_rows.npy')
+        }
+
+    def current_build(self) -> dict:
+        """
+        Reads the pointer to the published build.
+
+        Returns:
+            dict: The version, directory name and raw vectors file of the published build, the directory is None if the index is empty.
+        """
+        if not os.path.exists(self.current_path):
+            return {"version" : 0, "build" : None, "vectors_file" : None}
+
+        with open(self.current_path, 'r') as f:
+            return json.load(f)
+
+    def publish(self, version : int, build_name : str):
+        """
+        Points the loaders to a build by atomically replacing the pointer file, and removes the builds older than the
+        previous one with the raw vectors files only they read. Processes which loaded the previous build keep reading
+        it, and its memory-mapped files stay valid until they are unmapped even when they are removed later.
+
+        Args:
+            version (int): Version of the build.
+            build_name (str): Name of the build directory, None if the index is empty.
+        """
+        previous = self.current_build()
+
+        with open(f"{self.current_path}.tmp", 'w') as f:
+            json.dump({"version" : version, "build" : build_name, "vectors_file" : self.vectors_file}, f)
+        os.replace(f"{self.current_path}.tmp", self.current_path)
+
+        for name in os.listdir(self.persist_directory):
+            if name.startswith('index_') and name not in (build_name, previous['build']):
+                shutil.rmtree(os.path.join(self.persist_directory, name), ignore_errors = True)
+            elif name.startswith('vectors') and name.endswith('.f32') and name not in (self.vectors_file, previous.get('vectors_file')):
+                os.remove(os.path.join(self.persist_directory, name))
+
+    def build(self):
+        """
+        Trains the index on a sample of the live vectors and adds every live vector to it, by batches. Indexes that
+        cannot be trained on so few vectors (e.g. fewer vectors than IVF lists) fall back to an exact flat index.
+        """
+        faiss = import_faiss()
+        rows = self.connect().execute("SELECT id, row, company_symbol, report_year FROM rows ORDER BY row").fetchall()
+        raw_vectors = self.raw_vectors()
+        version = self.current_build()['version'] + 1
+
+        if len(rows) == 0 or raw_vectors is None:
+            self.publish(version, None)
+            self.load_index()
+            return
+
+        if 1 - len(rows) / len(raw_vectors) > self.compact_ratio:
+            rows = self.compact(rows, version)
+            raw_vectors = self.raw_vectors()
+
+        raw_rows = np.array([row[1] for row in rows], dtype = np.int64)
+        metric = faiss.METRIC_INNER_PRODUCT if self.metric == 'cosine' else faiss.METRIC_L2
+        index = faiss.index_factory(self.dim, self.index_factory, metric)
+
+        if not index.is_trained:
+            # Sorted rows keep the sample reads sequential in the memory-mapped file
+            sample = np.sort(np.random.default_rng(0).choice(len(raw_rows), min(self.train_size, len(raw_rows)), replace = False))
+            try:
+                index.train(np.ascontiguousarray(raw_vectors[raw_rows[sample]]))
+            except RuntimeError as e:
+                print(f"WARNING: Cannot train {self.index_factory} on {len(sample)} vectors, building an exact flat index instead: {e}")
+                index = faiss.index_factory(self.dim, 'Flat', metric)
+
+        for start in range(0, len(raw_rows), ADD_BATCH_SIZE):
+            index.add(np.ascontiguousarray(raw_vectors[raw_rows[start : start + ADD_BATCH_SIZE]]))
+
+        partitions = sorted({tuple(row[2:]) for row in rows})
+        partition_codes = {partition : code for code, partition in enumerate(partitions)}
+
+        # The files of the build are written to a new directory, only published once complete
+        build_name = f"index_{version}"
+        paths = self.build_paths(build_name)
+        shutil.rmtree(os.path.dirname(paths['index']), ignore_errors = True)
+        os.makedirs(os.path.dirname(paths['index']))
+
+        faiss.write_index(index, paths['index'])
+        np.save(paths['codes'], np.array([partition_codes[tuple(row[2:])] for row in rows], dtype = np.int32))
+        # Fixed-width strings, so the ids are memory-mapped like the codes instead of unpickled
+        position_ids = np.array([row[0] for row in rows], dtype = str)
+        np.save(paths['ids'], position_ids)
+        # The embeddings of the build are read by chunk id with a binary search on the sorted ids
+        id_order = np.argsort(position_ids)
+        np.save(paths['sorted_ids'], position_ids[id_order])
+        np.save(paths['sorted_rows'], raw_rows[id_order])
+        with open(paths['partitions'], 'w') as f:
+            json.dump([dict(zip(FILTER_KEYS, partition)) for partition in partitions], f)
+
+        self.publish(version, build_name)
+        print(f"Built {self.index_factory} index of {index.ntotal} vectors ({os.path.getsize(paths['index']) / 2 ** 20:.1f} MB)")
+        self.load_index()
+
+    def load_index(self):
+        """
+        Memory-maps the published build of the index with the chunk ids of its positions and the raw vectors it was
+        built from, if it was built. Index types that cannot be memory-mapped are read into memory.
+        """
+        current = self.current_build()
+        build_name = current['build']
+
+        if build_name is None:
+            self.index, self.position_codes, self.position_ids, self.partitions = None, None, None, []
+            self.sorted_ids = self.sorted_rows = self.build_vectors = None
+            return
+
+        faiss = import_faiss()
+        paths = self.build_paths(build_name)
+        try:
+            index = faiss.read_index(paths['index'], faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            index = faiss.read_index(paths['index'])
+
+        position_codes = np.load(paths['codes'], mmap_mode = 'r')
+        position_ids = np.load(paths['ids'], mmap_mode = 'r')
+        with open(paths['partitions'], 'r') as f:
+            partitions = json.load(f)
+
+        sorted_ids = np.load(paths['sorted_ids'], mmap_mode = 'r')
+        sorted_rows = np.load(paths['sorted_rows'], mmap_mode = 'r')
+        vectors_path = os.path.join(self.persist_directory, current.get('vectors_file') or 'vectors.f32')
+        build_vectors = np.memmap(vectors_path, dtype = np.float32, mode = 'r', shape = (os.path.getsize(vectors_path) // (4 * index.d), index.d))
+
+        self.index, self.position_codes, self.position_ids, self.partitions = index, position_codes, position_ids, partitions
+        self.sorted_ids, self.sorted_rows, self.build_vectors = sorted_ids, sorted_rows, build_vectors
+
+    def search_params(self, selector : Any = None, index : Any = None) -> Any:
+        """
+        Builds the search parameters of the index type.
+
+        Args:
+            selector (Any, optional): FAISS id selector restricting the search. Defaults to None.
+            index (Any, optional): The searched index. Defaults to None, the loaded index.
+
+        Returns:
+            faiss.SearchParameters: The search parameters.
+        """
+        faiss = import_faiss()
+        index = index if index is not None else self.index
+
+        if faiss.try_extract_index_ivf(index) is not None:
+            return faiss.SearchParametersIVF(nprobe = self.nprobe, sel = selector)
+        if isinstance(index, faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(efSearch = self.ef_search, sel = selector)
+
+        return faiss.SearchParameters(sel = selector)
+
+    def search_by_vector(self, embedding : list[float], k : int = 4, filter : dict = None) -> list[tuple[Document, float]]:
+        """
+        Searches the index with a query embedding.
+
+        Args:
+            embedding (list[float]): The query embedding.
+            k (int, optional): Number of chunks to return. Defaults to 4.
+            filter (dict, optional): Mapping of FILTER_KEYS to the accepted values. Missing or empty keys accept every value. Defaults to None.
+
+        Returns:
+            list[tuple[Document, float]]: References to the nearest chunks and their similarity (cosine) or distance (l2).
+        """
+        # The files of one build are read together, even if the index is reloaded during the search
+        index, position_codes, position_ids, partitions = self.index, self.position_codes, self.position_ids, self.partitions
+        if index is None or index.ntotal == 0: return []
+
+        faiss = import_faiss()
+        selector = bitmap = None
+
+        if filter:
+            codes = [code for code, partition in enumerate(partitions) if all(not filter.get(key) or partition[key] in filter[key] for key in FILTER_KEYS)]
+            if len(codes) == 0: return []
+
+            if len(codes) < len(partitions):
+                # The bitmap must outlive the search, the selector only keeps a pointer to it
+                bitmap = np.packbits(np.isin(position_codes, codes), bitorder = 'little')
+                selector = faiss.IDSelectorBitmap(index.ntotal, faiss.swig_ptr(bitmap))
+
+        scores, positions = index.search(self.normalize([embedding]), k, params = self.search_params(selector, index))
+
+        return [
+            (chunk_reference(str(position_ids[position]), metadata = dict(partitions[position_codes[position]])), float(score))
+            for position, score in zip(positions[0], scores[0]) if position >= 0
+        ]
+
+    def similarity_search_with_score(self, query : str, k : int = 4, filter : dict = None, **kwargs : Any) -> list[tuple[Document, float]]:
+        return self.search_by_vector(self.embedding_function.embed_query(query), k, filter)
+
+    def similarity_search(self, query : str, k : int = 4, filter : dict = None, **kwargs : Any) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def similarity_search_by_vector(self, embedding : list[float], k : int = 4, filter : dict = None, **kwargs : Any) -> list[Document]:
+        return [doc for doc, _ in self.search_by_vector(embedding, k, filter)]
+
+    def count(self) -> int:
+        """
+        Counts the chunks of the store, including the ones not added to the index yet.
+
+        Returns:
+            int: The number of chunks.
+        """
+        return self.connect().execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+    def get_embeddings(self, ids : list[str]) -> np.ndarray:
+        """
+        Reads the full precision vectors of some chunks from the published build, like the search, so an ingestion which
+        is not published yet never changes them.
+
+        Args:
+            ids (list[str]): The chunk ids.
+
+        Returns:
+            np.ndarray: The vector of every chunk, in the order of the ids. Chunks outside the build get a zero vector.
+        """
+        sorted_ids, sorted_rows, build_vectors = self.sorted_ids, self.sorted_rows, self.build_vectors
+        if build_vectors is None or len(ids) == 0: return np.zeros((len(ids), self.dim or 0), dtype = np.float32)
+
+        ids = np.array(ids, dtype = str)
+        positions = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        found = sorted_ids[positions] == ids
+        vectors = np.zeros((len(ids), build_vectors.shape[1]), dtype = np.float32)
+        vectors[found] = build_vectors[sorted_rows[positions[found]]]
+
+        return vectors
+
+    @classmethod
+    def from_texts(cls, texts : list[str], embedding : Embeddings, metadatas : Optional[list[dict]] = None, ids : Optional[list[str]] = None, **kwargs : Any) -> "CompressedFAISS":
+        vectorstore = cls(embedding_function = embedding, **kwargs)
+        vectorstore.add_texts(texts, metadatas, ids)
+        vectorstore.build()
+        return vectorstore
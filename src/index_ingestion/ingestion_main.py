@@ -2,16 +2,182 @@ from config import settings
 from src.index_ingestion.markdown_chunker import MarkdownChunker
 from src.index_ingestion.marker_parser import MarkerParser
 from src.mapper import get_class
-from src.index_ingestion.utils import get_file_paths, preprocess_text
+from src.company_registry import get_company_registry, get_report_symbols
+from src.index_ingestion.utils import get_file_paths
+from src.index_ingestion.text_utils import preprocess_text
+from src.index_ingestion.report_store import write_parsed_report, load_report_pages, PARSED_REPORT_EXT
+from src.index_ingestion.manifest import IngestionManifest, IngestionCheckpoint, hash_file, hash_config
+from src.index_ingestion.embedding_cache import CachedEmbeddings, create_embedding
+from src.index_ingestion.chunk_store import ChunkStore, CHUNK_ID_KEY, chunk_reference
 import pickle
-import json
 import os
+import time
+import resource
+import multiprocessing
+from itertools import batched, islice
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from langchain_community.retrievers import BM25Retriever
+from rank_bm25 import BM25Okapi
+
+# Chunk metadata kept in the vector store, the rest of the chunk is read from the chunk store
+VECTORSTORE_METADATA_KEYS = (CHUNK_ID_KEY, 'company_symbol', 'report_year')
+# Parser owned by the current worker process of the parsing pool
+_worker_parser = None
+# Chunker owned by the current worker process of the chunking pool
+_worker_chunker = None
+
+def init_parse_worker(parser_config : dict, num_threads : int, max_memory_gb : float = None):
+    """
+    Initializes a parsing worker process with its own parser and a cap on its memory usage.
+
+    Args:
+        parser_config (dict): Configuration for the parser.
+        num_threads (int): Number of threads the worker may use for model inference.
+        max_memory_gb (float, optional): Maximum address space of the worker in GB. Defaults to None (no cap).
+    """
+    global _worker_parser
+    import torch
+
+    if max_memory_gb is not None:
+        max_memory = int(max_memory_gb * 1024 ** 3)
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+
+    # Split the CPU cores between the workers to avoid oversubscription
+    torch.set_num_threads(num_threads)
+    _worker_parser = MarkerParser(parser_config)
+
+def parse_report(report_file : str, parsed_path : str, parser : MarkerParser = None) -> tuple[str, int, float]:
+    """
+    Parses a single report and atomically saves the parsed pages.
+
+    Args:
+        report_file (str): Path to the PDF report.
+        parsed_path (str): Path of the parsed report to write.
+        parser (MarkerParser, optional): Parser to use. Defaults to the parser of the current worker process.
+
+    Returns:
+        tuple[str, int, float]: The report path, the number of parsed pages and the parsing time in seconds.
+    """
+    parser = parser or _worker_parser
+    t0 = time.perf_counter()
+    report_pages = parser.parse(report_file)
+    write_parsed_report(report_pages, parsed_path)
+
+    return report_file, len(report_pages), time.perf_counter() - t0
+
+def init_chunk_worker(chunker : MarkdownChunker):
+    """
+    Initializes a chunking worker process with a copy of the chunker of the main process.
+
+    Args:
+        chunker (MarkdownChunker): The chunker to use in the worker.
+    """
+    global _worker_chunker
+    _worker_chunker = chunker
+
+def chunk_report(parsed_file : str, chunker : MarkdownChunker = None) -> tuple[str, list[Document]]:
+    """
+    Loads a parsed report and chunks it.
+
+    Args:
+        parsed_file (str): Path to the parsed report.
+        chunker (MarkdownChunker, optional): Chunker to use. Defaults to the chunker of the current worker process.
+
+    Returns:
+        tuple[str, list[Document]]: The parsed report path and its chunks.
+    """
+    chunker = chunker or _worker_chunker
+
+    report_pages = load_report_pages(parsed_file)
+
+    return parsed_file, chunker.chunk(report_pages = report_pages, parsed_file = parsed_file)
+
+def update_bm25_retriever(retriever : BM25Retriever, new_docs : list[Document], delete_ids : list[str], new_corpus : list[list[str]] = None) -> BM25Retriever:
+    """
+    Creates a new BM25 retriever from an existing one with some documents removed and new documents added.
+    The kept documents are not tokenised again, their term frequencies are reused from the existing index.
+
+    Args:
+        retriever (BM25Retriever): The existing BM25 retriever.
+        new_docs (list[Document]): The documents to add.
+        delete_ids (list[str]): Ids of the documents to remove.
+        new_corpus (list[list[str]], optional): The tokens of the documents to add, if they were already tokenised. Defaults to None.
+
+    Returns:
+        BM25Retriever: The updated BM25 retriever.
+    """
+    delete_ids = set(delete_ids)
+    vectorizer = retriever.vectorizer
+    kept_idx = [doc_idx for doc_idx, doc in enumerate(retriever.docs) if doc.id not in delete_ids]
+
+    # Expand the stored term frequencies back into token lists, BM25 only depends on the frequencies and not the token order
+    corpus = [[term for term, freq in vectorizer.doc_freqs[doc_idx].items() for _ in range(freq)] for doc_idx in kept_idx]
+    corpus += new_corpus if new_corpus is not None else [retriever.preprocess_func(doc.page_content) for doc in new_docs]
+
+    return BM25Retriever(
+        vectorizer = BM25Okapi(corpus, k1 = vectorizer.k1, b = vectorizer.b, epsilon = vectorizer.epsilon),
+        docs = [retriever.docs[doc_idx] for doc_idx in kept_idx] + new_docs,
+        k = retriever.k,
+        preprocess_func = retriever.preprocess_func
+    )
+
+class BM25RetrieverBuilder:
+    """
+    Class to build or update a pickled BM25Retriever from batches of chunks, like the SparseBM25Builder. Every batch
+    is tokenised when it is added and only its tokens are kept, the retriever references the chunks by id and their
+    text is read from the chunk store.
+    """
+
+    def __init__(self, retriever : BM25Retriever = None, delete_ids : list[str] = None, preprocess_func : callable = preprocess_text, bm25_params : dict = None, **kwargs):
+        """
+        Initializes the BM25RetrieverBuilder.
+
+        Args:
+            retriever (BM25Retriever, optional): The retriever to update. Defaults to None, building a new retriever.
+            delete_ids (list[str], optional): Ids of the chunks to remove from the retriever. Defaults to None.
+            preprocess_func (callable, optional): Function tokenising the chunks. Defaults to preprocess_text.
+            bm25_params (dict, optional): Parameters of BM25Okapi. Defaults to None.
+            **kwargs: Other fields of the retriever, e.g. k.
+        """
+        self.retriever = retriever
+        self.delete_ids = delete_ids or []
+        self.preprocess_func = retriever.preprocess_func if retriever is not None else preprocess_func
+        self.bm25_params = bm25_params or {}
+        self.kwargs = kwargs
+        self.corpus = []
+        self.docs = []
+
+    def add(self, documents : list[Document]):
+        """
+        Tokenises a batch of chunks.
+
+        Args:
+            documents (list[Document]): The chunks, with their chunk id as document id.
+        """
+        self.corpus += [self.preprocess_func(doc.page_content) for doc in documents]
+        self.docs += [chunk_reference(doc.id) for doc in documents]
+
+    def build(self) -> BM25Retriever:
+        """
+        Builds the retriever from the added chunks, or updates the existing retriever with them.
+
+        Returns:
+            BM25Retriever: The built retriever.
+        """
+        if self.retriever is not None:
+            return update_bm25_retriever(self.retriever, self.docs, self.delete_ids, new_corpus = self.corpus)
+
+        return BM25Retriever(vectorizer = BM25Okapi(self.corpus, **self.bm25_params), docs = self.docs, preprocess_func = self.preprocess_func, **self.kwargs)
+
 
 class IndexIngestion:
     """Class to handle the ingestion process of parsing and chunking financial reports for indexing."""
 
-    def __init__(self, parser_config: dict , chunker_config : dict, base_dir : str):
+    def __init__(self, parser_config: dict , chunker_config : dict, base_dir : str, manifest_path : str = 'storage/ingestion_manifest.json'):
         """
         Initializes the IndexIngestion with parser and chunker configurations.
 
@@ -19,6 +185,7 @@ class IndexIngestion:
             parser_config (dict): Configuration for the parser.
             chunker_config (dict): Configuration for the chunker.
             base_dir (str): Base directory containing the reports to be processed.
+            manifest_path (str, optional): Path to the manifest tracking the parsed and indexed version of every report.
         """
         self.parser_config = parser_config
         # Initialize the MarkerParser with the provided configuration
@@ -33,69 +200,394 @@ class IndexIngestion:
         )
 
         self.base_dir = base_dir
+        self.manifest = IngestionManifest(manifest_path)
 
+    def get_parsed_path(self, report_file : str) -> str:
+        """
+        Returns the path of the parsed report of a PDF report.
+
+        Args:
+            report_file (str): Path to the PDF report.
 
-    def parse(self):
-        """ Parses all PDF reports in the specified directory and saves the parsed content as JSON files. """
+        Returns:
+            str: Path to the parsed report under the parsed_reports directory.
+        """
+        dir_name, file_name = os.path.split(report_file)
+        base_name, _ = os.path.splitext(file_name)
+
+        # Create new directory path for parsed reports
+        new_dir = dir_name.replace('reports', 'parsed_reports')
+        return os.path.join(new_dir, base_name + PARSED_REPORT_EXT)
+
+    def parse(self, num_workers : int = 1, max_worker_memory_gb : float = None) -> list[tuple[str, int, float]]:
+        """ 
+        Parses the new and modified PDF reports in the specified directory and saves the parsed content.
+        A report is parsed again only when its content or the parser configuration changed since it was last parsed.
+
+        Args:
+            num_workers (int, optional): Number of worker processes parsing reports in parallel. Defaults to 1 (parse in this process).
+            max_worker_memory_gb (float, optional): Maximum memory of each worker process in GB. Defaults to None (no cap).
+
+        Returns:
+            list[tuple[str, int, float]]: The path, number of pages and parsing time of every parsed report.
+        """
         report_dir = os.path.join(self.base_dir, 'reports')
         report_files = get_file_paths(report_dir, '.pdf')
+        pending_reports = {}
 
-        # Iterate through each report file and parse it
+        # Collect the report files that still need to be parsed
         for report_file in report_files:
+            parsed_path = self.get_parsed_path(report_file)
+            pdf_hash = hash_file(report_file)
+            parse_key = hash_config({"pdf_hash" : pdf_hash, "parser_config" : self.parser.output_config()})
 
-            dir_name, file_name = os.path.split(report_file)
-            base_name, _ = os.path.splitext(file_name)
+            # Skip parsing if the report was already parsed from the same content and configuration
+            if self.manifest.is_parsed(report_file, parse_key): continue
 
-            # Create new directory path for parsed reports
-            new_dir = dir_name.replace('reports', 'parsed_reports')
-            parsed_path = os.path.join(new_dir, base_name + '.json')
+            # Reports parsed before the manifest existed are adopted as they are instead of being parsed again
+            if not self.manifest.get(report_file) and os.path.exists(parsed_path):
+                self.manifest.update(report_file, pdf_hash = pdf_hash, parse_key = parse_key, parsed_path = parsed_path)
+                continue
 
-            # Skip parsing if the parsed file already exists
-            if os.path.exists(parsed_path): continue
+            pending_reports[report_file] = {"pdf_hash" : pdf_hash, "parse_key" : parse_key, "parsed_path" : parsed_path}
 
-            # Parsing the report file using the MarkerParser object
-            report_pages = self.parser.parse(report_file)
-            os.makedirs(new_dir, exist_ok=True)
+        parse_timings = []
 
-            # Save the parsed report pages as a JSON file
-            with open(parsed_path, 'w') as f:
-                json.dump(report_pages, f, indent=4)
+        if num_workers <= 1:
+            # Parse the reports one after another in this process
+            for report_file, entry in pending_reports.items():
+                parse_timing = parse_report(report_file, entry['parsed_path'], self.parser)
+                parse_timings.append(self.log_progress(len(parse_timings), len(pending_reports), parse_timing))
+                self.manifest.update(report_file, **entry)
+                self.manifest.save()
 
-    def chunk(self) -> list[Document]:
+            self.manifest.save()
+            return parse_timings
+
+        num_threads = max(1, os.cpu_count() // num_workers)
+
+        # Spawn fresh worker processes so each one loads its own models instead of inheriting CUDA state from the parent
+        with ProcessPoolExecutor(
+            max_workers = num_workers,
+            mp_context = multiprocessing.get_context('spawn'),
+            initializer = init_parse_worker,
+            initargs = (dict(self.parser_config), num_threads, max_worker_memory_gb)
+        ) as executor:
+            futures = {executor.submit(parse_report, report_file, entry['parsed_path']) : report_file for report_file, entry in pending_reports.items()}
+
+            for future in as_completed(futures):
+                report_file = futures[future]
+
+                try:
+                    parse_timings.append(self.log_progress(len(parse_timings), len(pending_reports), future.result()))
+                    self.manifest.update(report_file, **pending_reports[report_file])
+                    self.manifest.save()
+                except Exception as e:
+                    print(f'ERROR: Failed to parse {report_file}: {e}')
+
+        self.manifest.save()
+        return parse_timings
+    
+    def log_progress(self, idx : int, total : int, parse_timing : tuple[str, int, float]) -> tuple[str, int, float]:
+        """
+        Reports the parsing progress and the timing of a parsed report.
+
+        Args:
+            idx (int): Number of reports parsed before this one.
+            total (int): Total number of reports to parse.
+            parse_timing (tuple[str, int, float]): The report path, number of parsed pages and parsing time in seconds.
+
+        Returns:
+            tuple[str, int, float]: The unchanged parse timing.
+        """
+        report_file, num_pages, elapsed_time = parse_timing
+        print(f"[{idx + 1}/{total}] Parsed {report_file} ({num_pages} pages) in {elapsed_time:.1f}s ({num_pages / elapsed_time:.2f} pages/sec)")
+
+        return parse_timing
+
+    def chunk(self, parsed_files : list[str] = None) -> list[Document]:
         """
         Chunks the parsed reports into smaller segments for indexing.
+
+        Args:
+            parsed_files (list[str], optional): Parsed reports to chunk. Defaults to all the parsed reports.
+
         Returns:
             list[Document]: A list of chunked document segments.
         """
-        parsed_dir = os.path.join(self.base_dir, 'parsed_reports')
-        parsed_files = get_file_paths(parsed_dir, '.json')
-        document_chunks = []
+        if parsed_files is None:
+            parsed_dir = os.path.join(self.base_dir, 'parsed_reports')
+            parsed_files = get_file_paths(parsed_dir, PARSED_REPORT_EXT)
 
-        for parsed_file in parsed_files:
-            with open(parsed_file, 'r') as f:
-                report_pages = json.load(f) 
+        return [chunk for _, chunks in self.iter_chunks(parsed_files) for chunk in chunks]
 
-            chunks = self.chunker.chunk(report_pages = report_pages, parsed_file = parsed_file)
-            document_chunks += chunks
+    def iter_chunks(self, parsed_files : list[str], num_workers : int = 1) -> Iterator[tuple[str, list[Document]]]:
+        """
+        Lazily chunks the parsed reports, optionally in a pool of worker processes. At most two reports per worker are
+        chunked ahead of the consumer, so a slow consumer (e.g. embedding) holds back chunking instead of piling up chunks.
 
-        return document_chunks 
-    
- 
+        Args:
+            parsed_files (list[str]): Parsed reports to chunk.
+            num_workers (int, optional): Number of worker processes chunking reports in parallel. Defaults to 1 (chunk in this process).
+
+        Yields:
+            tuple[str, list[Document]]: The parsed report path and its chunks, in completion order.
+        """
+        if num_workers <= 1:
+            for parsed_file in parsed_files:
+                yield chunk_report(parsed_file, self.chunker)
+            return
+
+        parsed_files = iter(parsed_files)
+
+        with ProcessPoolExecutor(
+            max_workers = num_workers,
+            mp_context = multiprocessing.get_context('spawn'),
+            initializer = init_chunk_worker,
+            initargs = (self.chunker,)
+        ) as executor:
+            pending = {executor.submit(chunk_report, parsed_file) for parsed_file in islice(parsed_files, 2 * num_workers)}
+
+            while pending:
+                done, pending = wait(pending, return_when = FIRST_COMPLETED)
+
+                for future in done:
+                    yield future.result()
+
+                    # Only submit the next report once a chunked report has been consumed
+                    next_file = next(parsed_files, None)
+                    if next_file is not None: pending.add(executor.submit(chunk_report, next_file))
+
+    def index(
+        self, 
+        vectorstore_config : dict, 
+        lexicalstore_config : dict, 
+        batch_size : int = 256, 
+        num_workers : int = 1, 
+        checkpoint_path : str = 'storage/ingestion_checkpoint.json',
+        chunkstore_path : str = 'storage/chunkstore.db'
+    ):
+        """
+        Brings the vector store and lexical store up to date with the parsed reports. Only the reports whose parsed
+        content or chunker configuration changed are re-chunked, and only their chunks are upserted or deleted.
+        The stores are rebuilt from scratch when they do not exist yet or were not built with the manifest.
+
+        The chunks are streamed through the pipeline: reports are chunked in parallel, and the chunks are embedded and
+        written to the vector store in fixed-size batches. A checkpoint is written after every batch, so running the
+        ingestion again after a failure skips the batches that were already written.
+
+        Args:
+            vectorstore_config (dict): Configuration for the vector store.
+            lexicalstore_config (dict): Configuration for the lexical store.
+            batch_size (int, optional): Number of chunks embedded and written to the vector store at a time. Defaults to 256.
+            num_workers (int, optional): Number of worker processes chunking reports in parallel. Defaults to 1.
+            checkpoint_path (str, optional): Path to the checkpoint file of the run.
+            chunkstore_path (str, optional): Path to the chunk store holding the text and metadata of the chunks.
+        """
+        report_dir = os.path.join(self.base_dir, 'reports')
+        report_files = get_file_paths(report_dir, '.pdf')
+        chunker_hash = hash_config(self.chunker_config)
+
+        # Rebuild everything when a store is missing, the lexical store cannot be updated in place, or none of the indexed chunks are tracked by the manifest
+        lexicalstore_cls = get_class('lexicalstore', lexicalstore_config.lexicalstore_class)
+        rebuild = (
+            not os.path.exists(vectorstore_config.vectorstore_path)
+            or not os.path.exists(chunkstore_path)
+            or not os.path.exists(lexicalstore_config.lexicalstore_path)
+            or not (lexicalstore_config.lexicalstore_class == 'BM25Retriever' or hasattr(lexicalstore_cls, 'update'))
+            or not any('index_key' in entry for entry in self.manifest.reports.values())
+        )
+
+        # Find the reports whose chunks are missing or outdated, and the reports that were removed
+        stale_reports = {}
+        for report_file in report_files:
+            entry = self.manifest.get(report_file)
+            # Skip reports that failed to parse
+            if 'parse_key' not in entry: continue
+
+            index_key = hash_config({"parse_key" : entry['parse_key'], "chunker_hash" : chunker_hash})
+            if rebuild or not self.manifest.is_indexed(report_file, index_key):
+                stale_reports[report_file] = index_key
+
+        removed_reports = [report_file for report_file in self.manifest.reports if report_file not in report_files]
+        delete_ids = [chunk_id for report_file in [*stale_reports, *removed_reports] for chunk_id in self.manifest.get(report_file).get('chunk_ids', [])]
+        checkpoint = IngestionCheckpoint(checkpoint_path, hash_config({"stale_reports" : stale_reports, "delete_ids" : delete_ids, "rebuild" : rebuild}))
+
+        print(f"Indexing {len(stale_reports)} new or modified reports and removing {len(removed_reports)} deleted reports")
+        # Fetch the names of newly uploaded companies once, so chunking never has to look them up
+        company_registry = get_company_registry()
+        missing_symbols = company_registry.missing_symbols(get_report_symbols(self.base_dir))
+        if len(missing_symbols) > 0: company_registry.refresh(missing_symbols)
+
+        # Created once so the embedding cache statistics cover the whole run
+        embedding = create_embedding(vectorstore_config)
+        vectorstore = self.load_vectorstore(vectorstore_config, embedding)
+        chunk_store = ChunkStore(chunkstore_path)
+
+        # Reset the collection or delete the outdated chunks, unless the interrupted run being resumed already did it
+        if not checkpoint.prepared:
+            if rebuild:
+                vectorstore.delete_collection()
+                vectorstore = self.load_vectorstore(vectorstore_config, embedding)
+                chunk_store.clear()
+            elif len(delete_ids) > 0:
+                vectorstore.delete(ids = delete_ids)
+                chunk_store.delete(delete_ids)
+
+            checkpoint.mark_prepared()
+
+        parsed_files = {self.manifest.get(report_file)['parsed_path'] : report_file for report_file in stale_reports}
+        report_chunk_ids = {}
+        # Lexical stores supporting it are fed batch by batch, so the chunks of the whole run are never held in memory
+        lexical_builder = self.init_lexical_builder(lexicalstore_config, delete_ids, rebuild, num_workers)
+
+        def stream_chunks() -> Iterator[Document]:
+            # Record the chunk ids of every report while flattening the chunks into a single stream
+            for parsed_file, chunks in self.iter_chunks(list(parsed_files), num_workers):
+                report_chunk_ids[parsed_files[parsed_file]] = [chunk.id for chunk in chunks]
+                yield from chunks
+
+        for batch in batched(stream_chunks(), batch_size):
+            # Every chunk of the run goes to the lexical store, which is only saved once the run completes
+            if lexical_builder is not None: lexical_builder.add(batch)
+            # Skip the chunks written by the interrupted run being resumed
+            batch = [chunk for chunk in batch if chunk.id not in checkpoint.indexed_ids]
+            if len(batch) == 0: continue
+
+            chunk_ids = [chunk.id for chunk in batch]
+            chunk_store.add(batch)
+            self.add_to_vectorstore(vectorstore, embedding, batch)
+            checkpoint.mark_indexed(chunk_ids)
+            print(f"Indexed {len(checkpoint.indexed_ids)} chunks")
+
+        # Compressed indexes are trained on the raw vectors once every chunk is written
+        if hasattr(vectorstore, 'build'):
+            vectorstore.build()
+
+        new_chunk_ids = [chunk_id for chunk_ids in report_chunk_ids.values() for chunk_id in chunk_ids]
+        self.update_lexicalstore(lexicalstore_config, lexical_builder, chunk_store, new_chunk_ids, rebuild)
 
+        # Record the indexed version and chunk ids of every updated report
+        for report_file, index_key in stale_reports.items():
+            self.manifest.update(report_file, index_key = index_key, chunk_ids = report_chunk_ids[report_file])
+
+        for report_file in removed_reports:
+            parsed_path = self.manifest.remove(report_file).get('parsed_path')
+            if parsed_path and os.path.exists(parsed_path): os.remove(parsed_path)
+
+        self.manifest.index_version = hash_config({report_file : entry.get('index_key') for report_file, entry in self.manifest.reports.items()})
+        self.manifest.save()
+        checkpoint.clear()
+
+        if isinstance(embedding, CachedEmbeddings):
+            stats = embedding.get_stats()
+            print(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate), {stats['provider_calls']} provider calls, {stats['saved_calls']} calls saved")
+
+    def load_vectorstore(self, vectorstore_config : dict, embedding : Embeddings):
+        """
+        Opens the persisted vector store with the given embedding model.
+
+        Args:
+            vectorstore_config (dict): Configuration for the vector store.
+            embedding (Embeddings): The embedding model, possibly wrapped with the embedding cache.
+
+        Returns:
+            VectorStore: The vector store.
+        """
+        # Initialize the vectorstore using the specified class and configuration
+        vectorstore_cls = get_class('vectorstore', vectorstore_config.vectorstore_class)
+
+        return vectorstore_cls(embedding_function = embedding, persist_directory=vectorstore_config.vectorstore_path, **vectorstore_config.vectorstore_params)
+
+    def add_to_vectorstore(self, vectorstore : VectorStore, embedding : Embeddings, document_chunks : list[Document]):
+        """
+        Embeds chunks and writes them to the vector store. Only the embeddings and the metadata needed to filter
+        and identify the chunks are stored, the text and full metadata of the chunks live in the chunk store.
+
+        Args:
+            vectorstore (VectorStore): The vector store.
+            embedding (Embeddings): The embedding model.
+            document_chunks (list[Document]): The chunks to write.
+        """
+        chunk_ids = [chunk.id for chunk in document_chunks]
+        embeddings = embedding.embed_documents([chunk.page_content for chunk in document_chunks])
+        metadatas = [{key : chunk.metadata[key] for key in VECTORSTORE_METADATA_KEYS} for chunk in document_chunks]
+
+        if hasattr(vectorstore, 'upsert_embeddings'):
+            vectorstore.upsert_embeddings(chunk_ids, embeddings, metadatas)
+        else:
+            vectorstore._collection.upsert(ids = chunk_ids, embeddings = embeddings, metadatas = metadatas, documents = [""] * len(chunk_ids))
+
+    def init_lexical_builder(self, lexicalstore_config : dict, delete_ids : list[str], rebuild : bool, num_workers : int = 1):
+        """
+        Starts building the lexical store from batches of chunks, for lexical stores providing a builder (e.g. SparseBM25Retriever)
+        and the pickled BM25Retriever.
+
+        Args:
+            lexicalstore_config (dict): Configuration for the lexical store.
+            delete_ids (list[str]): Ids of the chunks to delete.
+            rebuild (bool): Whether to build the lexical store from scratch.
+            num_workers (int, optional): Number of processes tokenising the chunks. Defaults to 1.
+
+        Returns:
+            The builder of the lexical store, or None if the lexical store has no builder.
+        """
+        lexicalstore_cls = get_class('lexicalstore', lexicalstore_config.lexicalstore_class)
+
+        if issubclass(lexicalstore_cls, BM25Retriever):
+            if rebuild:
+                return BM25RetrieverBuilder(preprocess_func = preprocess_text, **lexicalstore_config.lexicalstore_params)
+            with open(lexicalstore_config.lexicalstore_path, 'rb') as f:
+                return BM25RetrieverBuilder(pickle.load(f), delete_ids)
+
+        if not hasattr(lexicalstore_cls, 'builder'):
+            return None
+
+        if rebuild:
+            return lexicalstore_cls.builder(preprocess_func = preprocess_text, num_workers = num_workers, **lexicalstore_config.lexicalstore_params)
+
+        lexicalstore = lexicalstore_cls.load(lexicalstore_config.lexicalstore_path, preprocess_func = preprocess_text, **lexicalstore_config.lexicalstore_params)
+        return lexicalstore_cls.builder(lexicalstore, delete_ids, num_workers = num_workers)
+
+    def update_lexicalstore(self, lexicalstore_config : dict, lexical_builder, chunk_store : ChunkStore, new_chunk_ids : list[str], rebuild : bool):
+        """
+        Updates the lexical store with the new chunks, drops the outdated ones and saves it to disk. Lexical stores
+        with a builder were fed during the run and are saved in their own format, or pickled. The others (e.g. the
+        TFIDFRetriever) hold the text of every chunk anyway, so the new chunks are read back from the chunk store and
+        the store is pickled.
+
+        Args:
+            lexicalstore_config (dict): Configuration for the lexical store.
+            lexical_builder: The builder fed with the chunks of the run, or None if the lexical store has no builder.
+            chunk_store (ChunkStore): The chunk store holding the new chunks.
+            new_chunk_ids (list[str]): Ids of the new or updated chunks.
+            rebuild (bool): Whether to build the lexical store from scratch.
+        """
+        if lexical_builder is not None:
+            lexicalstore = lexical_builder.build()
+            if hasattr(lexicalstore, 'save'):
+                lexicalstore.save(lexicalstore_config.lexicalstore_path)
+                return
+        elif rebuild:
+            lexicalstore_cls = get_class('lexicalstore', lexicalstore_config.lexicalstore_class)
+            lexicalstore = lexicalstore_cls.from_documents(documents = chunk_store.get(new_chunk_ids), preprocess_func = preprocess_text, **lexicalstore_config.lexicalstore_params)
+        else:
+            raise Exception(f'ERROR: {lexicalstore_config.lexicalstore_class} cannot be updated, rebuild the index')
 
+        with open(lexicalstore_config.lexicalstore_path, 'wb') as f:
+            pickle.dump(lexicalstore, f)
 
 if __name__ == "__main__":
     # Initialize the IndexIngestion with configurations from settings
-    ingestion_job = IndexIngestion(parser_config=settings.parser_config, chunker_config=settings.chunker_config, base_dir = settings.base_input_dir)
-    # Run the parsing process
-    ingestion_job.parse()
-    # Run the chunking process and retrieve the document chunks
-    document_chunks = ingestion_job.chunk()
-
-    # Initialize the embedding, vectorstore, and lexicalstore using the specified classes and configurations
-    embedding = get_class('embedding', settings.vectorstore_config.embedding_class)(**settings.vectorstore_config.embedding_params)
-    vectorstore = get_class('vectorstore', settings.vectorstore_config.vectorstore_class).from_documents(documents=document_chunks, embedding = embedding, persist_directory=settings.vectorstore_config.vectorstore_path, **settings.vectorstore_config.vectorstore_params)
-    lexicalstore = get_class('lexicalstore', settings.lexicalstore_config.lexicalstore_class).from_documents(documents = document_chunks,preprocess_func = preprocess_text, **settings.lexicalstore_config.lexicalstore_params)
- 
-    with open( settings.lexicalstore_config.lexicalstore_path, 'wb') as f:
-        pickle.dump(lexicalstore, f)
\ No newline at end of file
+    ingestion_job = IndexIngestion(parser_config=settings.parser_config, chunker_config=settings.chunker_config, base_dir = settings.base_input_dir, manifest_path = settings.ingestion_config.manifest_path)
+    # Run the parsing process on the new and modified reports
+    ingestion_job.parse(num_workers = settings.ingestion_config.num_workers, max_worker_memory_gb = settings.ingestion_config.max_worker_memory_gb)
+    # Chunk the new and modified reports and update the vectorstore and lexicalstore with their chunks
+    ingestion_job.index(
+        vectorstore_config = settings.vectorstore_config, 
+        lexicalstore_config = settings.lexicalstore_config,
+        batch_size = settings.ingestion_config.batch_size,
+        num_workers = settings.ingestion_config.num_workers,
+        checkpoint_path = settings.ingestion_config.checkpoint_path,
+        chunkstore_path = settings.chunkstore_path
+    )
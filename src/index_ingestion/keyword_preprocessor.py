@@ -0,0 +1,100 @@
+from nltk.tokenize import word_tokenize
+from nltk.stem import PorterStemmer
+from nltk.corpus import stopwords
+from functools import lru_cache
+from typing_extensions import Literal
+import string
+import re
+import nltk
+
+# NLTK data used by the preprocessing, by resource name and path in the NLTK data directory
+NLTK_RESOURCES = {'stopwords' : 'corpora/stopwords', 'punkt_tab' : 'tokenizers/punkt_tab'}
+
+# Quotation marks outside string.punctuation that NLTK splits into tokens of their own
+QUOTE_PATTERN = re.compile(r"([«“‘„»”’])")
+# Words that NLTK splits into two tokens (e.g. "cannot" -> "can", "not"), once apostrophes have been removed
+CONTRACTION_PATTERN = re.compile(r"(?i)\b(can)(not)\b|\b(gim)(me)\b|\b(gon)(na)\b|\b(got)(ta)\b|\b(lem)(me)\b|\b(wan)(na)(?=\s|$)")
+
+
+def load_nltk_data(resources : list[str], nltk_data_dir : str = None):
+    """
+    Makes NLTK read its data from a local directory and checks the required data is there, instead of downloading it.
+
+    Args:
+        resources (list[str]): Names of the required resources, keys of NLTK_RESOURCES.
+        nltk_data_dir (str, optional): Local NLTK data directory, searched before NLTK's default directories. Defaults to None.
+
+    Raises:
+        Exception: Some resources are missing
+    """
+    if nltk_data_dir is not None and nltk_data_dir not in nltk.data.path:
+        nltk.data.path.insert(0, nltk_data_dir)
+
+    missing = []
+    for resource in resources:
+        try:
+            nltk.data.find(NLTK_RESOURCES[resource])
+        except LookupError:
+            missing.append(resource)
+
+    if len(missing) > 0:
+        raise Exception(f"ERROR: Missing NLTK data {missing}, install it with `python -m nltk.downloader -d {nltk_data_dir or '<nltk_data_dir>'} {' '.join(missing)}`")
+
+
+class KeywordPreprocessor:
+    """ Class to turn text into BM25 keywords with precomputed lookups, applying lowercasing/punctuation removal, tokenisation, stopword removal and stemming. """
+
+    def __init__(self, tokenizer : Literal['nltk', 'regex'] = 'nltk', stem_cache_size : int = 1 << 16, nltk_data_dir : str = None):
+        """
+        Initializes the KeywordPreprocessor.
+
+        Args:
+            tokenizer (Literal['nltk', 'regex'], optional): 'nltk' tokenises with NLTK's word_tokenize. 'regex' splits on
+                whitespace and applies the quote and contraction rules NLTK uses on punctuation-free text, which is much faster. Defaults to 'nltk'.
+            stem_cache_size (int, optional): Maximum number of distinct tokens whose stems are memoised. Defaults to 65536.
+            nltk_data_dir (str, optional): Local directory of the NLTK stopwords and tokenizer data. Defaults to None, which only searches NLTK's default directories.
+        """
+        if tokenizer not in ('nltk', 'regex'):
+            raise Exception('ERROR: Invalid tokenizer')
+
+        # The regex tokenizer does not need the punkt_tab data
+        load_nltk_data(['stopwords', 'punkt_tab'] if tokenizer == 'nltk' else ['stopwords'], nltk_data_dir)
+
+        self.translation_table = str.maketrans('', '', string.punctuation)
+        self.stop_words = frozenset(stopwords.words('english'))
+        self.tokenize = word_tokenize if tokenizer == 'nltk' else self.regex_tokenize
+        # Stemming is a pure function of the token, and financial text reuses a small vocabulary over and over
+        self.stem = lru_cache(maxsize = stem_cache_size)(PorterStemmer().stem)
+
+    def regex_tokenize(self, text : str) -> list[str]:
+        """
+        Tokenises text whose ASCII punctuation has already been removed.
+
+        Args:
+            text (str): The text to tokenise.
+
+        Returns:
+            list[str]: The tokens of the text.
+        """
+        text = QUOTE_PATTERN.sub(r" \1 ", text)
+        text = CONTRACTION_PATTERN.sub(lambda match : " ".join(group for group in match.groups() if group), text)
+
+        return text.split()
+
+    def __call__(self, text : str) -> list[str]:
+        """
+        Preprocesses a text to generate a list of keywords.
+
+        Args:
+            text (str): The input text to be preprocessed.
+
+        Returns:
+            list[str]: A list of preprocessed keywords from the input text.
+        """
+        # Lowercasing and punctuation removal
+        text = text.strip().lower().translate(self.translation_table)
+        stop_words = self.stop_words
+        stem = self.stem
+
+        # Tokenisation, stopword removal and stemming
+        return [stem(token) for token in self.tokenize(text) if token not in stop_words]
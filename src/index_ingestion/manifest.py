@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+import tempfile
+
+
+def hash_file(file_path : str, block_size : int = 1 << 20) -> str:
+    """
+    Computes the SHA-256 hash of a file's content.
+
+    Args:
+        file_path (str): Path to the file to hash.
+        block_size (int, optional): Number of bytes read at a time. Defaults to 1MB.
+
+    Returns:
+        str: The hexadecimal SHA-256 digest of the file content.
+    """
+    file_hash = hashlib.sha256()
+
+    with open(file_path, 'rb') as f:
+        while block := f.read(block_size):
+            file_hash.update(block)
+
+    return file_hash.hexdigest()
+
+
+def hash_config(*configs : dict) -> str:
+    """
+    Computes a stable hash of one or more configuration dictionaries.
+
+    Args:
+        *configs (dict): The configurations to hash.
+
+    Returns:
+        str: The hexadecimal SHA-256 digest of the serialised configurations.
+    """
+    serialised = json.dumps(configs, sort_keys=True, default=str)
+    return hashlib.sha256(serialised.encode()).hexdigest()
+
+
+class IngestionManifest:
+    """ Class to track which version of every report has been parsed and indexed, so re-runs only process what changed. """
+
+    def __init__(self, manifest_path : str):
+        """
+        Initializes the IngestionManifest, loading the existing manifest file if there is one.
+
+        Args:
+            manifest_path (str): Path to the JSON manifest file.
+        """
+        self.manifest_path = manifest_path
+        self.reports = {}
+        # Hash of the indexed content, changes whenever the chunks in the vector and lexical stores change
+        self.index_version = None
+
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+                self.reports = manifest['reports']
+                self.index_version = manifest.get('index_version')
+
+    def get(self, report_file : str) -> dict:
+        """
+        Returns the manifest entry of a report.
+
+        Args:
+            report_file (str): Path to the PDF report.
+
+        Returns:
+            dict: The manifest entry, or an empty dictionary if the report is not tracked yet.
+        """
+        return self.reports.get(report_file, {})
+
+    def update(self, report_file : str, **fields):
+        """
+        Updates the manifest entry of a report with the given fields.
+
+        Args:
+            report_file (str): Path to the PDF report.
+            **fields: Fields of the entry to set (e.g. pdf_hash, parse_key, index_key, chunk_ids).
+        """
+        self.reports.setdefault(report_file, {}).update(fields)
+
+    def remove(self, report_file : str) -> dict:
+        """
+        Stops tracking a report.
+
+        Args:
+            report_file (str): Path to the PDF report.
+
+        Returns:
+            dict: The removed manifest entry.
+        """
+        return self.reports.pop(report_file, {})
+
+    def is_parsed(self, report_file : str, parse_key : str) -> bool:
+        """
+        Checks whether the report has already been parsed from the same PDF content with the same parser configuration.
+
+        Args:
+            report_file (str): Path to the PDF report.
+            parse_key (str): Hash of the PDF content and parser configuration.
+
+        Returns:
+            bool: True if the parsed report is up to date, False otherwise.
+        """
+        entry = self.get(report_file)
+        return entry.get('parse_key') == parse_key and os.path.exists(entry.get('parsed_path', ''))
+
+    def is_indexed(self, report_file : str, index_key : str) -> bool:
+        """
+        Checks whether the chunks of the report in the vector and lexical stores are up to date.
+
+        Args:
+            report_file (str): Path to the PDF report.
+            index_key (str): Hash of the parse key and chunker configuration.
+
+        Returns:
+            bool: True if the indexed chunks are up to date, False otherwise.
+        """
+        return self.get(report_file).get('index_key') == index_key
+
+    def save(self):
+        """ Atomically writes the manifest to disk. """
+        manifest_dir = os.path.dirname(self.manifest_path) or '.'
+        os.makedirs(manifest_dir, exist_ok=True)
+
+        with tempfile.NamedTemporaryFile('w', dir = manifest_dir, suffix = '.tmp', delete = False) as f:
+            json.dump({"reports" : self.reports, "index_version" : self.index_version}, f, indent=4)
+
+        os.replace(f.name, self.manifest_path)
+
+
+class IngestionCheckpoint:
+    """ Class to record the progress of an indexing run after every batch, so a failed run can resume where it stopped. """
+
+    def __init__(self, checkpoint_path : str, run_key : str):
+        """
+        Initializes the IngestionCheckpoint, resuming the progress of a previous run with the same run key.
+        The checkpoint is an append-only JSON lines file, so recording a batch never rewrites the previous ones.
+
+        Args:
+            checkpoint_path (str): Path to the checkpoint file.
+            run_key (str): Hash identifying the work of the run (reports to index and chunks to delete).
+        """
+        self.checkpoint_path = checkpoint_path
+        self.run_key = run_key
+        self.prepared = False
+        self.indexed_ids = set()
+
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path, 'r') as f:
+                records = [json.loads(line) for line in f if line.strip()]
+
+            # Only resume when the previous run was working on exactly the same reports
+            if len(records) > 0 and records[0].get('run_key') == run_key:
+                for record in records[1:]:
+                    self.prepared = self.prepared or record.get('prepared', False)
+                    self.indexed_ids.update(record.get('indexed_ids', []))
+                return
+
+        os.makedirs(os.path.dirname(checkpoint_path) or '.', exist_ok=True)
+        self.append({"run_key" : run_key}, mode = 'w')
+
+    def append(self, record : dict, mode : str = 'a'):
+        """
+        Durably appends a record to the checkpoint file.
+
+        Args:
+            record (dict): The record to append.
+            mode (str, optional): File mode, 'w' to start a new checkpoint. Defaults to 'a'.
+        """
+        with open(self.checkpoint_path, mode) as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def mark_prepared(self):
+        """ Records that the outdated chunks were deleted (or the stores reset) before the new chunks were added. """
+        self.prepared = True
+        self.append({"prepared" : True})
+
+    def mark_indexed(self, chunk_ids : list[str]):
+        """
+        Records that a batch of chunks was written to the vector store.
+
+        Args:
+            chunk_ids (list[str]): Ids of the written chunks.
+        """
+        self.indexed_ids.update(chunk_ids)
+        self.append({"indexed_ids" : chunk_ids})
+
+    def clear(self):
+        """ Removes the checkpoint once the run has completed. """
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
@@ -1,5 +1,6 @@
 from langchain_core.documents import Document
 import ast
+import os
 from src.mapper import get_class
 from src.index_ingestion.utils import create_chunk, parse_report_path, clean_text
 from dotenv import load_dotenv
@@ -41,68 +42,62 @@ class MarkdownChunker:
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
 
-    def create_chunks(self, report_chunks : list[Document]) -> list[Document]:
+    def create_chunks(self, segments : list[tuple[str, bool, dict]]) -> list[list[tuple[int, int]]]:
         """
-        Merges smaller chunks belonging to the same header section into larger chunks based on the configured chunk size and overlap.
+        Merges smaller segments belonging to the same header section into larger chunks based on the configured chunk size and overlap.
+        Chunks are assembled as (segment index, start offset) spans into the segment texts, so no intermediate strings or
+        documents are created for the merged and overlapping segments.
 
         Args:
-            report_chunks (list[Document]): List of document chunks to be merged.
+            segments (list[tuple[str, bool, dict]]): The (text, starts a header section, page metadata) segments of the report.
 
         Returns:
-            list[Document]: A list of merged document chunks.
+            list[list[tuple[int, int]]]: The spans of each merged chunk. Each span runs from its start offset to the end of its segment.
         """
-        # List to hold the final merged chunks
+        # List to hold the spans of the final merged chunks
         chunks = []
-        # A buffer to hold chunks to be merged together
+        # A buffer to hold the spans to be merged together
         chunk_buffer = []
         # Variable to track the current size of the chunk being formed
         curr_chunk_size = 0
 
-        # Iterate through each chunk in the report
-        for report_chunk in report_chunks:
-            # Checking if the current chunk is the start/continuation of a new header section and if the current chunk size exceeds the configured chunk size
-            if len(report_chunk.metadata.get('headers')) > 0 and curr_chunk_size > self.chunk_size: 
-                # Create a new chunk by merging the buffered chunks
-                chunk = create_chunk(buffer = chunk_buffer)
+        # Iterate through each segment in the report
+        for seg_idx, (seg_text, starts_section, _) in enumerate(segments):
+            # Checking if the current segment is the start/continuation of a new header section and if the current chunk size exceeds the configured chunk size
+            if starts_section and curr_chunk_size > self.chunk_size: 
+                # Close the current chunk with the buffered spans
+                if chunk_buffer: chunks.append(chunk_buffer)
                 # Reset the current chunk size for the next chunk
                 curr_chunk_size = 0
-                overlap_chunks = []
-
-                # If a valid chunk is created, add it to the final chunks list
-                if chunk: chunks.append(chunk)
-
-                # Handle the overlap by adding necessary segments from the end of the current chunk buffer
-                for chunk_segment in chunk_buffer[::-1]:
-                    # Get the length of the current chunk segment
-                    chunk_segment_len = len(chunk_segment.page_content)
-
-                    # Check if adding this segment would exceed the overlap size
-                    if chunk_segment_len + curr_chunk_size >= self.chunk_overlap:
-                        # Calculate the portion of the segment to include for overlap
-                        partial_chunk = Document(
-                            page_content = chunk_segment.page_content[-(self.chunk_overlap - curr_chunk_size):], 
-                            metadata=chunk_segment.metadata
-                        )
-                        # Add the partial chunk to the overlap chunks and update the current chunk size
-                        curr_chunk_size += len(partial_chunk.page_content)
-                        overlap_chunks.append(partial_chunk)
+                overlap_spans = []
+
+                # Handle the overlap by adding necessary spans from the end of the current chunk buffer
+                for span_seg_idx, start in chunk_buffer[::-1]:
+                    span_seg_len = len(segments[span_seg_idx][0])
+                    # Get the length of the current span
+                    span_len = span_seg_len - start
+
+                    # Check if adding this span would exceed the overlap size
+                    if span_len + curr_chunk_size >= self.chunk_overlap:
+                        # Move the start offset so only the portion needed for the overlap is kept (a zero-size remainder keeps the whole span)
+                        remainder = self.chunk_overlap - curr_chunk_size
+                        if remainder > 0: start = max(start, span_seg_len - remainder)
+                        curr_chunk_size += span_seg_len - start
+                        overlap_spans.append((span_seg_idx, start))
                         break
                     else:
-                        # Add the entire segment to the overlap chunks and update the current chunk size
-                        overlap_chunks.append(chunk_segment)
-                        curr_chunk_size += len(chunk_segment.page_content)
+                        # Add the entire span to the overlap spans and update the current chunk size
+                        overlap_spans.append((span_seg_idx, start))
+                        curr_chunk_size += span_len
 
-                # Reverse the overlap chunks to maintain the original order
-                overlap_chunks = overlap_chunks[::-1]
-                # Reset the chunk buffer to start forming the next chunk
-                chunk_buffer = overlap_chunks
+                # Reverse the overlap spans to maintain the original order and start forming the next chunk
+                chunk_buffer = overlap_spans[::-1]
 
-            # Add the current report chunk to the chunk buffer and update the current chunk size
-            chunk_buffer.append(report_chunk)
-            curr_chunk_size += len(report_chunk.page_content)
+            # Add the current segment to the chunk buffer and update the current chunk size
+            chunk_buffer.append((seg_idx, 0))
+            curr_chunk_size += len(seg_text)
 
-        chunk = create_chunk(buffer = chunk_buffer)
-        if chunk: chunks.append(chunk)
+        if chunk_buffer: chunks.append(chunk_buffer)
         return chunks
 
     def chunk(self, report_pages : list, parsed_file : str) -> list[Document]:
@@ -115,10 +110,16 @@ class MarkdownChunker:
         Returns:
             list[Document]: A list of chunked document segments.
         """
-        # List to hold all chunks for the report
-        report_chunks = []
+        # List to hold all the (text, starts a header section, page metadata) segments of the report
+        segments = []
         # Extract metadata from the parsed file path
         symbol, year, company_name = parse_report_path(parsed_file)
+        report_metadata = {
+            "company_name" : company_name, 
+            "company_symbol" : symbol, 
+            "report_year" : year, 
+            "file_path": os.path.splitext(parsed_file)[0] + ".pdf",
+        }
 
         # Process each parsed page in the report
         for page_data in report_pages:
@@ -126,30 +127,12 @@ class MarkdownChunker:
             page_metadata = page_data['page_metadata']
             page_content = clean_text(page_data['page_content'])
 
+            # Split the page content using the configured chunker and keep the text of each split with its page metadata
+            for page_chunk in self.chunker.split_text(page_content):
+                segments.append((page_chunk.page_content.strip(), len(page_chunk.metadata) > 0, page_metadata))
 
-            # Split the page content into chunks using the configured chunker
-            page_chunks = self.chunker.split_text(page_content)
-            
-            # Assign metadata to each chunk of the page
-            for chunk in page_chunks:
-                chunk.metadata = {"headers" : chunk.metadata,  **page_metadata}
-                chunk.page_content = chunk.page_content.strip()
-
-            report_chunks += page_chunks
-
-        # Merge chunks belonging to the same header section to create the list of final chunks
-        chunks = self.create_chunks(report_chunks)
-
-        # Add additional metadata to each final chunk
-        for chunk in chunks:
-            chunk.metadata = {
-                "company_name" : company_name, 
-                "company_symbol" : symbol, 
-                "report_year" : year, 
-                "file_path": parsed_file.replace(".json", ".pdf"),
-                **chunk.metadata
-            }
-            chunk.page_content = f"(Company Name: {company_name} / {symbol}, Company Symbol: Report Year: {year}, Page: {chunk.metadata['page_num']})\n{chunk.page_content}"
-
-        return chunks
-            
\ No newline at end of file
+        # Merge segments belonging to the same header section and materialise the final chunks with their metadata and a stable id
+        return [
+            create_chunk(spans, segments, report_metadata, chunk_id = f"{symbol}/{year}/{chunk_idx}")
+            for chunk_idx, spans in enumerate(self.create_chunks(segments))
+        ]
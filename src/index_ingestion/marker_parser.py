@@ -1,7 +1,7 @@
 import nest_asyncio
 import fitz
 from dotenv import load_dotenv
-from src.index_ingestion.utils import classify_scanned_pdf
+from src.index_ingestion.utils import classify_scanned_pdf, get_page_metadata, split_paginated_markdown, profile_page, page_to_markdown
 from marker.converters.pdf import PdfConverter
 from marker.models import create_model_dict
 import gc
@@ -11,6 +11,26 @@ import torch
 load_dotenv()
 nest_asyncio.apply()    
 
+# Parser configuration keys consumed by MarkerParser itself rather than by the Marker library
+PARSER_KEYS = ('use_model_pool', 'page_batch_size', 'tiered_parsing', 'fast_path_max_img_coverage', 'fast_path_max_table_likelihood')
+
+# Marker model artifacts shared by every parser and converter in the current process
+_artifact_dict = None
+
+def get_artifact_dict() -> dict:
+    """ 
+    Loads the Marker model artifacts (layout, OCR, table recognition, ...) once per process.
+
+    Returns:
+        dict: The cached Marker artifact dictionary.
+    """
+    global _artifact_dict
+
+    if _artifact_dict is None:
+        _artifact_dict = create_model_dict(device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu"))
+
+    return _artifact_dict
+
 class MarkerParser:
     """ Class to handle parsing of PDF documents into markdown pages using Marker library. """
     def __init__(self, parser_config : dict):
@@ -19,8 +39,127 @@ class MarkerParser:
         Args:
             parser_config (dict): Configuration for the Marker parser.
         """
-        self.marker_config = parser_config
-    
+        self.marker_config = {k : v for k, v in parser_config.items() if k not in PARSER_KEYS}
+        # In model pool mode the artifacts and converters are loaded once and reused across pages and documents
+        self.use_model_pool = parser_config.get('use_model_pool', False)
+        self.page_batch_size = parser_config.get('page_batch_size', 8)
+        # In tiered mode (model pool only) born-digital prose pages are extracted with PyMuPDF and only the remaining pages go through Marker
+        self.tiered_parsing = self.use_model_pool and parser_config.get('tiered_parsing', False)
+        self.fast_path_max_img_coverage = parser_config.get('fast_path_max_img_coverage', 0.02)
+        self.fast_path_max_table_likelihood = parser_config.get('fast_path_max_table_likelihood', 0.2)
+        self.converters = {}
+
+    def output_config(self) -> dict:
+        """
+        Returns the settings that affect the parsed output, which are used to detect when reports must be parsed again.
+
+        Returns:
+            dict: The Marker configuration and the tiered parsing settings.
+        """
+        if not self.tiered_parsing:
+            return self.marker_config
+
+        return {
+            **self.marker_config, 
+            "tiered_parsing" : True, 
+            "fast_path_max_img_coverage" : self.fast_path_max_img_coverage,
+            "fast_path_max_table_likelihood" : self.fast_path_max_table_likelihood
+        }
+
+    def get_converter(self, disable_ocr : bool) -> PdfConverter:
+        """
+        Returns the pooled PdfConverter for the given OCR setting, creating it on first use.
+
+        Args:
+            disable_ocr (bool): Whether the converter should skip OCR.
+
+        Returns:
+            PdfConverter: A converter that renders paginated markdown so that batched pages can be split apart.
+        """
+        if disable_ocr not in self.converters:
+            marker_config = {**self.marker_config, 'disable_ocr' : disable_ocr, 'paginate_output' : True}
+            config_parser = ConfigParser(marker_config)
+
+            self.converters[disable_ocr] = PdfConverter(
+                config=config_parser.generate_config_dict(),
+                artifact_dict=get_artifact_dict(),
+                processor_list=config_parser.get_processors(),
+                renderer=config_parser.get_renderer(),
+                llm_service=config_parser.get_llm_service()
+            )
+
+        return self.converters[disable_ocr]
+
+    def group_pages(self, page_idxs : list[int], scanned_page_idx : dict) -> list[tuple[bool, list[int]]]:
+        """
+        Groups consecutive pages that share the same OCR setting into batches of at most `page_batch_size` pages.
+
+        Args:
+            page_idxs (list[int]): Indices of the pages to convert, in page order.
+            scanned_page_idx (dict): Indices of the scanned pages in the document.
+
+        Returns:
+            list[tuple[bool, list[int]]]: A list of (disable_ocr, page indices) batches in page order.
+        """
+        batches = []
+
+        for page_idx in page_idxs:
+            disable_ocr = page_idx not in scanned_page_idx
+
+            # Start a new batch when the OCR setting changes or the current batch is full
+            if len(batches) == 0 or batches[-1][0] != disable_ocr or len(batches[-1][1]) >= self.page_batch_size:
+                batches.append((disable_ocr, []))
+
+            batches[-1][1].append(page_idx)
+
+        return batches
+
+    def is_fast_path_page(self, profile : dict) -> bool:
+        """
+        Decides whether a page is plain born-digital prose that can be extracted directly with PyMuPDF.
+
+        Args:
+            profile (dict): The page profile computed by `profile_page`.
+
+        Returns:
+            bool: True if the page has searchable text and no figures or tables, False otherwise.
+        """
+        return (
+            not profile['is_scanned']
+            and profile['img_coverage'] <= self.fast_path_max_img_coverage
+            and profile['table_likelihood'] <= self.fast_path_max_table_likelihood
+        )
+
+    def convert_batch(self, input_path : str, page_idxs : list[int], disable_ocr : bool) -> list:
+        """
+        Converts a batch of pages to markdown with a pooled converter.
+
+        Args:
+            input_path (str): Path to the PDF document to be parsed.
+            page_idxs (list[int]): Indices of the pages to convert.
+            disable_ocr (bool): Whether OCR should be skipped for these pages.
+
+        Returns:
+            list: A list of dictionaries containing markdown content and metadata for each page in the batch.
+        """
+        converter = self.get_converter(disable_ocr)
+        # The page range is read by the PDF provider on every call, so the converter can be reused for any range
+        converter.config['page_range'] = page_idxs
+
+        md_output = converter(input_path)
+        page_stats = {stat['page_id'] : stat for stat in md_output.metadata['page_stats']}
+        page_contents = split_paginated_markdown(md_output.markdown, page_idxs)
+        md_pages = []
+
+        for page_idx in page_idxs:
+            block_counts = {k : v for [k, v] in page_stats[page_idx]['block_counts']} if page_idx in page_stats else {}
+            md_pages.append({
+                "page_metadata" : get_page_metadata(block_counts, page_idx + 1),
+                "page_content" : page_contents.get(page_idx, "")
+            })
+
+        return md_pages
+
     def parse(self, input_path: str) -> list:
         """ Parses the given PDF document and returns a list of markdown pages.
 
@@ -30,8 +169,84 @@ class MarkerParser:
         Returns:
             list: A list of dictionaries containing markdown content and metadata for each page.
         """
+        if self.use_model_pool:
+            return self.parse_batched(input_path)
         
-        marker_config = self.marker_config
+        return self.parse_per_page(input_path)
+
+    def parse_batched(self, input_path: str) -> list:
+        """ Parses the given PDF document in page batches using the pooled models and converters.
+        In tiered mode, the pages that are plain prose are extracted with PyMuPDF instead of Marker.
+
+        Args:
+            input_path (str): Path to the PDF document to be parsed.
+
+        Returns:
+            list: A list of dictionaries containing markdown content and metadata for each page.
+        """
+        md_pages = []
+        marker_page_idxs = []
+        scanned_page_idx = {}
+        # Open the PDF document using fitz
+        document = fitz.open(input_path)
+
+        # Profile every page once to classify scanned pages and route plain prose pages to the fast path
+        for page_idx, page in enumerate(document):
+            if not self.tiered_parsing:
+                marker_page_idxs.append(page_idx)
+                continue
+
+            profile, text_dict = profile_page(page)
+
+            if self.is_fast_path_page(profile):
+                md_pages.append({
+                    "page_metadata" : get_page_metadata({}, page_idx + 1),
+                    "page_content" : page_to_markdown(text_dict)
+                })
+            else:
+                if profile['is_scanned']: scanned_page_idx[page_idx] = page
+                marker_page_idxs.append(page_idx)
+
+        if not self.tiered_parsing:
+            # Classify scanned pages in the PDF document
+            scanned_page_idx = classify_scanned_pdf(document)
+
+        document.close()
+
+        for disable_ocr, page_idxs in self.group_pages(marker_page_idxs, scanned_page_idx):
+            try:
+                md_pages += self.convert_batch(input_path, page_idxs, disable_ocr)
+            except Exception as e:
+                print(f'ERROR: {e}')
+
+                # Retry the pages one at a time so a single faulty page does not fail the whole batch
+                for page_idx in page_idxs:
+                    try:
+                        md_pages += self.convert_batch(input_path, [page_idx], disable_ocr)
+                    except Exception as e:
+                        print(f'ERROR: {e}')
+                        md_pages.append({
+                            "page_metadata" : get_page_metadata({}, page_idx + 1),
+                            "page_content" : f'ERROR: {e}'
+                        })
+
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+        # Restore the page order after merging the fast path and Marker pages
+        return sorted(md_pages, key = lambda md_page : md_page['page_metadata']['page_num'])
+    
+    def parse_per_page(self, input_path: str) -> list:
+        """ Parses the given PDF document one page at a time, loading a fresh converter and models for every page.
+
+        Args:
+            input_path (str): Path to the PDF document to be parsed.
+
+        Returns:
+            list: A list of dictionaries containing markdown content and metadata for each page.
+        """
+        
+        marker_config = dict(self.marker_config)
         md_pages = []
         # Open the PDF document using fitz
         document = fitz.open(input_path)
@@ -70,13 +285,10 @@ class MarkerParser:
 
                 # Extract block counts from the metadata
                 block_counts = {k : v for [k, v] in md_metadata['page_stats'][0]['block_counts']}
-                # Determine if the page contains tables or images
-                contain_table = any(tag in block_counts for tag in ['Table', 'TableGroup', 'TableOfContents', 'TableCell'])
-                contain_img = any(tag in block_counts for tag in ['Figure', 'FigureGroup', 'Picture', 'PictureGroup'])
 
                 # Append the markdown content and metadata for the current page to the list
                 md_pages.append({
-                    "page_metadata" : {"contain_img" : contain_img, "contain_table" : contain_table, "page_num" : page_idx + 1},
+                    "page_metadata" : get_page_metadata(block_counts, page_idx + 1),
                     "page_content" : md_content
                 })
 
@@ -96,6 +308,3 @@ class MarkerParser:
 
 
         return md_pages
-
-
-    
\ No newline at end of file
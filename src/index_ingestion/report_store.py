@@ -0,0 +1,225 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import tempfile
+from collections.abc import Iterator
+from config import settings
+
+# File extension of the parsed reports
+PARSED_REPORT_EXT = '.pages'
+# Magic bytes identifying the parsed report format and its version
+MAGIC = b'AYFPAGE1'
+# File header: magic bytes and number of pages
+HEADER = struct.Struct('<8sI')
+# Page table entry: content offset, content length in bytes, page number and image/table flags
+PAGE_ENTRY = struct.Struct('<QIIBxxx')
+CONTAIN_IMG = 1
+CONTAIN_TABLE = 2
+
+
+def write_parsed_report(report_pages : list, parsed_path : str):
+    """
+    Saves the parsed report pages in the compact parsed report format. The file holds a fixed-size header, a table
+    with the offset, length and metadata of every page, and the UTF-8 content of all pages. The pages are first written
+    to a temporary file in the same directory which then replaces the target, so an interrupted write never leaves a
+    half-written report behind.
+
+    Args:
+        report_pages (list): The parsed pages of the report.
+        parsed_path (str): Path of the parsed report to write.
+    """
+    parsed_dir = os.path.dirname(parsed_path)
+    os.makedirs(parsed_dir, exist_ok=True)
+
+    contents = [page_data['page_content'].encode('utf-8') for page_data in report_pages]
+    offset = HEADER.size + PAGE_ENTRY.size * len(report_pages)
+
+    with tempfile.NamedTemporaryFile('wb', dir = parsed_dir, suffix = '.tmp', delete = False) as f:
+        f.write(HEADER.pack(MAGIC, len(report_pages)))
+
+        for page_data, content in zip(report_pages, contents):
+            page_metadata = page_data['page_metadata']
+            flags = (CONTAIN_IMG if page_metadata['contain_img'] else 0) | (CONTAIN_TABLE if page_metadata['contain_table'] else 0)
+            f.write(PAGE_ENTRY.pack(offset, len(content), page_metadata['page_num'], flags))
+            offset += len(content)
+
+        for content in contents:
+            f.write(content)
+
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(f.name, parsed_path)
+
+
+class ParsedReport:
+    """ Class to read the pages of a parsed report from a memory-mapped file, one page at a time. """
+
+    def __init__(self, parsed_path : str):
+        """
+        Initializes the ParsedReport by memory-mapping the parsed report file. Only the header is read here,
+        the page table and the page contents are read on access.
+
+        Args:
+            parsed_path (str): Path to the parsed report.
+
+        Raises:
+            Exception: If the file is not a parsed report.
+        """
+        self.parsed_path = parsed_path
+
+        with open(parsed_path, 'rb') as f:
+            # Empty files cannot be memory-mapped
+            self.buffer = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size > 0 else b''
+
+        if len(self.buffer) < HEADER.size:
+            raise Exception(f'ERROR: {parsed_path} is not a parsed report')
+
+        magic, self.num_pages = HEADER.unpack_from(self.buffer, 0)
+
+        if magic != MAGIC:
+            raise Exception(f'ERROR: {parsed_path} is not a parsed report')
+
+    def __len__(self) -> int:
+        return self.num_pages
+
+    def __getitem__(self, page_idx : int) -> dict:
+        """
+        Reads a single page of the report.
+
+        Args:
+            page_idx (int): 0-based index of the page in the report.
+
+        Returns:
+            dict: The page content and metadata, in the same schema as the parser output.
+        """
+        if not 0 <= page_idx < self.num_pages:
+            raise IndexError(page_idx)
+
+        offset, length, page_num, flags = PAGE_ENTRY.unpack_from(self.buffer, HEADER.size + PAGE_ENTRY.size * page_idx)
+
+        return {
+            "page_metadata" : {"contain_img" : bool(flags & CONTAIN_IMG), "contain_table" : bool(flags & CONTAIN_TABLE), "page_num" : page_num},
+            "page_content" : self.buffer[offset : offset + length].decode('utf-8')
+        }
+
+    def __iter__(self) -> Iterator[dict]:
+        for page_idx in range(self.num_pages):
+            yield self[page_idx]
+
+    def get_page(self, page_num : int) -> dict:
+        """
+        Reads the page with the given page number.
+
+        Args:
+            page_num (int): 1-based page number, as stored in the page metadata.
+
+        Returns:
+            dict: The page content and metadata.
+        """
+        # Pages are stored in page order, so the page number is usually the page index plus one
+        page_idx = page_num - 1
+        if 0 <= page_idx < self.num_pages and PAGE_ENTRY.unpack_from(self.buffer, HEADER.size + PAGE_ENTRY.size * page_idx)[2] == page_num:
+            return self[page_idx]
+
+        for page_data in self:
+            if page_data['page_metadata']['page_num'] == page_num:
+                return page_data
+
+        raise IndexError(page_num)
+
+    def close(self):
+        """ Unmaps the parsed report file. """
+        if isinstance(self.buffer, mmap.mmap): self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def load_report_pages(parsed_path : str) -> list:
+    """
+    Loads all the pages of a parsed report, stored either in the parsed report format or in the legacy JSON format.
+
+    Args:
+        parsed_path (str): Path to the parsed report.
+
+    Returns:
+        list: A list of dictionaries containing markdown content and metadata for each page.
+    """
+    if parsed_path.endswith('.json'):
+        with open(parsed_path, 'r') as f:
+            return json.load(f)
+
+    with ParsedReport(parsed_path) as parsed_report:
+        return list(parsed_report)
+
+
+def read_parsed_page(base_dir : str, symbol : str, year : str, page_num : int) -> dict:
+    """
+    Reads a single page of a parsed report, e.g. to display the source of a citation.
+
+    Args:
+        base_dir (str): Base directory containing the parsed reports.
+        symbol (str): The company symbol.
+        year (str): The report year.
+        page_num (int): 1-based page number.
+
+    Returns:
+        dict: The page content and metadata.
+    """
+    parsed_path = os.path.join(base_dir, 'parsed_reports', symbol, f"{year}{PARSED_REPORT_EXT}")
+
+    with ParsedReport(parsed_path) as parsed_report:
+        return parsed_report.get_page(page_num)
+
+
+def convert_json_reports(parsed_dir : str, keep_json : bool = False) -> dict:
+    """
+    Migrates the parsed reports stored as JSON files to the parsed report format.
+
+    Args:
+        parsed_dir (str): Directory containing the parsed JSON reports.
+        keep_json (bool, optional): Whether to keep the JSON files after conversion. Defaults to False.
+
+    Returns:
+        dict: Mapping of the converted JSON paths to the new parsed report paths.
+    """
+    converted_paths = {}
+
+    for root, _, files in os.walk(parsed_dir):
+        for file in files:
+            if not file.endswith('.json'): continue
+
+            json_path = os.path.join(root, file)
+            parsed_path = os.path.splitext(json_path)[0] + PARSED_REPORT_EXT
+            write_parsed_report(load_report_pages(json_path), parsed_path)
+            converted_paths[json_path] = parsed_path
+
+            if not keep_json: os.remove(json_path)
+
+    return converted_paths
+
+
+if __name__ == "__main__":
+    from src.index_ingestion.manifest import IngestionManifest
+
+    arg_parser = argparse.ArgumentParser(description = "Migrates the parsed JSON reports to the compact parsed report format.")
+    arg_parser.add_argument("--parsed-dir", default = os.path.join(settings.base_input_dir, 'parsed_reports'), help = "Directory containing the parsed reports")
+    arg_parser.add_argument("--keep-json", action = "store_true", help = "Keep the JSON files after conversion")
+    args = arg_parser.parse_args()
+
+    converted_paths = convert_json_reports(args.parsed_dir, args.keep_json)
+
+    # Point the manifest to the converted reports so they are not parsed again
+    manifest = IngestionManifest(settings.ingestion_config.manifest_path)
+    for report_file, entry in manifest.reports.items():
+        if entry.get('parsed_path') in converted_paths:
+            manifest.update(report_file, parsed_path = converted_paths[entry['parsed_path']])
+    manifest.save()
+
+    print(f"Converted {len(converted_paths)} parsed reports")
@@ -0,0 +1,328 @@
+import json
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from typing_extensions import Any, Iterable, Optional
+from src.mapper import get_class
+from src.rag_architecture.components.search_filters import to_chroma_where
+
+
+def shard_key(company_symbol : str, report_year : str = None) -> str:
+    """
+    Builds the key of a shard, which is also its directory relative to the sharded store.
+
+    Args:
+        company_symbol (str): The company symbol.
+        report_year (str, optional): The report year, for stores sharded by year. Defaults to None.
+
+    Returns:
+        str: The shard key.
+    """
+    return company_symbol if report_year is None else f"{company_symbol}/{report_year}"
+
+
+class ShardedVectorStore(VectorStore):
+    """
+    Vector store splitting the chunks into one shard per company (optionally per company and report year), each shard
+    being a vector store of its own directory. Ingesting a company only writes and rebuilds its own shards, and a search
+    only fans out to the shards matching the search filters, concurrently, before merging their results into a global top k.
+    """
+
+    # Search filters select the shards, they are converted for the shards when needed
+    accepts_search_filters = True
+    # Forked workers can share the store when the shard class is fork safe as well
+    fork_safe = True
+
+    def __init__(self, embedding_function : Embeddings, persist_directory : str, shard_class : str = 'Chroma', shard_params : dict = None,
+                 shard_by_year : bool = False, max_workers : int = 8, latency_window : int = 1000):
+        """
+        Initializes the ShardedVectorStore, opening the existing shards.
+
+        Args:
+            embedding_function (Embeddings): The embedding model of the queries.
+            persist_directory (str): Directory of the shards.
+            shard_class (str, optional): Name of the vector store class of the shards, from the vectorstore mapping. Defaults to 'Chroma'.
+            shard_params (dict, optional): Parameters of the shards. Defaults to None.
+            shard_by_year (bool, optional): Whether to shard by company and report year instead of by company only. Defaults to False.
+            max_workers (int, optional): Number of shards searched concurrently. Defaults to 8.
+            latency_window (int, optional): Number of recent searches kept for the latency statistics of every shard. Defaults to 1000.
+        """
+        self.embedding_function = embedding_function
+        self.persist_directory = persist_directory
+        self.shard_class = shard_class
+        self.shard_params = dict(shard_params or {})
+        self.shard_by_year = shard_by_year
+        self.shards_path = os.path.join(persist_directory, 'shards.json')
+        self.executor = ThreadPoolExecutor(max_workers = max_workers, thread_name_prefix = 'vector_shard')
+        self.latency_window = latency_window
+        self.lock = threading.Lock()
+        self.shards = {}
+        self.shard_metadata = {}
+        self.latencies = {}
+        self.dirty_shards = set()
+
+        if os.path.exists(self.shards_path):
+            with open(self.shards_path, 'r') as f:
+                for key, metadata in json.load(f).items():
+                    self.open_shard(key, metadata)
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding_function
+
+    def open_shard(self, key : str, metadata : dict) -> VectorStore:
+        """
+        Opens a shard, creating it if it does not exist.
+
+        Args:
+            key (str): The shard key.
+            metadata (dict): The company symbol (and report year) of the shard.
+
+        Returns:
+            VectorStore: The shard.
+        """
+        if key not in self.shards:
+            shard_cls = get_class('vectorstore', self.shard_class)
+            self.shards[key] = shard_cls(embedding_function = self.embedding_function, persist_directory = os.path.join(self.persist_directory, key), **self.shard_params)
+            self.shard_metadata[key] = metadata
+            self.latencies[key] = deque(maxlen = self.latency_window)
+
+        return self.shards[key]
+
+    def save_shards(self):
+        """ Writes the list of shards. """
+        os.makedirs(self.persist_directory, exist_ok = True)
+        with open(self.shards_path, 'w') as f:
+            json.dump(self.shard_metadata, f, indent = 2)
+
+    def key_of_chunk(self, chunk_id : str) -> str:
+        """
+        Finds the shard of a chunk from its id, '{symbol}/{year}/{index}'.
+
+        Args:
+            chunk_id (str): The chunk id.
+
+        Returns:
+            str: The shard key.
+        """
+        company_symbol, report_year, _ = chunk_id.split('/')
+        return shard_key(company_symbol, report_year if self.shard_by_year else None)
+
+    def upsert_embeddings(self, ids : list[str], embeddings : list[list[float]], metadatas : list[dict]):
+        """
+        Adds or replaces the embeddings of chunks in their shards.
+
+        Args:
+            ids (list[str]): The chunk ids.
+            embeddings (list[list[float]]): The chunk embeddings.
+            metadatas (list[dict]): The chunk metadata, holding at least the company symbol and report year.
+        """
+        groups = {}
+        for chunk_id, embedding, metadata in zip(ids, embeddings, metadatas):
+            shard_metadata = {"company_symbol" : metadata['company_symbol']}
+            if self.shard_by_year: shard_metadata['report_year'] = metadata['report_year']
+            key = shard_key(*shard_metadata.values())
+            groups.setdefault(key, (shard_metadata, []))[1].append((chunk_id, embedding, metadata))
+
+        new_shards = [key for key in groups if key not in self.shards]
+
+        for key, (shard_metadata, chunks) in groups.items():
+            shard = self.open_shard(key, shard_metadata)
+            chunk_ids, shard_embeddings, shard_metadatas = map(list, zip(*chunks))
+
+            if hasattr(shard, 'upsert_embeddings'):
+                shard.upsert_embeddings(chunk_ids, shard_embeddings, shard_metadatas)
+            else:
+                shard._collection.upsert(ids = chunk_ids, embeddings = shard_embeddings, metadatas = shard_metadatas, documents = [""] * len(chunk_ids))
+
+            self.dirty_shards.add(key)
+
+        if len(new_shards) > 0: self.save_shards()
+
+    def add_texts(self, texts : Iterable[str], metadatas : Optional[list[dict]] = None, ids : Optional[list[str]] = None, **kwargs : Any) -> list[str]:
+        texts = list(texts)
+        self.upsert_embeddings(ids, self.embedding_function.embed_documents(texts), metadatas)
+        return ids
+
+    def delete(self, ids : Optional[list[str]] = None, **kwargs : Any):
+        """
+        Deletes chunks from their shards.
+
+        Args:
+            ids (list[str], optional): Ids of the chunks to delete. Defaults to None.
+        """
+        groups = {}
+        for chunk_id in ids or []:
+            groups.setdefault(self.key_of_chunk(chunk_id), []).append(chunk_id)
+
+        for key, chunk_ids in groups.items():
+            if key not in self.shards: continue
+            self.shards[key].delete(ids = chunk_ids)
+            self.dirty_shards.add(key)
+
+    def close(self):
+        """ Closes the connections of the shards, e.g. before forking. """
+        for shard in self.shards.values():
+            if hasattr(shard, 'close'): shard.close()
+
+    def delete_collection(self):
+        """ Deletes every shard. """
+        for shard in self.shards.values():
+            shard.delete_collection()
+
+        shutil.rmtree(self.persist_directory, ignore_errors = True)
+        self.shards, self.shard_metadata, self.latencies, self.dirty_shards = {}, {}, {}, set()
+
+    def build(self):
+        """ Builds the shards changed since the last build, for shard classes that need a build step (e.g. CompressedFAISS). """
+        for key in sorted(self.dirty_shards):
+            if hasattr(self.shards[key], 'build'):
+                print(f"Building vector shard {key}")
+                self.shards[key].build()
+
+        self.dirty_shards = set()
+
+    def match_shards(self, filter : dict = None) -> list[str]:
+        """
+        Finds the shards matching the search filters.
+
+        Args:
+            filter (dict, optional): Mapping of the company_symbol and report_year metadata to the accepted values. Defaults to None.
+
+        Returns:
+            list[str]: The keys of the matching shards.
+        """
+        filter = filter or {}
+        return [
+            key for key, metadata in self.shard_metadata.items()
+            if all(not filter.get(name) or value in filter[name] for name, value in metadata.items())
+        ]
+
+    def search_shard(self, key : str, embedding : list[float], k : int, filter : dict = None) -> list[tuple[Document, float]]:
+        """
+        Searches a shard and measures its latency.
+
+        Args:
+            key (str): The shard key.
+            embedding (list[float]): The query embedding.
+            k (int): Number of chunks to return.
+            filter (dict, optional): The search filters. Defaults to None.
+
+        Returns:
+            list[tuple[Document, float]]: The nearest chunks and their similarity, higher is better.
+        """
+        shard = self.shards[key]
+        t0 = time.perf_counter()
+
+        if getattr(shard, 'accepts_search_filters', False):
+            results = shard.search_by_vector(embedding, k, filter)
+            # Distances of an l2 index are turned into similarities so the shards can be merged by decreasing score
+            if getattr(shard, 'metric', 'cosine') == 'l2': results = [(doc, -score) for doc, score in results]
+        else:
+            # Chroma returns distances, lower is better
+            results = shard.similarity_search_by_vector_with_relevance_scores(embedding, k = k, filter = to_chroma_where(filter or {}))
+            results = [(doc, -distance) for doc, distance in results]
+
+        with self.lock:
+            self.latencies[key].append(time.perf_counter() - t0)
+
+        return results
+
+    def search_by_vector(self, embedding : list[float], k : int = 4, filter : dict = None) -> list[tuple[Document, float]]:
+        """
+        Searches the shards matching the search filters concurrently and merges their results.
+
+        Args:
+            embedding (list[float]): The query embedding.
+            k (int, optional): Number of chunks to return. Defaults to 4.
+            filter (dict, optional): The search filters. Defaults to None.
+
+        Returns:
+            list[tuple[Document, float]]: The k nearest chunks over every matching shard and their similarity.
+        """
+        futures = [self.executor.submit(self.search_shard, key, embedding, k, filter) for key in self.match_shards(filter)]
+        results = [result for future in futures for result in future.result()]
+        scores = np.array([score for _, score in results])
+
+        # Every shard returns its own top k, so the global top k is among them
+        top = np.argsort(-scores, kind = 'stable')[:k] if len(results) > 0 else []
+        return [results[idx] for idx in top]
+
+    def similarity_search_with_score(self, query : str, k : int = 4, filter : dict = None, **kwargs : Any) -> list[tuple[Document, float]]:
+        # The query is embedded once for every shard
+        return self.search_by_vector(self.embedding_function.embed_query(query), k, filter)
+
+    def similarity_search(self, query : str, k : int = 4, filter : dict = None, **kwargs : Any) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def similarity_search_by_vector(self, embedding : list[float], k : int = 4, filter : dict = None, **kwargs : Any) -> list[Document]:
+        return [doc for doc, _ in self.search_by_vector(embedding, k, filter)]
+
+    def get_embeddings(self, ids : list[str]) -> np.ndarray:
+        """
+        Reads the stored embeddings of some chunks from their shards.
+
+        Args:
+            ids (list[str]): The chunk ids.
+
+        Returns:
+            np.ndarray: The embedding of every chunk, in the order of the ids. Unknown chunks get a zero vector.
+        """
+        stored_embeddings = {}
+        groups = {}
+        for chunk_id in ids:
+            groups.setdefault(self.key_of_chunk(chunk_id), []).append(chunk_id)
+
+        for key, chunk_ids in groups.items():
+            if key not in self.shards: continue
+            shard = self.shards[key]
+
+            if hasattr(shard, 'get_embeddings'):
+                stored_embeddings.update(zip(chunk_ids, shard.get_embeddings(chunk_ids)))
+            else:
+                stored = shard.get(ids = chunk_ids, include = ['embeddings'])
+                stored_embeddings.update(zip(stored['ids'], stored['embeddings']))
+
+        dim = len(next(iter(stored_embeddings.values()))) if len(stored_embeddings) > 0 else 0
+        embeddings = np.zeros((len(ids), dim), dtype = np.float32)
+
+        for row, chunk_id in enumerate(ids):
+            if chunk_id in stored_embeddings: embeddings[row] = stored_embeddings[chunk_id]
+
+        return embeddings
+
+    def get_shard_stats(self) -> dict:
+        """
+        Returns the size and latency statistics of every shard.
+
+        Returns:
+            dict: For every shard, the number of chunks, the number of recent searches and their mean and 95th percentile latency in milliseconds.
+        """
+        stats = {}
+
+        for key, shard in self.shards.items():
+            with self.lock:
+                latencies = sorted(self.latencies[key])
+
+            stats[key] = {
+                "chunks" : shard.count() if hasattr(shard, 'count') else shard._collection.count(),
+                "searches" : len(latencies),
+                "mean_ms" : 1000 * sum(latencies) / len(latencies) if latencies else None,
+                "p95_ms" : 1000 * latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] if latencies else None,
+            }
+
+        return stats
+
+    @classmethod
+    def from_texts(cls, texts : list[str], embedding : Embeddings, metadatas : Optional[list[dict]] = None, ids : Optional[list[str]] = None, **kwargs : Any) -> "ShardedVectorStore":
+        vectorstore = cls(embedding_function = embedding, **kwargs)
+        vectorstore.add_texts(texts, metadatas, ids)
+        vectorstore.build()
+        return vectorstore
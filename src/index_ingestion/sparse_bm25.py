@@ -0,0 +1,664 @@
+import json
+import math
+import multiprocessing
+import os
+import shutil
+from collections import Counter
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables.config import run_in_executor
+from langchain_community.retrievers.bm25 import default_preprocessing_func
+from src.index_ingestion.chunk_store import chunk_reference
+from pydantic import ConfigDict, PrivateAttr
+from typing_extensions import Any
+
+# Arrays of the index, persisted as .npy files and memory-mapped when loaded
+INDEX_ARRAYS = ('indptr', 'doc_idx', 'term_freqs', 'weights', 'doc_lens')
+# Chunk metadata the documents are partitioned by, so filtered queries only score the matching partitions
+PARTITION_KEYS = ('company_symbol', 'report_year')
+
+
+def create_tokenize_pool(num_workers : int) -> ProcessPoolExecutor:
+    """
+    Creates the pool of worker processes tokenising the texts.
+
+    Args:
+        num_workers (int): Number of worker processes.
+
+    Returns:
+        ProcessPoolExecutor: The pool.
+    """
+    return ProcessPoolExecutor(max_workers = num_workers, mp_context = multiprocessing.get_context('spawn'))
+
+
+def tokenize_corpus(texts : list[str], preprocess_func : Callable[[str], list[str]], num_workers : int = 1, executor : ProcessPoolExecutor = None) -> list[list[str]]:
+    """
+    Tokenises the texts of a corpus, in parallel worker processes when num_workers > 1.
+
+    Args:
+        texts (list[str]): The texts to tokenise.
+        preprocess_func (Callable[[str], list[str]]): Function turning a text into keywords. Must be a module-level function to be sent to the workers.
+        num_workers (int, optional): Number of worker processes. Defaults to 1.
+        executor (ProcessPoolExecutor, optional): Pool of num_workers processes reused across calls. Defaults to None, starting a pool for this call.
+
+    Returns:
+        list[list[str]]: The keywords of every text.
+    """
+    if num_workers <= 1 or len(texts) < 2 * num_workers:
+        return [preprocess_func(text) for text in texts]
+
+    chunksize = max(1, len(texts) // (num_workers * 4))
+    if executor is not None:
+        return list(executor.map(preprocess_func, texts, chunksize = chunksize))
+
+    with create_tokenize_pool(num_workers) as executor:
+        return list(executor.map(preprocess_func, texts, chunksize = chunksize))
+
+
+def group_partitions(partition_values : list[tuple]) -> tuple[np.ndarray, list[dict]]:
+    """
+    Groups documents by partition, keeping the partitions in order of first appearance and the documents of a
+    partition in their original order.
+
+    Args:
+        partition_values (list[tuple]): The PARTITION_KEYS metadata values of every document.
+
+    Returns:
+        tuple[np.ndarray, list[dict]]: The document order making every partition contiguous, and the metadata values
+            and [start, end) document range of every partition in that order.
+    """
+    groups = {}
+    for doc_pos, values in enumerate(partition_values):
+        groups.setdefault(tuple(values), []).append(doc_pos)
+
+    order = np.array([doc_pos for positions in groups.values() for doc_pos in positions], dtype = np.int64)
+    partitions, start = [], 0
+    for values, positions in groups.items():
+        partitions.append({**dict(zip(PARTITION_KEYS, values)), "start" : start, "end" : start + len(positions)})
+        start += len(positions)
+
+    return order, partitions
+
+
+class BM25Index:
+    """
+    Class implementing BM25Okapi over a term-major CSR matrix: for every term, the ids of the documents containing it,
+    the term frequencies and the precomputed BM25 weights. Scoring a query only touches the postings of its terms.
+    """
+
+    def __init__(self, terms : list[str], indptr : np.ndarray, doc_idx : np.ndarray, term_freqs : np.ndarray, doc_lens : np.ndarray,
+                 k1 : float = 1.5, b : float = 0.75, epsilon : float = 0.25, weights : np.ndarray = None):
+        """
+        Initializes the BM25Index from its postings, computing the BM25 weights if they are not given.
+
+        Args:
+            terms (list[str]): The vocabulary, the position of a term is its row in the CSR matrix.
+            indptr (np.ndarray): Offsets of the postings of every term, of length len(terms) + 1.
+            doc_idx (np.ndarray): Document index of every posting.
+            term_freqs (np.ndarray): Frequency of the term in the document of every posting.
+            doc_lens (np.ndarray): Number of keywords of every document.
+            k1 (float, optional): BM25 term frequency saturation. Defaults to 1.5.
+            b (float, optional): BM25 document length normalisation. Defaults to 0.75.
+            epsilon (float, optional): Fraction of the average idf given to terms with a negative idf. Defaults to 0.25.
+            weights (np.ndarray, optional): Precomputed BM25 weight of every posting. Defaults to None.
+        """
+        self.terms = terms
+        self.vocab = {term : term_id for term_id, term in enumerate(terms)}
+        self.indptr = indptr
+        self.doc_idx = doc_idx
+        self.term_freqs = term_freqs
+        self.doc_lens = doc_lens
+        self.k1, self.b, self.epsilon = k1, b, epsilon
+        self.num_docs = len(doc_lens)
+        self.avgdl = int(doc_lens.sum()) / self.num_docs if self.num_docs > 0 else 0.0
+        self.weights = self.compute_weights() if weights is None else weights
+
+    @classmethod
+    def from_postings(cls, terms : list[str], term_ids : np.ndarray, doc_idx : np.ndarray, term_freqs : np.ndarray, doc_lens : np.ndarray, **bm25_params) -> "BM25Index":
+        """
+        Builds the BM25Index from unordered (term, document, frequency) postings. Terms without postings are dropped.
+
+        Args:
+            terms (list[str]): The vocabulary indexed by term_ids.
+            term_ids (np.ndarray): Term id of every posting.
+            doc_idx (np.ndarray): Document index of every posting.
+            term_freqs (np.ndarray): Term frequency of every posting.
+            doc_lens (np.ndarray): Number of keywords of every document.
+            **bm25_params: k1, b and epsilon.
+
+        Returns:
+            BM25Index: The index.
+        """
+        # Drop the terms that no longer occur in any document, they do not count towards the average idf
+        term_counts = np.bincount(term_ids, minlength = len(terms))
+        present = term_counts > 0
+        term_ids = (np.cumsum(present) - 1)[term_ids]
+        terms = [term for term, is_present in zip(terms, present) if is_present]
+
+        order = np.lexsort((doc_idx, term_ids))
+        indptr = np.zeros(len(terms) + 1, dtype = np.int64)
+        np.cumsum(term_counts[present], out = indptr[1:])
+
+        return cls(terms, indptr, doc_idx[order].astype(np.int32), term_freqs[order].astype(np.int32), doc_lens.astype(np.int32), **bm25_params)
+
+    @classmethod
+    def from_corpus(cls, corpus : list[list[str]], **bm25_params) -> "BM25Index":
+        """
+        Builds the BM25Index from tokenised documents.
+
+        Args:
+            corpus (list[list[str]]): The keywords of every document.
+            **bm25_params: k1, b and epsilon.
+
+        Returns:
+            BM25Index: The index.
+        """
+        return cls.from_postings(*cls.corpus_postings(corpus, {}, 0), **bm25_params)
+
+    @staticmethod
+    def corpus_postings(corpus : list[list[str]], vocab : dict, doc_offset : int) -> tuple:
+        """
+        Counts the term frequencies of tokenised documents, adding their new terms to the vocabulary.
+
+        Args:
+            corpus (list[list[str]]): The keywords of every document.
+            vocab (dict): Mapping of terms to term ids, updated in place.
+            doc_offset (int): Index of the first document.
+
+        Returns:
+            tuple: The vocabulary terms, and the term ids, document indices and term frequencies of the postings, and the document lengths.
+        """
+        term_ids, doc_idx, term_freqs = [], [], []
+
+        for doc_pos, tokens in enumerate(corpus, start = doc_offset):
+            for term, freq in Counter(tokens).items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                doc_idx.append(doc_pos)
+                term_freqs.append(freq)
+
+        return (
+            list(vocab),
+            np.array(term_ids, dtype = np.int64),
+            np.array(doc_idx, dtype = np.int64),
+            np.array(term_freqs, dtype = np.int64),
+            np.array([len(tokens) for tokens in corpus], dtype = np.int64),
+        )
+
+    def compute_weights(self) -> np.ndarray:
+        """
+        Computes the BM25Okapi weight of every posting, in the same floating point order as rank_bm25 so the scores are identical.
+
+        Returns:
+            np.ndarray: The weight of every posting.
+        """
+        doc_freqs = np.diff(self.indptr).tolist()
+        idf = [math.log(self.num_docs - doc_freq + 0.5) - math.log(doc_freq + 0.5) for doc_freq in doc_freqs]
+
+        # Terms occurring in more than half of the documents have a negative idf, which is floored to a fraction of the average idf
+        if len(idf) > 0:
+            eps = self.epsilon * (sum(idf) / len(idf))
+            idf = [eps if term_idf < 0 else term_idf for term_idf in idf]
+
+        posting_idf = np.repeat(np.array(idf, dtype = np.float64), doc_freqs)
+        tf = self.term_freqs.astype(np.float64)
+        doc_lens = self.doc_lens[self.doc_idx].astype(np.float64)
+
+        return posting_idf * (tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * doc_lens / self.avgdl)))
+
+    def get_scores(self, query : list[str]) -> np.ndarray:
+        """
+        Scores every document against the query keywords.
+
+        Args:
+            query (list[str]): The query keywords, repeated keywords count multiple times.
+
+        Returns:
+            np.ndarray: The BM25 score of every document.
+        """
+        scores = np.zeros(self.num_docs)
+
+        for term in query:
+            term_id = self.vocab.get(term)
+            if term_id is None: continue
+
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            # A document occurs at most once in the postings of a term, so the scatter-add has no duplicate indices
+            scores[self.doc_idx[start:end]] += self.weights[start:end]
+
+        return scores
+
+    def get_range_scores(self, query : list[str], doc_ranges : list[tuple[int, int]]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Scores the documents of some document ranges against the query keywords. Only the postings falling in the
+        ranges are read, they are located by binary search since the postings of a term are sorted by document.
+
+        Args:
+            query (list[str]): The query keywords, repeated keywords count multiple times.
+            doc_ranges (list[tuple[int, int]]): Sorted, non-overlapping [start, end) ranges of documents to score.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Indices of the documents in the ranges, and their BM25 scores.
+        """
+        candidates = np.concatenate([np.arange(start, end) for start, end in doc_ranges]) if len(doc_ranges) > 0 else np.zeros(0, dtype = np.int64)
+        offsets = np.cumsum([0] + [end - start for start, end in doc_ranges])
+        scores = np.zeros(len(candidates))
+
+        for term in query:
+            term_id = self.vocab.get(term)
+            if term_id is None: continue
+
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            term_docs = self.doc_idx[start:end]
+
+            for (range_start, range_end), offset in zip(doc_ranges, offsets):
+                lo, hi = np.searchsorted(term_docs, [range_start, range_end])
+                scores[term_docs[lo:hi] - range_start + offset] += self.weights[start + lo : start + hi]
+
+        return candidates, scores
+
+    def top_k(self, query : list[str], k : int, doc_ranges : list[tuple[int, int]] = None) -> np.ndarray:
+        """
+        Returns the indices of the k best scoring documents, by decreasing score. Ties are ordered like rank_bm25's
+        reversed argsort, from the highest document index to the lowest.
+
+        Args:
+            query (list[str]): The query keywords.
+            k (int): Number of documents to return.
+            doc_ranges (list[tuple[int, int]], optional): Sorted [start, end) ranges restricting the documents to score. Defaults to None, scoring every document.
+
+        Returns:
+            np.ndarray: Indices of the top k documents.
+        """
+        if doc_ranges is None:
+            candidates, scores = np.arange(self.num_docs), self.get_scores(query)
+        else:
+            candidates, scores = self.get_range_scores(query, doc_ranges)
+
+        k = min(k, len(candidates))
+        if k <= 0: return np.zeros(0, dtype = np.int64)
+
+        # Candidates are in document order, so ordering ties by candidate position orders them by document index
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(candidates) else np.arange(len(candidates))
+        return candidates[top[np.lexsort((-top, -scores[top]))]]
+
+    def reorder(self, order : np.ndarray) -> "BM25Index":
+        """
+        Creates a new index with the documents reordered. The scores of the documents do not change.
+
+        Args:
+            order (np.ndarray): The current indices of the documents, in their new order.
+
+        Returns:
+            BM25Index: The reordered index.
+        """
+        new_positions = np.empty(self.num_docs, dtype = np.int64)
+        new_positions[order] = np.arange(self.num_docs)
+        term_ids = np.repeat(np.arange(len(self.terms)), np.diff(self.indptr))
+
+        return self.from_postings(self.terms, term_ids, new_positions[self.doc_idx], self.term_freqs, self.doc_lens[order], k1 = self.k1, b = self.b, epsilon = self.epsilon)
+
+    def update(self, keep_docs : np.ndarray, new_corpus : list[list[str]]) -> "BM25Index":
+        """
+        Creates a new index with some documents removed and new documents appended. The kept documents are not
+        tokenised again, their postings are reused.
+
+        Args:
+            keep_docs (np.ndarray): Boolean mask of the documents to keep.
+            new_corpus (list[list[str]]): The keywords of the documents to append.
+
+        Returns:
+            BM25Index: The updated index.
+        """
+        vocab = dict(self.vocab)
+        return self.update_postings(keep_docs, *self.corpus_postings(new_corpus, vocab, int(keep_docs.sum())))
+
+    def update_postings(self, keep_docs : np.ndarray, terms : list[str], new_term_ids : np.ndarray, new_doc_idx : np.ndarray,
+                        new_term_freqs : np.ndarray, new_doc_lens : np.ndarray) -> "BM25Index":
+        """
+        Creates a new index with some documents removed and the postings of new documents appended.
+
+        Args:
+            keep_docs (np.ndarray): Boolean mask of the documents to keep.
+            terms (list[str]): The vocabulary of the index extended with the new terms, in term id order.
+            new_term_ids (np.ndarray): Term id of every new posting.
+            new_doc_idx (np.ndarray): Document index of every new posting, numbered after the kept documents.
+            new_term_freqs (np.ndarray): Term frequency of every new posting.
+            new_doc_lens (np.ndarray): Number of keywords of every new document.
+
+        Returns:
+            BM25Index: The updated index.
+        """
+        term_ids = np.repeat(np.arange(len(self.terms)), np.diff(self.indptr))
+        kept_postings = keep_docs[self.doc_idx]
+        # Renumber the kept documents so they stay contiguous
+        doc_remap = np.cumsum(keep_docs) - 1
+
+        return self.from_postings(
+            terms,
+            np.concatenate([term_ids[kept_postings], new_term_ids]),
+            np.concatenate([doc_remap[self.doc_idx[kept_postings]], new_doc_idx]),
+            np.concatenate([self.term_freqs[kept_postings], new_term_freqs]),
+            np.concatenate([self.doc_lens[keep_docs], new_doc_lens]),
+            k1 = self.k1, b = self.b, epsilon = self.epsilon
+        )
+
+    def save(self, index_dir : str):
+        """
+        Saves the index arrays as .npy files and the vocabulary and parameters as JSON.
+
+        Args:
+            index_dir (str): Directory to write the index to.
+        """
+        for name in INDEX_ARRAYS:
+            np.save(os.path.join(index_dir, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+
+        with open(os.path.join(index_dir, 'terms.json'), 'w') as f:
+            json.dump(self.terms, f)
+
+        with open(os.path.join(index_dir, 'params.json'), 'w') as f:
+            json.dump({"k1" : self.k1, "b" : self.b, "epsilon" : self.epsilon}, f)
+
+    @classmethod
+    def load(cls, index_dir : str) -> "BM25Index":
+        """
+        Loads an index, memory-mapping its arrays so they are paged in on demand and shared between processes.
+
+        Args:
+            index_dir (str): Directory of the index.
+
+        Returns:
+            BM25Index: The index.
+        """
+        arrays = {name : np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode = 'r') for name in INDEX_ARRAYS}
+
+        with open(os.path.join(index_dir, 'terms.json'), 'r') as f:
+            terms = json.load(f)
+
+        with open(os.path.join(index_dir, 'params.json'), 'r') as f:
+            bm25_params = json.load(f)
+
+        return cls(terms, **arrays, **bm25_params)
+
+
+class SparseBM25Retriever(BaseRetriever):
+    """
+    Retriever ranking documents with a BM25Index, a replacement for LangChain's BM25Retriever. Only the document ids
+    are kept, the retriever returns chunk references whose text is read from the chunk store. Documents are stored
+    contiguously per company and report year, so queries filtered on them only score the matching partitions.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed = True)
+
+    index : Any
+    """ The BM25Index of the documents. """
+    doc_ids : list[str]
+    """ Ids of the indexed documents, in index order. """
+    partitions : list[dict] = []
+    """ The PARTITION_KEYS metadata values and [start, end) document range of every partition. """
+    k : int = 4
+    """ Number of documents to return. """
+    preprocess_func : Callable[[str], list[str]] = default_preprocessing_func
+    """ Function turning a text into keywords. """
+
+    _doc_positions : Any = PrivateAttr(default = None)
+
+    @classmethod
+    def from_documents(cls, documents : list[Document], preprocess_func : Callable[[str], list[str]] = default_preprocessing_func,
+                       bm25_params : dict = None, num_workers : int = 1, **kwargs) -> "SparseBM25Retriever":
+        """
+        Builds the retriever from documents.
+
+        Args:
+            documents (list[Document]): The documents to index.
+            preprocess_func (Callable[[str], list[str]], optional): Function turning a text into keywords. Defaults to whitespace splitting.
+            bm25_params (dict, optional): k1, b and epsilon of BM25Okapi. Defaults to None.
+            num_workers (int, optional): Number of processes tokenising the documents. Defaults to 1.
+            **kwargs: Other fields of the retriever, e.g. k.
+
+        Returns:
+            SparseBM25Retriever: The retriever.
+        """
+        documents = list(documents)
+        order, partitions = group_partitions([[doc.metadata.get(key) for key in PARTITION_KEYS] for doc in documents])
+        documents = [documents[doc_pos] for doc_pos in order]
+        corpus = tokenize_corpus([doc.page_content for doc in documents], preprocess_func, num_workers)
+
+        return cls(
+            index = BM25Index.from_corpus(corpus, **(bm25_params or {})),
+            doc_ids = [doc.id for doc in documents],
+            partitions = partitions,
+            preprocess_func = preprocess_func,
+            **kwargs
+        )
+
+    def update(self, new_docs : list[Document], delete_ids : list[str], num_workers : int = 1) -> "SparseBM25Retriever":
+        """
+        Creates a new retriever with some documents removed and new documents added.
+
+        Args:
+            new_docs (list[Document]): The documents to add.
+            delete_ids (list[str]): Ids of the documents to remove.
+            num_workers (int, optional): Number of processes tokenising the new documents. Defaults to 1.
+
+        Returns:
+            SparseBM25Retriever: The updated retriever.
+        """
+        builder = self.builder(self, delete_ids, num_workers = num_workers)
+        builder.add(new_docs)
+        return builder.build()
+
+    @classmethod
+    def builder(cls, retriever : "SparseBM25Retriever" = None, delete_ids : list[str] = None, **kwargs) -> "SparseBM25Builder":
+        """
+        Starts building a retriever from batches of documents, e.g. while the ingestion streams the chunks.
+
+        Args:
+            retriever (SparseBM25Retriever, optional): The retriever to update. Defaults to None, building a new retriever.
+            delete_ids (list[str], optional): Ids of the documents of the retriever to remove. Defaults to None.
+            **kwargs: Other parameters of the SparseBM25Builder.
+
+        Returns:
+            SparseBM25Builder: The builder.
+        """
+        return SparseBM25Builder(retriever, delete_ids, **kwargs)
+
+    def partition_values(self) -> list[tuple]:
+        """
+        Returns the PARTITION_KEYS metadata values of every document, in index order.
+
+        Returns:
+            list[tuple]: The partition values of every document. Documents outside every partition (e.g. of an index
+                saved before partitioning) get None values.
+        """
+        partition_values = [(None,) * len(PARTITION_KEYS)] * len(self.doc_ids)
+        for partition in self.partitions:
+            partition_values[partition['start'] : partition['end']] = [tuple(partition[key] for key in PARTITION_KEYS)] * (partition['end'] - partition['start'])
+
+        return partition_values
+
+    def save(self, index_dir : str):
+        """
+        Saves the retriever to a directory. The index is written to a temporary directory first which then replaces
+        the previous one, so an interrupted save never leaves a half-written index behind.
+
+        Args:
+            index_dir (str): Directory to save the retriever to.
+        """
+        index_dir = os.path.normpath(index_dir)
+        tmp_dir, old_dir = f"{index_dir}.tmp", f"{index_dir}.old"
+        shutil.rmtree(tmp_dir, ignore_errors = True)
+        os.makedirs(tmp_dir)
+
+        self.index.save(tmp_dir)
+        with open(os.path.join(tmp_dir, 'doc_ids.json'), 'w') as f:
+            json.dump(self.doc_ids, f)
+
+        with open(os.path.join(tmp_dir, 'partitions.json'), 'w') as f:
+            json.dump(self.partitions, f)
+
+        if os.path.exists(index_dir): os.replace(index_dir, old_dir)
+        os.replace(tmp_dir, index_dir)
+        shutil.rmtree(old_dir, ignore_errors = True)
+
+    @classmethod
+    def load(cls, index_dir : str, preprocess_func : Callable[[str], list[str]] = default_preprocessing_func, **kwargs) -> "SparseBM25Retriever":
+        """
+        Loads a saved retriever. The preprocessing function is not saved and must be the one the index was built with.
+
+        Args:
+            index_dir (str): Directory of the saved retriever.
+            preprocess_func (Callable[[str], list[str]], optional): Function turning a text into keywords. Defaults to whitespace splitting.
+            **kwargs: Other fields of the retriever, e.g. k.
+
+        Returns:
+            SparseBM25Retriever: The retriever.
+        """
+        with open(os.path.join(index_dir, 'doc_ids.json'), 'r') as f:
+            doc_ids = json.load(f)
+
+        partitions = []
+        # Indexes saved before partitioning have no partitions, they are searched without filters
+        if os.path.exists(os.path.join(index_dir, 'partitions.json')):
+            with open(os.path.join(index_dir, 'partitions.json'), 'r') as f:
+                partitions = json.load(f)
+
+        return cls(index = BM25Index.load(index_dir), doc_ids = doc_ids, partitions = partitions, preprocess_func = preprocess_func, **kwargs)
+
+    def match_partitions(self, filters : dict) -> list[tuple[int, int]]:
+        """
+        Finds the document ranges of the partitions matching the search filters.
+
+        Args:
+            filters (dict): Mapping of PARTITION_KEYS to the accepted values. Missing or empty keys accept every value.
+
+        Returns:
+            list[tuple[int, int]]: The sorted [start, end) document ranges of the matching partitions. A partition
+                without a value for a key (e.g. documents indexed before partitioning) matches every value, like an
+                index without partitions.
+        """
+        return [
+            (partition['start'], partition['end']) for partition in self.partitions
+            if all(not filters.get(key) or partition[key] is None or partition[key] in filters[key] for key in PARTITION_KEYS)
+        ]
+
+    def score_documents(self, query : str, doc_ids : list[str]) -> np.ndarray:
+        """
+        Scores some documents against a query, e.g. the candidates of a reranker.
+
+        Args:
+            query (str): The search query.
+            doc_ids (list[str]): Ids of the documents to score.
+
+        Returns:
+            np.ndarray: The BM25 score of every document, 0 for the documents that are not indexed.
+        """
+        if self._doc_positions is None:
+            self._doc_positions = {doc_id : doc_idx for doc_idx, doc_id in enumerate(self.doc_ids)}
+
+        positions = np.array([self._doc_positions.get(doc_id, -1) for doc_id in doc_ids], dtype = np.int64)
+        scores = self.index.get_scores(self.preprocess_func(query))
+
+        return np.where(positions >= 0, scores[positions], 0.0)
+
+    def _get_relevant_documents(self, query : str, *, run_manager : CallbackManagerForRetrieverRun, filters : dict = None) -> list[Document]:
+        doc_ranges = self.match_partitions(filters) if filters and len(self.partitions) > 0 else None
+        return [chunk_reference(self.doc_ids[doc_idx]) for doc_idx in self.index.top_k(self.preprocess_func(query), self.k, doc_ranges)]
+
+    async def _aget_relevant_documents(self, query : str, *, run_manager : AsyncCallbackManagerForRetrieverRun, filters : dict = None) -> list[Document]:
+        return await run_in_executor(None, self._get_relevant_documents, query, run_manager = run_manager.get_sync(), filters = filters)
+
+
+class SparseBM25Builder:
+    """
+    Class to build or update a SparseBM25Retriever from batches of documents. Every batch is tokenised when it is
+    added and only its postings are kept, as compact arrays, so the text of the documents never has to be held in
+    memory all at once. The index is built once from the postings of every batch. With several workers, the batches
+    are tokenised by one pool of processes, started on the first batch and shut down by `build`.
+    """
+
+    def __init__(self, retriever : SparseBM25Retriever = None, delete_ids : list[str] = None, preprocess_func : Callable[[str], list[str]] = default_preprocessing_func,
+                 bm25_params : dict = None, num_workers : int = 1, **kwargs):
+        """
+        Initializes the SparseBM25Builder.
+
+        Args:
+            retriever (SparseBM25Retriever, optional): The retriever to update, whose preprocessing function and BM25 parameters are kept. Defaults to None, building a new retriever.
+            delete_ids (list[str], optional): Ids of the documents of the retriever to remove. Defaults to None.
+            preprocess_func (Callable[[str], list[str]], optional): Function turning a text into keywords, for a new retriever. Defaults to whitespace splitting.
+            bm25_params (dict, optional): k1, b and epsilon of BM25Okapi, for a new retriever. Defaults to None.
+            num_workers (int, optional): Number of processes tokenising the documents. Defaults to 1.
+            **kwargs: Other fields of the retriever, e.g. k.
+        """
+        self.retriever = retriever
+        self.num_workers = num_workers
+        self.executor = None
+        self.postings = []
+
+        if retriever is None:
+            self.preprocess_func = preprocess_func
+            self.bm25_params = bm25_params or {}
+            self.kwargs = kwargs
+            self.keep_docs = None
+            self.vocab = {}
+            self.doc_ids, self.partition_values = [], []
+        else:
+            delete_ids = set(delete_ids or [])
+            index = retriever.index
+            self.preprocess_func = retriever.preprocess_func
+            self.bm25_params = {"k1" : index.k1, "b" : index.b, "epsilon" : index.epsilon}
+            self.kwargs = {"k" : retriever.k, **kwargs}
+            self.keep_docs = np.array([doc_id not in delete_ids for doc_id in retriever.doc_ids], dtype = bool)
+            self.vocab = dict(index.vocab)
+            self.doc_ids = [doc_id for doc_id, keep in zip(retriever.doc_ids, self.keep_docs) if keep]
+            self.partition_values = [values for values, keep in zip(retriever.partition_values(), self.keep_docs) if keep]
+
+    def add(self, documents : list[Document]):
+        """
+        Tokenises a batch of documents and keeps their postings.
+
+        Args:
+            documents (list[Document]): The documents to add.
+        """
+        # Starting a pool imports the preprocessing in every worker, which costs far more than tokenising a batch
+        if self.num_workers > 1 and self.executor is None:
+            self.executor = create_tokenize_pool(self.num_workers)
+
+        corpus = tokenize_corpus([doc.page_content for doc in documents], self.preprocess_func, self.num_workers, self.executor)
+        _, term_ids, doc_idx, term_freqs, doc_lens = BM25Index.corpus_postings(corpus, self.vocab, len(self.doc_ids))
+
+        self.postings.append((term_ids.astype(np.int32), doc_idx.astype(np.int32), term_freqs.astype(np.int32), doc_lens.astype(np.int32)))
+        self.doc_ids += [doc.id for doc in documents]
+        self.partition_values += [tuple(doc.metadata.get(key) for key in PARTITION_KEYS) for doc in documents]
+
+    def build(self) -> SparseBM25Retriever:
+        """
+        Builds the retriever from the kept documents of the retriever and the added documents.
+
+        Returns:
+            SparseBM25Retriever: The retriever.
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+        terms = list(self.vocab)
+        postings = [np.concatenate([batch[field] for batch in self.postings]) if len(self.postings) > 0 else np.zeros(0, dtype = np.int32) for field in range(4)]
+        term_ids, doc_idx, term_freqs, doc_lens = [array.astype(np.int64) for array in postings]
+
+        if self.retriever is None:
+            index = BM25Index.from_postings(terms, term_ids, doc_idx, term_freqs, doc_lens, **self.bm25_params)
+        else:
+            index = self.retriever.index.update_postings(self.keep_docs, terms, term_ids, doc_idx, term_freqs, doc_lens)
+
+        # Documents are appended in ingestion order, so they are regrouped to keep every partition contiguous
+        doc_ids = self.doc_ids
+        order, partitions = group_partitions(self.partition_values)
+        if not np.array_equal(order, np.arange(len(order))):
+            index = index.reorder(order)
+            doc_ids = [doc_ids[doc_pos] for doc_pos in order]
+
+        return SparseBM25Retriever(index = index, doc_ids = doc_ids, partitions = partitions, preprocess_func = self.preprocess_func, **self.kwargs)
@@ -0,0 +1,74 @@
+from src.index_ingestion.keyword_preprocessor import KeywordPreprocessor
+from config import settings
+
+keyword_preprocessor = KeywordPreprocessor(tokenizer = settings.lexicalstore_config.get('tokenizer', 'nltk'), nltk_data_dir = settings.get('nltk_data_dir'))
+
+def format_page_num(page_nums: set[int]) -> str:
+    """
+    Formats a set of page numbers into a concise string representation. 
+
+    Args:
+        page_nums (set[int]): The page numbers spanned by a chunk.
+
+    Returns:
+        str: A formatted string representing the page numbers and ranges.
+    """
+    page_nums = sorted(page_nums)
+    ranges = []
+    start = prev = page_nums[0]
+
+    for n in page_nums[1:]:
+        if n == prev + 1:  
+            prev = n
+        else:  
+            ranges.append(f"{start}-{prev}" if start != prev else str(start))
+            start = prev = n
+
+    ranges.append(f"{start}-{prev}" if start != prev else str(start)) 
+
+    return ",".join(ranges)
+
+def expand_page_num(page_num : str) -> set[int]:
+    """
+    Expands formatted page numbers (e.g. '3', '3-5' or '3-5,8') into the page numbers.
+
+    Args:
+        page_num (str): The formatted page numbers.
+
+    Returns:
+        set[int]: The page numbers.
+    """
+    page_nums = set()
+
+    for page_range in str(page_num).split(','):
+        start_page, _, end_page = page_range.partition('-')
+        page_nums.update(range(int(start_page), int(end_page or start_page) + 1))
+
+    return page_nums
+
+def chunk_header(report_metadata: dict, page_num: str) -> str:
+    """
+    Creates the first line of a chunk, identifying the report and pages the chunk comes from.
+
+    Args:
+        report_metadata (dict): Company name, company symbol and report year of the report.
+        page_num (str): The formatted page numbers of the chunk.
+
+    Returns:
+        str: The chunk header.
+    """
+    return f"(Company Name: {report_metadata['company_name']} / {report_metadata['company_symbol']}, Company Symbol: Report Year: {report_metadata['report_year']}, Page: {page_num})"
+
+
+def preprocess_text(text : str) -> list[str]:
+    """
+    Preprocesses a text to generate a list of keywords, applying lowercasing/punctuation removal, tokenisation,
+    stopword removal and stemming
+
+    Args:
+        text (str): The input text to be preprocessed.
+
+    Returns:
+        list[str]: A list of preprocessed keywords from the input text.
+    """
+    return keyword_preprocessor(text)
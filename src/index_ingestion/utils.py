@@ -2,45 +2,10 @@ from pymupdf import Page
 import fitz
 import os
 from langchain_core.documents import Document
-import yfinance as yf
-from nltk.tokenize import word_tokenize
-from nltk.stem import PorterStemmer
-import string
-from nltk.corpus import stopwords
+from src.company_registry import get_company_registry
+from src.index_ingestion.chunk_store import CHUNK_ID_KEY
+from src.index_ingestion.text_utils import format_page_num, chunk_header
 import re
-import nltk
-
-nltk.download('punkt_tab', quiet = True)
-nltk.download('stopwords', quiet=True)
-
-stemmer = PorterStemmer()
-stop_words = set(stopwords.words('english'))
-punc = string.punctuation
-
-def format_page_num(buffer: list[Document]) -> str:
-    """
-    Formats the page numbers from a list of Document chunks into a concise string representation. 
-
-    Args:
-        buffer (list[Document]): A list of Document chunks with metadata containing page numbers.
-
-    Returns:
-        str: A formatted string representing the page numbers and ranges.
-    """
-    page_nums = sorted({c.metadata['page_num'] for c in buffer})
-    ranges = []
-    start = prev = page_nums[0]
-
-    for n in page_nums[1:]:
-        if n == prev + 1:  
-            prev = n
-        else:  
-            ranges.append(f"{start}-{prev}" if start != prev else str(start))
-            start = prev = n
-
-    ranges.append(f"{start}-{prev}" if start != prev else str(start)) 
-
-    return ",".join(ranges)
 
 def classify_scanned_pdf(document : list[Page]) -> dict:
     """ 
@@ -75,6 +40,152 @@ def classify_scanned_pdf(document : list[Page]) -> dict:
     return scanned_pages
 
 
+def profile_page(page : Page) -> tuple[dict, dict]:
+    """
+    Profiles a PDF page in a single pass over its text and images to decide how it should be parsed.
+
+    Args:
+        page (Page): The PDF page to profile.
+
+    Returns:
+        tuple[dict, dict]: The page profile (text density, image coverage, table likelihood and whether the page is scanned)
+        and the PyMuPDF text dictionary of the page, which can be reused to extract its text.
+    """
+    page_area = abs(page.rect)
+    text_dict = page.get_text("dict", flags = fitz.TEXTFLAGS_TEXT)
+    text_chars = numeric_lines = total_lines = 0
+
+    # Count the characters and the lines made up mostly of numbers, which are typical of financial tables
+    for block in text_dict['blocks']:
+        for line in block.get('lines', []):
+            line_text = "".join(span['text'] for span in line['spans'])
+            tokens = line_text.split()
+            if len(tokens) == 0: continue
+
+            total_lines += 1
+            text_chars += len(line_text.strip())
+            numeric_tokens = sum(1 for token in tokens if re.fullmatch(r"[\(\$]*-?[\d,.]+%?\)?", token))
+            if numeric_tokens >= 2 and numeric_tokens >= len(tokens) / 2: numeric_lines += 1
+
+    # Calculate the percentage of the page covered by images
+    img_area = sum(abs(fitz.Rect(img['bbox']) & page.rect) for img in page.get_image_info())
+    img_perc = img_area / page_area
+
+    # Horizontal and vertical rulings are drawn as thin lines or rectangles around table rows and columns
+    ruling_lines = sum(
+        1 for drawing in page.get_drawings() for item in drawing['items']
+        if item[0] == 'l' or (item[0] == 're' and min(item[1].width, item[1].height) <= 2)
+    )
+    numeric_ratio = numeric_lines / total_lines if total_lines > 0 else 0.0
+    table_likelihood = max(numeric_ratio, min(1.0, ruling_lines / 20))
+
+    profile = {
+        "text_density" : text_chars / page_area,
+        "img_coverage" : img_perc,
+        "table_likelihood" : table_likelihood,
+        # If the page has no searchable text and more than 80% image coverage, classify it as scanned
+        "is_scanned" : text_chars == 0 and img_perc >= 0.8
+    }
+
+    return profile, text_dict
+
+
+def page_to_markdown(text_dict : dict, margin : float = 0.06) -> str:
+    """
+    Converts the PyMuPDF text dictionary of a plain prose page into markdown. Blocks set in a larger or bold font than
+    the body text become headers, and blocks inside the top and bottom margins (page headers and footers) are dropped.
+
+    Args:
+        text_dict (dict): The PyMuPDF text dictionary of the page.
+        margin (float, optional): Fraction of the page height treated as header and footer margin. Defaults to 0.06.
+
+    Returns:
+        str: The markdown content of the page.
+    """
+    page_height = text_dict['height']
+    blocks = []
+    font_sizes = {}
+
+    for block in text_dict['blocks']:
+        spans = [span for line in block.get('lines', []) for span in line['spans'] if span['text'].strip()]
+        if len(spans) == 0: continue
+
+        # Skip page headers and footers such as running titles and page numbers
+        _, y0, _, y1 = block['bbox']
+        if y1 <= page_height * margin or y0 >= page_height * (1 - margin): continue
+
+        lines = ["".join(span['text'] for span in line['spans']).strip() for line in block['lines']]
+        blocks.append((lines, spans))
+
+        # Weight the font sizes by number of characters to find the body font size
+        for span in spans:
+            font_size = round(span['size'])
+            font_sizes[font_size] = font_sizes.get(font_size, 0) + len(span['text'])
+
+    body_size = max(font_sizes, key = font_sizes.get) if font_sizes else 0
+    md_blocks = []
+
+    for lines, spans in blocks:
+        # Join the lines of the block into a paragraph, merging words hyphenated across lines
+        text = ""
+        for line in filter(None, lines):
+            if text.endswith("-"): text = text[:-1] + line
+            else: text = f"{text} {line}" if text else line
+
+        font_size = min(span['size'] for span in spans)
+        is_bold = all(span['flags'] & fitz.TEXT_FONT_BOLD for span in spans)
+
+        if font_size >= body_size * 1.3:
+            md_blocks.append(f"## {text}")
+        elif (font_size >= body_size * 1.1 or is_bold) and len(text) < 100:
+            md_blocks.append(f"### {text}")
+        else:
+            md_blocks.append(text)
+
+    return "\n\n".join(md_blocks)
+
+
+def get_page_metadata(block_counts : dict, page_num : int) -> dict:
+    """
+    Builds the metadata of a parsed page from the Marker block counts of that page.
+
+    Args:
+        block_counts (dict): Mapping of Marker block types to their number of occurrences on the page.
+        page_num (int): The 1-based page number.
+
+    Returns:
+        dict: The page metadata indicating whether the page contains images or tables, and its page number.
+    """
+    # Determine if the page contains tables or images
+    contain_table = any(tag in block_counts for tag in ['Table', 'TableGroup', 'TableOfContents', 'TableCell'])
+    contain_img = any(tag in block_counts for tag in ['Figure', 'FigureGroup', 'Picture', 'PictureGroup'])
+
+    return {"contain_img" : contain_img, "contain_table" : contain_table, "page_num" : page_num}
+
+
+def split_paginated_markdown(markdown : str, page_ids : list[int] = None) -> dict:
+    """
+    Splits the paginated markdown rendered by Marker into the content of each page.
+    Marker prefixes every page with a separator of the form "{page_id}" followed by 48 dashes.
+
+    Args:
+        markdown (str): The paginated markdown output.
+        page_ids (list[int], optional): Indices of the rendered pages, pages without a separator are returned empty. Defaults to None.
+
+    Returns:
+        dict: A dictionary with page indices as keys and the markdown content of each page as values.
+    """
+    # Marker collapses the newlines around the separator of an empty page, so the newlines are optional
+    parts = re.split(r"\n*\{(\d+)\}-{48}\n*", markdown)
+    # re.split alternates between the text before a separator and the captured page index
+    page_contents = {int(page_id) : content for page_id, content in zip(parts[1::2], parts[2::2])}
+
+    for page_id in page_ids or []:
+        page_contents.setdefault(page_id, "")
+
+    return page_contents
+
+
 def get_file_paths(input_path : str, file_extension : str) -> list:
     """
     Retrieves all file paths with the specified extension from the given directory or file.
@@ -97,30 +208,35 @@ def get_file_paths(input_path : str, file_extension : str) -> list:
     return file_paths
 
 
-def create_chunk(buffer: list[Document]) -> Document:
+def create_chunk(spans: list[tuple[int, int]], segments: list[tuple[str, bool, dict]], report_metadata: dict, chunk_id: str) -> Document:
     """
-    Creates a single Document chunk by combining the contents of the provided buffer.
+    Creates a single Document chunk from spans of the report segments. The chunk text is only materialised here,
+    with a single join over the segment suffixes.
 
     Args:
-        buffer (list[Document]): A list of Document chunks to be combined.
+        spans (list[tuple[int, int]]): The (segment index, start offset) pairs making up the chunk. Each span runs to the end of its segment.
+        segments (list[tuple[str, bool, dict]]): The (text, starts a header section, page metadata) segments of the report.
+        report_metadata (dict): Company name, company symbol, report year and file path of the report.
+        chunk_id (str): The stable id of the chunk.
 
     Returns:
-        Document: A single Document chunk combining the contents of the buffer.
+        Document: A single Document chunk combining the contents of the spans.
     """
-    # If the buffer is empty, return None
-    if len(buffer) == 0:
-        return None
-    else:
-        # Create and return a new Document with combined content and metadata
-        return Document(
-            metadata={
-                'contain_img': any(c.metadata.get('contain_img', False) for c in buffer),
-                'contain_table': any(c.metadata.get('contain_table', False) for c in buffer),
-                'page_num': format_page_num(buffer)
-            },
-            page_content='\n'.join(c.page_content for c in buffer)
-        )
-
+    page_metadatas = [segments[seg_idx][2] for seg_idx, _ in spans]
+    page_num = format_page_num({page_metadata['page_num'] for page_metadata in page_metadatas})
+    header = chunk_header(report_metadata, page_num)
+
+    return Document(
+        id = chunk_id,
+        metadata={
+            **report_metadata,
+            CHUNK_ID_KEY: chunk_id,
+            'contain_img': any(page_metadata.get('contain_img', False) for page_metadata in page_metadatas),
+            'contain_table': any(page_metadata.get('contain_table', False) for page_metadata in page_metadatas),
+            'page_num': page_num
+        },
+        page_content='\n'.join([header, *(segments[seg_idx][0][start:] for seg_idx, start in spans)])
+    )
 
 
 def clean_text(page_content : str) -> str:
@@ -163,35 +279,6 @@ def parse_report_path(path: str) -> tuple[str, str, str]:
     parts = os.path.normpath(path).split(os.sep)
     symbol = parts[-2]  
     year = os.path.splitext(parts[-1])[0] 
-    ticker = yf.Ticker(symbol)
-    company_name = ticker.info.get("longName")
+    company_name = get_company_registry().get_name(symbol)
 
     return symbol, year, company_name
-
-
-def preprocess_text(text : str) -> list[str]:
-    """
-    Preprocesses a text to generate a list of keywords, applying lowercasing/punctuation removal, tokenisation,
-    stopword removal and stemming
-
-    Args:
-        text (str): The input text to be preprocessed.
-
-    Returns:
-        list[str]: A list of preprocessed keywords from the input text.
-    """
-    # Lowercasing and punctuation removal
-    text = text.strip()
-    text = text.lower()
-    text = text.translate(str.maketrans('', '', punc))
-
-    # Tokenisation
-    tokens = word_tokenize(text)
-    # Stopword Removal
-    filtered_tokens = [token for token in tokens if token not in stop_words]
-    # Stemming
-    stemmed_unigrams = [stemmer.stem(token) for token in filtered_tokens]
-    #stemmed_bigrams = list(" ".join([stemmer.stem(token) for token in n_gram]) for n_gram in ngrams(tokens, 2) if n_gram[0] not in stop_words and n_gram[-1] not in stop_words )
-    #stemmed_trigrams = list(" ".join([stemmer.stem(token) for token in n_gram]) for n_gram in ngrams(tokens, 3) if n_gram[0] not in stop_words and n_gram[-1] not in stop_words)
-
-    return stemmed_unigrams #+ stemmed_bigrams + stemmed_trigrams
\ No newline at end of file
@@ -1,45 +1,48 @@
-from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+import importlib
+import time
 from typing_extensions import Literal
-from langchain_text_splitters.markdown import MarkdownHeaderTextSplitter
-from langchain_chroma import Chroma
-from langchain_community.retrievers import BM25Retriever, TFIDFRetriever
-from langchain_community.vectorstores import FAISS
-from langchain_cohere import CohereRerank
 from typing_extensions import Any
 
 from dotenv import load_dotenv
 load_dotenv()
 
+# Classes are given as 'module:class' and imported on first use, so only the configured providers are imported
 splitter_map = {
-    "MarkdownHeaderTextSplitter" : MarkdownHeaderTextSplitter
+    "MarkdownHeaderTextSplitter" : "langchain_text_splitters.markdown:MarkdownHeaderTextSplitter"
 }
 llm_map = {
-    "ChatGoogleGenerativeAI" : ChatGoogleGenerativeAI,
-    "ChatOpenAI": ChatOpenAI
+    "ChatGoogleGenerativeAI" : "langchain_google_genai:ChatGoogleGenerativeAI",
+    "ChatOpenAI": "langchain_openai:ChatOpenAI"
 }
 
 lexicalstore_map = {
-    "BM25Retriever" : BM25Retriever,
-    "TFIDFRetriever": TFIDFRetriever
+    "BM25Retriever" : "langchain_community.retrievers:BM25Retriever",
+    "SparseBM25Retriever" : "src.index_ingestion.sparse_bm25:SparseBM25Retriever",
+    "TFIDFRetriever": "langchain_community.retrievers:TFIDFRetriever"
 }
 vectorstore_map = {
-    "Chroma" : Chroma,
-    "FAISS" : FAISS
+    "Chroma" : "langchain_chroma:Chroma",
+    "FAISS" : "langchain_community.vectorstores:FAISS",
+    "CompressedFAISS" : "src.index_ingestion.faiss_store:CompressedFAISS",
+    "ShardedVectorStore" : "src.index_ingestion.sharded_store:ShardedVectorStore"
 }
 
 embedding_map= {
-    "GoogleGenerativeAIEmbeddings" : GoogleGenerativeAIEmbeddings,
-    "OpenAIEmbeddings" : OpenAIEmbeddings
+    "GoogleGenerativeAIEmbeddings" : "langchain_google_genai:GoogleGenerativeAIEmbeddings",
+    "OpenAIEmbeddings" : "langchain_openai:OpenAIEmbeddings"
 }
 
 reranker_map = {
-    "CohereRerank" : CohereRerank
+    "CohereRerank" : "langchain_cohere:CohereRerank",
+    "EmbeddingRerank" : "src.rag_architecture.components.embedding_rerank:EmbeddingRerank"
 }
 
+# Seconds spent the first time each class was retrieved, keyed by '{map_type}:{name}', i.e. the import time of its provider
+import_times = {}
+
 def get_class(map_type: Literal['splitter', 'llm', 'vectorstore', 'lexicalstore', 'embedding', 'reranker'], name: str) -> Any:
     """
-    Retrieves the class corresponding to the given mapping type and name.
+    Retrieves the class corresponding to the given mapping type and name, importing its module on first use.
     Args:
         map_type (Literal[splitter, llm, vectorstore, lexicalstore, embedding, reranker]): Type of the mapping
         name (str): Name of the class to retrieve
@@ -47,12 +50,13 @@ def get_class(map_type: Literal['splitter', 'llm', 'vectorstore', 'lexicalstore'
     Raises:
         Exception: Mapping type does not exist
         Exception: Mapping name does not exist in mapping type
+        Exception: The package of the class is not installed
 
     Returns:
         Any: The class corresponding to the specified mapping type and name.
     """
     map_dict = {
-        "splitter" : splitter_map, 
+        "splitter" : splitter_map,
         "llm" : llm_map,
         'reranker' : reranker_map,
         'lexicalstore' : lexicalstore_map,
@@ -67,7 +71,15 @@ def get_class(map_type: Literal['splitter', 'llm', 'vectorstore', 'lexicalstore'
 
     if name not in map_type_dict:
         raise Exception('ERROR: Mapping name does not exist in mapping type')
-    
-    cls = map_type_dict[name]
+
+    module_name, _, class_name = map_type_dict[name].partition(':')
+    t0 = time.perf_counter()
+
+    try:
+        cls = getattr(importlib.import_module(module_name), class_name)
+    except ImportError as e:
+        raise Exception(f'ERROR: {name} requires {module_name}, which cannot be imported: {e}')
+
+    import_times.setdefault(f"{map_type}:{name}", time.perf_counter() - t0)
 
     return cls
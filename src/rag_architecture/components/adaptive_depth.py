@@ -0,0 +1,102 @@
+import threading
+from collections import Counter, deque
+from langchain_core.documents import Document
+from src.rag_architecture.components.hybrid_retriever import FUSED_SCORE_KEY
+
+# Metadata keys of the document scores, by preference: the reranker score, then the fused hybrid search score
+SCORE_KEYS = ('relevance_score', FUSED_SCORE_KEY)
+
+
+def select_depth(scores : list[float], min_docs : int, max_docs : int, max_relative_gap : float = None, min_relative_score : float = None) -> int:
+    """
+    Selects how many of the ranked documents to keep. Documents are added until the score drops by more than the
+    maximum gap from the previous document, or below the minimum score. Both are relative to the best score, so the
+    same settings apply to reranker and fused scores.
+
+    Args:
+        scores (list[float]): The scores of the documents, by decreasing score.
+        min_docs (int): Minimum number of documents to keep.
+        max_docs (int): Maximum number of documents to keep.
+        max_relative_gap (float, optional): Largest score drop between consecutive documents, as a fraction of the best score. Defaults to None, no gap cutoff.
+        min_relative_score (float, optional): Smallest score kept, as a fraction of the best score. Defaults to None, no threshold.
+
+    Returns:
+        int: The number of documents to keep.
+    """
+    depth = min(max_docs, len(scores))
+    if depth == 0 or scores[0] <= 0: return depth
+
+    for idx in range(max(min_docs, 1), depth):
+        if min_relative_score is not None and scores[idx] < min_relative_score * scores[0]:
+            return idx
+        if max_relative_gap is not None and scores[idx - 1] - scores[idx] > max_relative_gap * scores[0]:
+            return idx
+
+    return depth
+
+
+class AdaptiveDepth:
+    """ Class to cut the retrieved documents at an adaptive depth, and to record the chosen depths for tuning. """
+
+    def __init__(self, min_docs : int = 3, max_docs : int = 10, max_relative_gap : float = None, min_relative_score : float = None, stats_window : int = 1000):
+        """
+        Initializes the AdaptiveDepth.
+
+        Args:
+            min_docs (int, optional): Minimum number of documents to keep. Defaults to 3.
+            max_docs (int, optional): Maximum number of documents to keep. Defaults to 10.
+            max_relative_gap (float, optional): Largest score drop between consecutive documents, as a fraction of the best score. Defaults to None.
+            min_relative_score (float, optional): Smallest score kept, as a fraction of the best score. Defaults to None.
+            stats_window (int, optional): Number of recent queries kept for the depth statistics. Defaults to 1000.
+        """
+        if min_docs > max_docs:
+            raise Exception('ERROR: min_docs cannot be larger than max_docs')
+
+        self.min_docs = min_docs
+        self.max_docs = max_docs
+        self.max_relative_gap = max_relative_gap
+        self.min_relative_score = min_relative_score
+        self.depths = deque(maxlen = stats_window)
+        self.lock = threading.Lock()
+
+    def __call__(self, docs : list[Document]) -> list[Document]:
+        """
+        Keeps the documents above the adaptive depth.
+
+        Args:
+            docs (list[Document]): The retrieved documents, by decreasing relevance.
+
+        Returns:
+            list[Document]: The kept documents.
+        """
+        score_key = next((key for key in SCORE_KEYS if len(docs) > 0 and all(key in doc.metadata for doc in docs)), None)
+
+        if score_key is None:
+            # Without scores the documents can only be cut at the maximum depth
+            depth = min(self.max_docs, len(docs))
+        else:
+            scores = [float(doc.metadata[score_key]) for doc in docs]
+            depth = select_depth(scores, self.min_docs, self.max_docs, self.max_relative_gap, self.min_relative_score)
+
+        print(f"INFO: Retrieval depth {depth} of {len(docs)} documents (scores: {score_key})")
+        with self.lock:
+            self.depths.append((depth, len(docs)))
+
+        return docs[:depth]
+
+    def get_stats(self) -> dict:
+        """
+        Returns the depth statistics over the recent queries.
+
+        Returns:
+            dict: Number of queries, mean number of candidate and kept documents, and number of queries per kept depth.
+        """
+        with self.lock:
+            depths = list(self.depths)
+
+        return {
+            "queries" : len(depths),
+            "mean_candidates" : sum(candidates for _, candidates in depths) / len(depths) if depths else None,
+            "mean_depth" : sum(depth for depth, _ in depths) / len(depths) if depths else None,
+            "depth_counts" : dict(sorted(Counter(depth for depth, _ in depths).items())),
+        }
@@ -0,0 +1,222 @@
+import json
+import threading
+from collections import OrderedDict
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from src.rag_architecture.components.schemas import State
+
+# Number of missed questions whose embedding is kept until their answer is stored, i.e. conversations in flight
+PENDING_SIZE = 64
+
+
+class SemanticAnswerCache:
+    """
+    Class to cache final answers by the meaning of the question. A question is answered from the cache when a cached
+    question with the same search filters has an embedding whose cosine similarity exceeds a threshold. The question
+    embeddings are kept in a preallocated matrix and the search filters of every slot in an array of filter ids, so a
+    lookup is a single matrix-vector product and a comparison.
+    """
+
+    def __init__(self, embedding : Embeddings, similarity_threshold : float = 0.95, max_size : int = 1024, version_func : callable = None):
+        """
+        Initializes the SemanticAnswerCache.
+
+        Args:
+            embedding (Embeddings): The embedding model used to embed the rewritten questions.
+            similarity_threshold (float, optional): Minimum cosine similarity of a cached question to reuse its answer. Defaults to 0.95.
+            max_size (int, optional): Maximum number of cached answers, the least recently used answer is evicted first. Defaults to 1024.
+            version_func (callable, optional): Function returning the current index version, the cache is cleared when it changes. Defaults to None.
+        """
+        self.embedding = embedding
+        self.similarity_threshold = similarity_threshold
+        self.max_size = max_size
+        self.version_func = version_func
+        self.version = version_func() if version_func is not None else None
+        self.lock = threading.Lock()
+        self.vectors = None
+        self.entries = [None] * max_size
+        # Id of the search filters of every slot, -1 for an empty slot
+        self.filter_ids = np.full(max_size, -1, dtype = np.int64)
+        # Id of every search filters held by a slot, dropped when its last slot is evicted
+        self.filter_key_ids = {}
+        self.next_filter_id = 0
+        self.last_used = np.zeros(max_size, dtype = np.int64)
+        # Embeddings of the missed questions, reused when their answer is stored
+        self.pending_vectors = OrderedDict()
+        self.clock = 0
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def embed(self, question : str) -> np.ndarray:
+        """
+        Embeds a question into a unit vector.
+
+        Args:
+            question (str): The rewritten user question.
+
+        Returns:
+            np.ndarray: The normalised question embedding.
+        """
+        vector = np.asarray(self.embedding.embed_query(question), dtype = np.float32)
+        return vector / max(np.linalg.norm(vector), 1e-12)
+
+    def check_version(self):
+        """ Clears the cache if the index version changed since the answers were cached. Must hold the lock. """
+        if self.version_func is None: return
+
+        version = self.version_func()
+        if version != self.version:
+            self.entries = [None] * self.max_size
+            self.filter_ids[:] = -1
+            self.filter_key_ids = {}
+            self.last_used[:] = 0
+            self.version = version
+            self.invalidations += 1
+
+    def lookup(self, question : str, filters : dict) -> dict:
+        """
+        Looks up the answer of the most similar cached question with the same search filters.
+
+        Args:
+            question (str): The rewritten user question.
+            filters (dict): The search filters of the question.
+
+        Returns:
+            dict: The cached answer and citations, or None if no cached question is similar enough.
+        """
+        query_vector = self.embed(question)
+        filters_key = json.dumps(filters or {}, sort_keys = True)
+
+        with self.lock:
+            self.check_version()
+            filter_id = self.filter_key_ids.get(filters_key)
+            valid = self.filter_ids == filter_id if filter_id is not None else None
+
+            if self.vectors is None or valid is None or not valid.any():
+                self.miss(question, query_vector)
+                return None
+
+            similarities = np.where(valid, self.vectors @ query_vector, -np.inf)
+            best = int(np.argmax(similarities))
+
+            if similarities[best] < self.similarity_threshold:
+                self.miss(question, query_vector)
+                return None
+
+            self.clock += 1
+            self.last_used[best] = self.clock
+            self.hits += 1
+            return {"answer" : self.entries[best]['answer'], "citations" : list(self.entries[best]['citations'])}
+
+    def miss(self, question : str, query_vector : np.ndarray):
+        """
+        Counts a miss and keeps the question embedding for when its answer is stored. Must hold the lock.
+
+        Args:
+            question (str): The rewritten user question.
+            query_vector (np.ndarray): The normalised question embedding.
+        """
+        self.misses += 1
+        self.pending_vectors[question] = query_vector
+        self.pending_vectors.move_to_end(question)
+        if len(self.pending_vectors) > PENDING_SIZE:
+            self.pending_vectors.popitem(last = False)
+
+    def store(self, question : str, filters : dict, answer : str, citations : list[str]):
+        """
+        Caches the answer of a question, evicting the least recently used answer if the cache is full.
+
+        Args:
+            question (str): The rewritten user question.
+            filters (dict): The search filters of the question.
+            answer (str): The final answer.
+            citations (list[str]): The citations of the answer.
+        """
+        with self.lock:
+            query_vector = self.pending_vectors.pop(question, None)
+
+        # The question was embedded by its lookup, unless it was evicted from the pending embeddings meanwhile
+        if query_vector is None:
+            query_vector = self.embed(question)
+        filters_key = json.dumps(filters or {}, sort_keys = True)
+
+        with self.lock:
+            self.check_version()
+
+            if self.vectors is None:
+                self.vectors = np.zeros((self.max_size, len(query_vector)), dtype = np.float32)
+
+            empty_slots = np.flatnonzero(self.filter_ids < 0)
+            if len(empty_slots) > 0:
+                slot = int(empty_slots[0])
+            else:
+                slot = int(np.argmin(self.last_used))
+                self.evictions += 1
+
+            evicted = self.entries[slot]
+            if filters_key not in self.filter_key_ids:
+                self.filter_key_ids[filters_key] = self.next_filter_id
+                self.next_filter_id += 1
+
+            self.clock += 1
+            self.vectors[slot] = query_vector
+            self.last_used[slot] = self.clock
+            self.filter_ids[slot] = self.filter_key_ids[filters_key]
+
+            if evicted is not None and evicted['filters_key'] != filters_key and not (self.filter_ids == self.filter_key_ids[evicted['filters_key']]).any():
+                del self.filter_key_ids[evicted['filters_key']]
+            self.entries[slot] = {"question" : question, "filters_key" : filters_key, "answer" : answer, "citations" : tuple(citations)}
+
+    def get_stats(self) -> dict:
+        """
+        Returns the cache statistics.
+
+        Returns:
+            dict: Number of hits, misses, hit rate, evictions, invalidations by index changes and cached answers.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits" : self.hits,
+                "misses" : self.misses,
+                "hit_rate" : self.hits / lookups if lookups > 0 else 0.0,
+                "evictions" : self.evictions,
+                "invalidations" : self.invalidations,
+                "size" : int((self.filter_ids >= 0).sum()),
+            }
+
+
+def lookup_answer(state : State, answer_cache : SemanticAnswerCache) -> State:
+    """
+    Answers the user's question from the semantic answer cache when a paraphrase of it was answered before.
+
+    Args:
+        state (State): Graph state containing the rewritten user question and search filters.
+        answer_cache (SemanticAnswerCache): The semantic answer cache.
+
+    Returns:
+        State: An updated state with the cached answer and citations on a hit.
+    """
+    cached_answer = answer_cache.lookup(state.user_question, state.search_filters)
+
+    if cached_answer is None:
+        return {"answer_cache_hit" : False}
+
+    return {**cached_answer, "answer_cache_hit" : True}
+
+
+def store_answer(state : State, answer_cache : SemanticAnswerCache) -> State:
+    """
+    Stores the final answer in the semantic answer cache. Answers without citations (e.g. when the retrieved context
+    was insufficient) are not cached.
+
+    Args:
+        state (State): Graph state containing the rewritten user question, final answer and citations.
+        answer_cache (SemanticAnswerCache): The semantic answer cache.
+
+    Returns:
+        State: The unchanged state.
+    """
+    if len(state.citations) > 0:
+        answer_cache.store(state.user_question, state.search_filters, state.answer, state.citations)
+
+    return {}
@@ -0,0 +1,140 @@
+import json
+from langchain_core.messages import AIMessageChunk
+from langchain_core.utils.json import parse_partial_json
+from typing_extensions import AsyncIterator
+
+
+def format_sse(event : str, data) -> str:
+    """
+    Formats a server-sent event.
+
+    Args:
+        event (str): The event type.
+        data: The JSON serialisable payload of the event.
+
+    Returns:
+        str: The event in the text/event-stream format.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class AnswerTokenParser:
+    """
+    Class to extract the answer text from the streamed tool call chunks of the answer generation. The final answer is
+    generated as the arguments of a FinalAnswer tool call, streamed as a partial JSON string, so the answer is read
+    from the partially parsed arguments and only the text that was not emitted yet is returned.
+    """
+
+    def __init__(self, answer_tool : str = 'FinalAnswer'):
+        """
+        Initializes the AnswerTokenParser.
+
+        Args:
+            answer_tool (str, optional): Name of the tool call holding the final answer. Defaults to 'FinalAnswer'.
+        """
+        self.answer_tool = answer_tool
+        self.message_id = None
+        self.tool_calls = {}
+        self.emitted = ""
+
+    def __call__(self, chunk : AIMessageChunk) -> str:
+        """
+        Reads a streamed message chunk of the answer generation.
+
+        Args:
+            chunk (AIMessageChunk): The message chunk.
+
+        Returns:
+            str: The new answer text, empty if the chunk adds none.
+        """
+        # Every generation of the ReAct loop is a new message, whose tool calls are numbered from 0 again
+        if chunk.id != self.message_id:
+            self.message_id = chunk.id
+            self.tool_calls = {}
+
+        new_text = ""
+
+        for tool_call_chunk in chunk.tool_call_chunks:
+            # Only the first chunk of a tool call holds its name
+            tool_call = self.tool_calls.setdefault(tool_call_chunk.get('index'), {"name" : None, "args" : ""})
+            tool_call['name'] = tool_call['name'] or tool_call_chunk.get('name')
+            tool_call['args'] += tool_call_chunk.get('args') or ""
+
+            if tool_call['name'] != self.answer_tool:
+                continue
+
+            args = parse_partial_json(tool_call['args'])
+            answer = args.get('answer') if isinstance(args, dict) else None
+
+            # A partially parsed escape sequence can change the end of the text, which is emitted once complete
+            if isinstance(answer, str) and answer.startswith(self.emitted) and len(answer) > len(self.emitted):
+                new_text += answer[len(self.emitted):]
+                self.emitted = answer
+
+        return new_text
+
+
+def format_sources(retrieved_docs : list) -> list[dict]:
+    """
+    Describes the retrieved documents, numbered as in the context of the answer generation.
+
+    Args:
+        retrieved_docs (list): The retrieved documents.
+
+    Returns:
+        list[dict]: The chunk number, company, report year and pages of every document.
+    """
+    return [
+        {
+            "chunk" : doc_idx + 1,
+            "company_symbol" : doc.metadata.get('company_symbol'),
+            "report_year" : doc.metadata.get('report_year'),
+            "page_num" : doc.metadata.get('page_num')
+        }
+        for doc_idx, doc in enumerate(retrieved_docs)
+    ]
+
+
+async def stream_events(graph, messages : list) -> AsyncIterator[tuple[str, dict]]:
+    """
+    Runs the graph and yields its progress as it happens: the rewritten query, the retrieved sources, the calculator
+    calls and their results, the tokens of the answer and finally the answer with its citations.
+
+    Args:
+        graph: The compiled graph.
+        messages (list): The conversation history.
+
+    Yields:
+        tuple[str, dict]: The event type and its payload.
+    """
+    answer_parser = AnswerTokenParser()
+    final_state = {"answer" : "", "user_intention" : None, "citations" : []}
+
+    async for stream_mode, payload in graph.astream({"messages" : messages}, stream_mode = ["updates", "messages"]):
+
+        if stream_mode == "messages":
+            chunk, metadata = payload
+            # The rewrite also streams its structured output, only the tokens of the answer generation are forwarded
+            if metadata.get('langgraph_node') == 'generate_answer' and isinstance(chunk, AIMessageChunk):
+                new_text = answer_parser(chunk)
+                if new_text: yield "token", {"text" : new_text}
+            continue
+
+        for node_name, update in payload.items():
+            update = update or {}
+            final_state.update({key : value for key, value in update.items() if key in final_state})
+
+            if node_name == 'rewrite_query':
+                yield "rewrite", {"user_question" : update.get('user_question'), "user_intention" : update.get('user_intention'), "search_filters" : update.get('search_filters')}
+            elif 'formatted_docs' in update and update.get('retrieved_docs'):
+                # The sources are final once formatted, after the retrieval or after the context packing
+                yield "sources", {"sources" : format_sources(update['retrieved_docs'])}
+            elif node_name == 'generate_answer':
+                for tool_call in update['messages'][-1].tool_calls:
+                    if tool_call['name'] != answer_parser.answer_tool:
+                        yield "tool_call", {"name" : tool_call['name'], "args" : tool_call['args']}
+            elif node_name == 'tools':
+                for tool_message in update['messages']:
+                    yield "tool_result", {"name" : tool_message.name, "content" : str(tool_message.content)}
+
+    yield "citations", final_state
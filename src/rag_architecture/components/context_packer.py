@@ -0,0 +1,203 @@
+import tiktoken
+from langchain_community.document_transformers import LongContextReorder
+from langchain_core.documents import Document
+from src.index_ingestion.chunk_store import CHUNK_ID_KEY
+from src.index_ingestion.text_utils import chunk_header, expand_page_num, format_page_num
+from src.rag_architecture.components.schemas import State
+from src.rag_architecture.components.utils import format_doc
+
+
+class ContextPacker:
+    """
+    Class to pack the retrieved chunks into the context of the answer generation. Consecutive chunks of the same
+    report are merged into a single chunk without the text they overlap on, and the chunks are fitted into a token
+    budget by decreasing relevance.
+    """
+
+    def __init__(self, max_tokens : int = 2000, encoding_name : str = 'o200k_base', min_overlap : int = 16):
+        """
+        Initializes the ContextPacker.
+
+        Args:
+            max_tokens (int, optional): Token budget of the retrieved context. Defaults to 2000.
+            encoding_name (str, optional): Tiktoken encoding used to count the tokens. Defaults to 'o200k_base', the encoding of the GPT-4.1 models.
+            min_overlap (int, optional): Minimum number of characters two consecutive chunks must share to be treated as overlapping. Defaults to 16.
+        """
+        self.max_tokens = max_tokens
+        self.encoding = tiktoken.get_encoding(encoding_name)
+        self.min_overlap = min_overlap
+
+    def count_tokens(self, doc : Document) -> int:
+        """
+        Counts the tokens of a chunk as formatted in the context.
+
+        Args:
+            doc (Document): The chunk.
+
+        Returns:
+            int: The number of tokens.
+        """
+        return len(self.encoding.encode(format_doc([doc])))
+
+    def merge_text(self, first_text : str, second_text : str) -> str:
+        """
+        Concatenates the texts of two consecutive chunks, keeping their overlapping text once.
+
+        Args:
+            first_text (str): Text of the first chunk, without its header.
+            second_text (str): Text of the next chunk, without its header.
+
+        Returns:
+            str: The merged text.
+        """
+        # The next chunk starts with the end of the previous chunk, the longest such overlap is the one made by the chunker
+        for overlap in range(min(len(first_text), len(second_text)), self.min_overlap - 1, -1):
+            if first_text.endswith(second_text[:overlap]):
+                return first_text + second_text[overlap:]
+
+        return first_text + '\n' + second_text
+
+    def merge_chunks(self, chunks : list[Document]) -> Document:
+        """
+        Merges consecutive chunks of a report into a single chunk.
+
+        Args:
+            chunks (list[Document]): The chunks, in report order.
+
+        Returns:
+            Document: The merged chunk, with the chunk id of the first chunk and the ids of every merged chunk in 'merged_chunk_ids'.
+        """
+        page_num = format_page_num(set().union(*(expand_page_num(chunk.metadata['page_num']) for chunk in chunks)))
+        text = chunks[0].page_content.partition('\n')[2]
+
+        for chunk in chunks[1:]:
+            text = self.merge_text(text, chunk.page_content.partition('\n')[2])
+
+        metadata = {
+            **chunks[0].metadata,
+            'page_num' : page_num,
+            'contain_img' : any(chunk.metadata.get('contain_img', False) for chunk in chunks),
+            'contain_table' : any(chunk.metadata.get('contain_table', False) for chunk in chunks),
+            'merged_chunk_ids' : [chunk.metadata[CHUNK_ID_KEY] for chunk in chunks]
+        }
+
+        return Document(id = chunks[0].id, page_content = '\n'.join([chunk_header(metadata, page_num), text]), metadata = metadata)
+
+    def merge_adjacent(self, docs : list[Document]) -> list[Document]:
+        """
+        Merges the runs of consecutive chunks of the same report. Chunk ids are '{symbol}/{year}/{index}', so chunks
+        of a report are consecutive when their indices are.
+
+        Args:
+            docs (list[Document]): The chunks, by decreasing relevance.
+
+        Returns:
+            list[Document]: The chunks with the consecutive chunks merged, ranked by their most relevant chunk.
+        """
+        reports = {}
+        for rank, doc in enumerate(docs):
+            report_id, _, chunk_idx = doc.metadata.get(CHUNK_ID_KEY, '').rpartition('/')
+            if chunk_idx.isdigit():
+                reports.setdefault(report_id, []).append((int(chunk_idx), rank))
+
+        merged_docs = {rank : doc for rank, doc in enumerate(docs)}
+
+        for report_chunks in reports.values():
+            report_chunks.sort()
+            run = [report_chunks[0]]
+
+            for chunk_idx, rank in report_chunks[1:] + [(None, None)]:
+                if chunk_idx is not None and chunk_idx == run[-1][0] + 1:
+                    run.append((chunk_idx, rank))
+                    continue
+
+                if len(run) > 1:
+                    # The merged chunk takes the place of its most relevant chunk
+                    for _, run_rank in run: del merged_docs[run_rank]
+                    merged_docs[min(run_rank for _, run_rank in run)] = self.merge_chunks([docs[run_rank] for _, run_rank in run])
+
+                run = [(chunk_idx, rank)]
+
+        return [merged_docs[rank] for rank in sorted(merged_docs)]
+
+    def fit_budget(self, docs : list[Document]) -> list[Document]:
+        """
+        Keeps the most relevant chunks fitting in the token budget. The most relevant chunk is truncated if it does not fit on its own.
+
+        Args:
+            docs (list[Document]): The chunks, by decreasing relevance.
+
+        Returns:
+            list[Document]: The chunks fitting in the budget, by decreasing relevance.
+        """
+        packed_docs = []
+        remaining_tokens = self.max_tokens
+
+        for doc in docs:
+            num_tokens = self.count_tokens(doc)
+
+            if num_tokens <= remaining_tokens:
+                packed_docs.append(doc)
+                remaining_tokens -= num_tokens
+            elif len(packed_docs) == 0:
+                packed_docs.append(self.truncate(doc, remaining_tokens))
+                remaining_tokens = 0
+
+        return packed_docs
+
+    def truncate(self, doc : Document, max_tokens : int) -> Document:
+        """
+        Truncates the text of a chunk so the chunk, as formatted in the context with its header, fits in a number of tokens.
+
+        Args:
+            doc (Document): The chunk.
+            max_tokens (int): Maximum number of tokens of the formatted chunk.
+
+        Returns:
+            Document: The truncated chunk.
+        """
+        content_tokens = self.encoding.encode(doc.page_content)
+        header_tokens = self.count_tokens(Document(page_content = "", metadata = doc.metadata))
+        num_kept = max(0, max_tokens - header_tokens)
+        truncated = Document(id = doc.id, page_content = self.encoding.decode(content_tokens[:num_kept]), metadata = doc.metadata)
+
+        # Tokens can merge differently where the header meets the text, so the text is shortened until the chunk fits
+        while num_kept > 0 and self.count_tokens(truncated) > max_tokens:
+            num_kept -= 1
+            truncated = Document(id = doc.id, page_content = self.encoding.decode(content_tokens[:num_kept]), metadata = doc.metadata)
+
+        return truncated
+
+    def __call__(self, docs : list[Document]) -> list[Document]:
+        """
+        Packs the retrieved chunks.
+
+        Args:
+            docs (list[Document]): The retrieved chunks, by decreasing relevance.
+
+        Returns:
+            list[Document]: The packed chunks, by decreasing relevance.
+        """
+        return self.fit_budget(self.merge_adjacent(docs))
+
+
+def pack_context(state : State, context_packer : ContextPacker) -> State:
+    """
+    Packs the retrieved documents into the context of the answer generation. The packed documents replace the retrieved
+    documents, so the chunk numbers cited by the answer refer to the packed documents.
+
+    Args:
+        state (State): Graph state containing the retrieved documents, by decreasing relevance.
+        context_packer (ContextPacker): The context packer.
+
+    Returns:
+        State: An updated state with the packed and formatted documents.
+    """
+    packed_docs = context_packer(state.retrieved_docs)
+
+    # Reordering and formatting the packed documents to prevent lost in the middle issue
+    context_reorder = LongContextReorder()
+    reordered_docs = context_reorder.transform_documents(packed_docs)
+    formatted_docs = format_doc(reordered_docs)
+
+    return {"formatted_docs" : formatted_docs, "retrieved_docs" : reordered_docs}
@@ -0,0 +1,125 @@
+from copy import deepcopy
+import numpy as np
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import BaseDocumentCompressor, Document
+from pydantic import ConfigDict
+from typing_extensions import Any, ClassVar, Optional, Sequence
+from src.index_ingestion.chunk_store import CHUNK_ID_KEY
+
+
+def min_max_normalize(scores : np.ndarray) -> np.ndarray:
+    """
+    Rescales scores to [0, 1].
+
+    Args:
+        scores (np.ndarray): The scores to rescale.
+
+    Returns:
+        np.ndarray: The rescaled scores, all 0 when every score is equal.
+    """
+    score_range = scores.max() - scores.min()
+    return (scores - scores.min()) / score_range if score_range > 0 else np.zeros_like(scores)
+
+
+class EmbeddingRerank(BaseDocumentCompressor):
+    """
+    Local reranker scoring the candidate chunks by the cosine similarity of their embeddings, already stored in the
+    vector store, to the query embedding, already computed by the dense retrieval and served from the embedding cache.
+    The similarity can be fused with the BM25 scores of the candidates. Reranking makes no request to a provider
+    when the embedding cache is configured.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed = True)
+
+    uses_indexes : ClassVar[bool] = True
+    """ The graph constructor passes the vector store, embedding and lexical retriever to the reranker. """
+
+    vectorstore : Any = None
+    """ The vector store holding the chunk embeddings, a Chroma collection or a store with a get_embeddings method. """
+    embedding : Any = None
+    """ The embedding model of the vector store, ideally wrapped in the embedding cache. """
+    lexical_retriever : Any = None
+    """ The lexical retriever scoring the candidates with BM25, must have a score_documents method. """
+    top_n : int = 3
+    """ Number of documents to return. """
+    bm25_weight : float = 0.0
+    """ Weight of the normalised BM25 scores in the fused score, 0 to rank by embedding similarity only. """
+    id_key : str = CHUNK_ID_KEY
+    """ Metadata key of the chunk ids. """
+
+    def get_embeddings(self, doc_ids : list[str]) -> np.ndarray:
+        """
+        Reads the stored embeddings of some chunks from the vector store.
+
+        Args:
+            doc_ids (list[str]): Ids of the chunks.
+
+        Returns:
+            np.ndarray: The normalised embedding of every chunk, in the order of the ids. Chunks missing from the vector store get a zero vector.
+        """
+        if hasattr(self.vectorstore, 'get_embeddings'):
+            embeddings = self.vectorstore.get_embeddings(doc_ids)
+        else:
+            stored = self.vectorstore.get(ids = doc_ids, include = ['embeddings'])
+            # Chroma does not return the embeddings in the order of the requested ids
+            stored_embeddings = dict(zip(stored['ids'], stored['embeddings']))
+            dim = len(next(iter(stored_embeddings.values()))) if len(stored_embeddings) > 0 else 0
+            embeddings = np.zeros((len(doc_ids), dim), dtype = np.float32)
+
+            for row, doc_id in enumerate(doc_ids):
+                if doc_id in stored_embeddings: embeddings[row] = stored_embeddings[doc_id]
+
+        return embeddings / np.maximum(np.linalg.norm(embeddings, axis = 1, keepdims = True), 1e-12)
+
+    def score(self, query : str, doc_ids : list[str]) -> np.ndarray:
+        """
+        Scores the candidate chunks against the query.
+
+        Args:
+            query (str): The search query.
+            doc_ids (list[str]): Ids of the candidate chunks.
+
+        Returns:
+            np.ndarray: The relevance score of every chunk.
+        """
+        embeddings = self.get_embeddings(doc_ids)
+        if embeddings.shape[1] == 0:
+            return np.zeros(len(doc_ids))
+
+        query_vector = np.asarray(self.embedding.embed_query(query), dtype = np.float32)
+        similarities = embeddings @ (query_vector / max(np.linalg.norm(query_vector), 1e-12))
+
+        if self.bm25_weight <= 0 or not hasattr(self.lexical_retriever, 'score_documents'):
+            return similarities
+
+        # Cosine similarities and BM25 scores live on different scales, so both are rescaled over the candidates before fusing
+        bm25_scores = self.lexical_retriever.score_documents(query, doc_ids)
+        return (1 - self.bm25_weight) * min_max_normalize(similarities) + self.bm25_weight * min_max_normalize(bm25_scores)
+
+    def compress_documents(self, documents : Sequence[Document], query : str, callbacks : Optional[Callbacks] = None) -> Sequence[Document]:
+        """
+        Reranks the documents and keeps the top_n best scoring ones.
+
+        Args:
+            documents (Sequence[Document]): The candidate documents.
+            query (str): The search query.
+            callbacks (Optional[Callbacks], optional): Callbacks to run during the compression. Defaults to None.
+
+        Returns:
+            Sequence[Document]: The top_n documents by decreasing relevance, with their relevance_score in the metadata.
+        """
+        documents = list(documents)
+        if len(documents) == 0: return []
+
+        scores = self.score(query, [doc.metadata.get(self.id_key, doc.id) for doc in documents])
+        # The sort is stable, so documents with the same score keep the order of the hybrid search
+        ranking = np.argsort(-scores, kind = 'stable')[:self.top_n]
+        reranked_docs = []
+
+        for doc_pos in ranking:
+            doc = documents[doc_pos]
+            reranked_doc = Document(page_content = doc.page_content, metadata = deepcopy(doc.metadata), id = doc.id)
+            reranked_doc.metadata['relevance_score'] = float(scores[doc_pos])
+            reranked_docs.append(reranked_doc)
+
+        return reranked_docs
@@ -1,3 +1,4 @@
+from src.index_ingestion.text_utils import expand_page_num
 from src.rag_architecture.components.schemas import State
 
 
@@ -24,12 +25,8 @@ def extract_answer(state: State) -> State:
 
             if doc_idx + 1 in citations:
 
-                if '-' in doc.metadata['page_num']:
-                    start_page, end_page = map(int, doc.metadata['page_num'].split('-'))
-                    expanded_pages = list(range(start_page, end_page + 1))
-                else:
-                    expanded_pages = [int(doc.metadata['page_num'])]
-
+                # Merged chunks may span non-contiguous pages, e.g. '3-5,8'
+                expanded_pages = sorted(expand_page_num(doc.metadata['page_num']))
 
                 for expanded_page in expanded_pages:
                     doc_name =f"pdf/{doc.metadata['company_symbol']}/{doc.metadata['report_year']}/page_{expanded_page}.pdf"
@@ -37,7 +37,37 @@ def generate_answer(state : State, generator_llm : BaseChatModel) -> State:
     Returns:
         State: Updated state with generated messages.
     """
-    
+    generate_chain = build_generate_chain(generator_llm)
+    response = generate_chain.invoke({"context" : state.formatted_docs, 'messages' : state.messages})
+    return {"messages" : [response]}
+
+
+async def agenerate_answer(state : State, generator_llm : BaseChatModel) -> State:
+    """
+    Async version of generate_answer, awaiting the language model instead of blocking a thread.
+
+    Args:
+        state (State): Graph state containing context and messages.
+        generator_llm (BaseChatModel): Language model for generating answers.
+
+    Returns:
+        State: Updated state with generated messages.
+    """
+    generate_chain = build_generate_chain(generator_llm)
+    response = await generate_chain.ainvoke({"context" : state.formatted_docs, 'messages' : state.messages})
+    return {"messages" : [response]}
+
+
+def build_generate_chain(generator_llm : BaseChatModel):
+    """
+    Builds the answer generation chain.
+
+    Args:
+        generator_llm (BaseChatModel): Language model for generating answers.
+
+    Returns:
+        Runnable: The answer generation chain.
+    """
     generate_pt = ChatPromptTemplate(
         [
             ('system', generate_prompt),
@@ -45,7 +75,4 @@ def generate_answer(state : State, generator_llm : BaseChatModel) -> State:
         ]
     )
 
-
-    generate_chain = generate_pt | generator_llm
-    response = generate_chain.invoke({"context" : state.formatted_docs, 'messages' : state.messages})
-    return {"messages" : [response]}
\ No newline at end of file
+    return generate_pt | generator_llm
@@ -0,0 +1,173 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables.config import patch_config, run_in_executor
+from pydantic import PrivateAttr
+from typing_extensions import Any, List, Optional
+from src.index_ingestion.chunk_store import CHUNK_ID_KEY
+
+# Metadata key of the fused score of a document
+FUSED_SCORE_KEY = 'fused_score'
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever running several retrievers (e.g. lexical and dense search) concurrently and fusing their results with
+    weighted reciprocal rank fusion by chunk id. Every retriever has its own timeout, a retriever that times out or
+    fails is left out of the fusion instead of failing the search.
+    """
+
+    retrievers : List[BaseRetriever]
+    """ The retrievers to run. """
+    weights : List[float]
+    """ Weight of every retriever in the fusion. """
+    names : List[str]
+    """ Name of every retriever, used in the latency statistics. """
+    timeouts : List[Optional[float]]
+    """ Timeout in seconds of every retriever, None to wait without limit. """
+    c : int = 60
+    """ Constant added to the rank of a document, controlling the balance between high and low ranked documents. """
+    id_key : str = CHUNK_ID_KEY
+    """ Metadata key identifying a document across retrievers. """
+    latency_window : int = 1000
+    """ Number of recent searches kept for the latency statistics. """
+    max_concurrent_searches : int = 1
+    """ Number of searches running at the same time, e.g. the concurrent conversations of a worker, sizing the thread pool. """
+
+    _executor : Any = PrivateAttr(default = None)
+    _latencies : Any = PrivateAttr(default = None)
+    _lock : Any = PrivateAttr(default_factory = threading.Lock)
+
+    def model_post_init(self, __context : Any):
+        if not len(self.retrievers) == len(self.weights) == len(self.names) == len(self.timeouts):
+            raise Exception('ERROR: Every retriever needs a weight, a name and a timeout')
+
+        # Every concurrent search runs all its retrievers at once. A retriever that timed out keeps its thread until it
+        # returns, so the pool has as many threads again for the searches running meanwhile
+        max_workers = 2 * self.max_concurrent_searches * len(self.retrievers)
+        self._executor = ThreadPoolExecutor(max_workers = max_workers, thread_name_prefix = 'hybrid_retriever')
+        self._latencies = {name : deque(maxlen = self.latency_window) for name in self.names}
+
+    def run_retriever(self, retriever : BaseRetriever, query : str, config : dict, leg : dict, **kwargs) -> tuple[list[Document], float]:
+        """
+        Runs a single retriever and measures its latency.
+
+        Args:
+            retriever (BaseRetriever): The retriever to run.
+            query (str): The search query.
+            config (dict): Runnable configuration of the retriever.
+            leg (dict): State of the search shared with the waiting thread, receiving the start time of the retriever
+                in 'start_time' before 'started' is set.
+            **kwargs: Search arguments passed on to the retriever, e.g. filters.
+
+        Returns:
+            tuple[list[Document], float]: The retrieved documents and the latency in seconds.
+        """
+        leg['start_time'] = time.perf_counter()
+        leg['started'].set()
+        docs = retriever.invoke(query, config, **kwargs)
+        return docs, time.perf_counter() - leg['start_time']
+
+    def _get_relevant_documents(self, query : str, *, run_manager : CallbackManagerForRetrieverRun, **kwargs) -> list[Document]:
+        legs = [{"started" : threading.Event(), "start_time" : None} for _ in self.retrievers]
+        futures = [
+            self._executor.submit(self.run_retriever, retriever, query, patch_config(None, callbacks = run_manager.get_child(tag = f"retriever_{idx + 1}")), leg, **kwargs)
+            for idx, (retriever, leg) in enumerate(zip(self.retrievers, legs))
+        ]
+        retriever_docs = []
+
+        for name, timeout, future, leg in zip(self.names, self.timeouts, futures, legs):
+            # Every timeout counts from the start of its retriever, the time spent waiting for a thread of the pool
+            # is not the retriever being slow. A retriever still waiting after its timeout is cancelled.
+            if not leg['started'].wait(timeout) and future.cancel():
+                print(f"WARNING: {name} retrieval did not start within {timeout}s, continuing without it")
+                retriever_docs.append([])
+                self.record_latency(name, timeout, status = 'timeout')
+                continue
+
+            leg['started'].wait()
+            remaining = None if timeout is None else max(0.0, leg['start_time'] + timeout - time.perf_counter())
+
+            try:
+                docs, latency = future.result(timeout = remaining)
+                self.record_latency(name, latency, status = 'ok')
+            except TimeoutError:
+                print(f"WARNING: {name} retrieval timed out after {timeout}s, continuing without it")
+                docs = []
+                self.record_latency(name, timeout, status = 'timeout')
+            except Exception as e:
+                print(f"WARNING: {name} retrieval failed, continuing without it: {e}")
+                docs = []
+                self.record_latency(name, time.perf_counter() - leg['start_time'], status = 'error')
+
+            retriever_docs.append(docs)
+
+        return self.weighted_reciprocal_rank(retriever_docs)
+
+    async def _aget_relevant_documents(self, query : str, *, run_manager : AsyncCallbackManagerForRetrieverRun, **kwargs) -> list[Document]:
+        # The retrievers run in the thread pool either way, only the wait for their timeouts is moved off the event loop
+        return await run_in_executor(None, self._get_relevant_documents, query, run_manager = run_manager.get_sync(), **kwargs)
+
+    def weighted_reciprocal_rank(self, retriever_docs : list[list[Document]]) -> list[Document]:
+        """
+        Fuses the rankings of the retrievers with weighted reciprocal rank fusion.
+
+        Args:
+            retriever_docs (list[list[Document]]): The ranked documents of every retriever.
+
+        Returns:
+            list[Document]: The unique documents, by decreasing fused score, with their fused score in the metadata.
+        """
+        rrf_scores = {}
+        unique_docs = {}
+
+        for docs, weight in zip(retriever_docs, self.weights):
+            for rank, doc in enumerate(docs, start = 1):
+                doc_id = doc.metadata.get(self.id_key, doc.id)
+                rrf_scores[doc_id] = rrf_scores.get(doc_id, 0.0) + weight / (rank + self.c)
+                unique_docs.setdefault(doc_id, doc)
+
+        for doc_id, doc in unique_docs.items():
+            doc.metadata[FUSED_SCORE_KEY] = rrf_scores[doc_id]
+
+        # The sort is stable, so documents with the same score keep the order in which they were first retrieved
+        return sorted(unique_docs.values(), key = lambda doc : rrf_scores[doc.metadata.get(self.id_key, doc.id)], reverse = True)
+
+    def record_latency(self, name : str, latency : float, status : str):
+        """
+        Records the latency and outcome of a retriever.
+
+        Args:
+            name (str): Name of the retriever.
+            latency (float): Latency in seconds.
+            status (str): 'ok', 'timeout' or 'error'.
+        """
+        with self._lock:
+            self._latencies[name].append((latency, status))
+
+    def get_latency_stats(self) -> dict:
+        """
+        Returns the latency statistics of every retriever over the recent searches.
+
+        Returns:
+            dict: For every retriever, the number of searches, the mean and 95th percentile latency in milliseconds of
+                the successful searches, and the number of timeouts and errors.
+        """
+        stats = {}
+
+        with self._lock:
+            for name, records in self._latencies.items():
+                latencies = sorted(latency for latency, status in records if status == 'ok')
+                stats[name] = {
+                    "searches" : len(records),
+                    "mean_ms" : 1000 * sum(latencies) / len(latencies) if latencies else None,
+                    "p95_ms" : 1000 * latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] if latencies else None,
+                    "timeouts" : sum(status == 'timeout' for _, status in records),
+                    "errors" : sum(status == 'error' for _, status in records),
+                }
+
+        return stats
@@ -0,0 +1,158 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from langchain_core.documents import Document
+
+
+class IndexVersion:
+    """ Class to read the index version recorded in the ingestion manifest, re-reading the manifest only when it changes. """
+
+    def __init__(self, manifest_path : str):
+        """
+        Initializes the IndexVersion.
+
+        Args:
+            manifest_path (str): Path to the ingestion manifest.
+        """
+        self.manifest_path = manifest_path
+        self.mtime = None
+        self.version = None
+
+    def __call__(self) -> str:
+        """
+        Returns the current index version.
+
+        Returns:
+            str: The index version, or None if the manifest does not exist or has no version.
+        """
+        try:
+            mtime = os.stat(self.manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+        if mtime != self.mtime:
+            with open(self.manifest_path, 'r') as f:
+                self.version = json.load(f).get('index_version')
+            self.mtime = mtime
+
+        return self.version
+
+
+class RetrievalCache:
+    """
+    Class to cache the documents retrieved for a query, bounded in size (least recently used entries are evicted first)
+    and in time (entries expire after a time-to-live). The cache is cleared when the index version changes.
+    """
+
+    def __init__(self, max_size : int = 256, ttl_seconds : float = 3600, version_func : callable = None):
+        """
+        Initializes the RetrievalCache.
+
+        Args:
+            max_size (int, optional): Maximum number of cached queries. Defaults to 256.
+            ttl_seconds (float, optional): Number of seconds a cached query stays valid. Defaults to 3600.
+            version_func (callable, optional): Function returning the current index version. Defaults to None.
+        """
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.version_func = version_func
+        self.version = version_func() if version_func is not None else None
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def make_key(self, query : str, filters : dict) -> tuple:
+        """
+        Builds the cache key of a query. Case, repeated whitespace and trailing punctuation do not change the key.
+
+        Args:
+            query (str): The rewritten user question.
+            filters (dict): The search filters of the query.
+
+        Returns:
+            tuple: The cache key.
+        """
+        normalized_query = re.sub(r"\s+", " ", query).strip().rstrip("?!. ").casefold()
+        return normalized_query, json.dumps(filters or {}, sort_keys=True)
+
+    def check_version(self):
+        """ Clears the cache if the index version changed since the entries were cached. Must hold the lock. """
+        if self.version_func is None: return
+
+        version = self.version_func()
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+            self.invalidations += 1
+
+    def get(self, query : str, filters : dict) -> list[Document]:
+        """
+        Returns the cached documents of a query.
+
+        Args:
+            query (str): The rewritten user question.
+            filters (dict): The search filters of the query.
+
+        Returns:
+            list[Document]: The cached documents, or None if the query is not cached or its entry expired.
+        """
+        key = self.make_key(query, filters)
+
+        with self.lock:
+            self.check_version()
+            entry = self.entries.get(key)
+
+            if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+                if entry is not None: del self.entries[key]
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[1])
+
+    def put(self, query : str, filters : dict, docs : list[Document]):
+        """
+        Caches the documents retrieved for a query.
+
+        Args:
+            query (str): The rewritten user question.
+            filters (dict): The search filters of the query.
+            docs (list[Document]): The retrieved documents.
+        """
+        key = self.make_key(query, filters)
+
+        with self.lock:
+            self.check_version()
+            self.entries[key] = (time.monotonic(), tuple(docs))
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last = False)
+                self.evictions += 1
+
+    def clear(self):
+        """ Removes every cached query. """
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self) -> dict:
+        """
+        Returns the cache statistics.
+
+        Returns:
+            dict: Number of hits, misses, hit rate, evictions, invalidations by index changes and cached queries.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits" : self.hits,
+                "misses" : self.misses,
+                "hit_rate" : self.hits / lookups if lookups > 0 else 0.0,
+                "evictions" : self.evictions,
+                "invalidations" : self.invalidations,
+                "size" : len(self.entries),
+            }
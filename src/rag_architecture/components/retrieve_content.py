@@ -1,27 +1,84 @@
 from src.rag_architecture.components.schemas import State
 from langchain_community.document_transformers import LongContextReorder
 from langchain_core.retrievers import BaseRetriever
+from langchain_core.documents import Document
 from src.rag_architecture.components.utils import format_doc
+from src.rag_architecture.components.retrieval_cache import RetrievalCache
+from src.rag_architecture.components.adaptive_depth import AdaptiveDepth
 from dotenv import load_dotenv
 load_dotenv()
 
-def retrieve_content(state : State, retriever : BaseRetriever) -> State:
+def retrieve_content(state : State, retriever : BaseRetriever, retrieval_cache : RetrievalCache = None, adaptive_depth : AdaptiveDepth = None, reorder : bool = True) -> State:
     """
-    Retrieves relevant documents based on the user's question in the state.
+    Retrieves relevant documents based on the user's question in the state, restricted to the companies
+    and report years of the search filters.
 
     Args:
-        state (State): Graph state containing the user question.
+        state (State): Graph state containing the user question and search filters.
         retriever (BaseRetriever): Retriever to fetch relevant documents.
+        retrieval_cache (RetrievalCache, optional): Cache of the documents retrieved for recent queries. Defaults to None.
+        adaptive_depth (AdaptiveDepth, optional): Cuts the retrieved documents where their scores drop. Defaults to None, keeping every document.
+        reorder (bool, optional): Reorders and formats the documents for the answer generation. Disabled when the context packer
+            does it after packing, which needs the documents by decreasing relevance. Defaults to True.
 
     Returns:
         State: An updated state with retrieved and formatted documents.
     """
-    # Retrieving documents using the retriever
-    retrieved_docs = retriever.invoke(state.user_question)
+    # Retrieving documents using the retriever, unless the same query was retrieved recently
+    retrieved_docs = retrieval_cache.get(state.user_question, state.search_filters) if retrieval_cache is not None else None
+
+    if retrieved_docs is None:
+        retrieved_docs = retriever.invoke(state.user_question, filters = state.search_filters)
+        if retrieval_cache is not None: retrieval_cache.put(state.user_question, state.search_filters, retrieved_docs)
+
+    return prepare_docs(retrieved_docs, adaptive_depth, reorder)
+
+
+async def aretrieve_content(state : State, retriever : BaseRetriever, retrieval_cache : RetrievalCache = None, adaptive_depth : AdaptiveDepth = None, reorder : bool = True) -> State:
+    """
+    Async version of retrieve_content, awaiting the retriever instead of blocking a thread.
+
+    Args:
+        state (State): Graph state containing the user question and search filters.
+        retriever (BaseRetriever): Retriever to fetch relevant documents.
+        retrieval_cache (RetrievalCache, optional): Cache of the documents retrieved for recent queries. Defaults to None.
+        adaptive_depth (AdaptiveDepth, optional): Cuts the retrieved documents where their scores drop. Defaults to None, keeping every document.
+        reorder (bool, optional): Reorders and formats the documents for the answer generation. Defaults to True.
+
+    Returns:
+        State: An updated state with retrieved and formatted documents.
+    """
+    retrieved_docs = retrieval_cache.get(state.user_question, state.search_filters) if retrieval_cache is not None else None
+
+    if retrieved_docs is None:
+        retrieved_docs = await retriever.ainvoke(state.user_question, filters = state.search_filters)
+        if retrieval_cache is not None: retrieval_cache.put(state.user_question, state.search_filters, retrieved_docs)
+
+    return prepare_docs(retrieved_docs, adaptive_depth, reorder)
+
+
+def prepare_docs(retrieved_docs : list[Document], adaptive_depth : AdaptiveDepth = None, reorder : bool = True) -> State:
+    """
+    Cuts the retrieved documents at the adaptive depth, then reorders and formats them.
+
+    Args:
+        retrieved_docs (list[Document]): The retrieved documents, by decreasing relevance.
+        adaptive_depth (AdaptiveDepth, optional): Cuts the retrieved documents where their scores drop. Defaults to None, keeping every document.
+        reorder (bool, optional): Reorders and formats the documents for the answer generation. Defaults to True.
+
+    Returns:
+        State: An updated state with retrieved and formatted documents.
+    """
+    # The cache holds every retrieved document, so the depth is chosen again on a hit
+    if adaptive_depth is not None:
+        retrieved_docs = adaptive_depth(retrieved_docs)
+
+    if not reorder:
+        return {"retrieved_docs" : retrieved_docs}
+
     # Reordering and formatting the retrieved documents to prevent lost in the middle issue
     context_reorder = LongContextReorder()
     reordered_docs = context_reorder.transform_documents(retrieved_docs)
     formatted_docs = format_doc(reordered_docs)
 
     return {"formatted_docs" : formatted_docs ,"retrieved_docs" : reordered_docs}
-
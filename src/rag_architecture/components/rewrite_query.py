@@ -1,5 +1,6 @@
 from src.rag_architecture.components.schemas import  State
 from src.rag_architecture.components.schemas import RewriteOutput
+from src.rag_architecture.components.search_filters import build_search_filters
 from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.prompts.chat import ChatPromptTemplate
 from langchain_core.prompts.chat import MessagesPlaceholder
@@ -32,14 +33,56 @@ Additionally, your should include company names only if they are related to the
 
 -**Unrelated Question**: A user’s query that is not about fundamental analysis of any company and does not fall under financial evaluation, business performance, valuation, or shareholder returns. These questions are typically general, conversational, or about topics outside the scope of company financial analysis.
 
+3. Search Filters: If the rewritten query is about specific companies from the provided list, return their symbols. If it asks about specific fiscal years, return those years.
+
 I will tip you $2,000 if you honestly and accurately identify whether the rewritten query qualifies as a fundamental analysis question, correctly classify the user’s intention, and clearly distinguish it from non-fundamental or unrelated questions.
 Additionally, I will you another $500 if you do not attempt to rewrite to fix a user question that is ill-worded or contain many typos."""
 
-def rewrite_query(state : State, rewrite_llm : BaseChatModel , company_info : List) -> State:
+def rewrite_query(state : State, rewrite_llm : BaseChatModel , company_info : List, company_symbols : List = None, filter_config : dict = None) -> State:
     """
     Rewrites the user query based on conversation history and company information, as well
-    classifying the user's intention.
+    classifying the user's intention and extracting the companies and years to restrict the retrieval to.
+
+
+    Args:
+        state (State): Graph state containing conversation messages.
+        rewrite_llm (BaseChatModel): Language model for rewriting the query.
+        company_info (List): List of company names and symbols whose information are available.
+        company_symbols (List, optional): List of the symbols of the available companies. Defaults to None.
+        filter_config (dict, optional): Configuration for the search filters. Defaults to None, which disables filtering.
+
+    Returns:
+        State: An updated state with the rewritten user question, user intention and search filters.
+    """
+    rewrite_chain, rewrite_input = build_rewrite_chain(state, rewrite_llm, company_info)
+    rewrite_output = rewrite_chain.invoke(rewrite_input)
+
+    return parse_rewrite_output(rewrite_output, company_symbols, filter_config)
+
+
+async def arewrite_query(state : State, rewrite_llm : BaseChatModel , company_info : List, company_symbols : List = None, filter_config : dict = None) -> State:
+    """
+    Async version of rewrite_query, awaiting the language model instead of blocking a thread.
+
+    Args:
+        state (State): Graph state containing conversation messages.
+        rewrite_llm (BaseChatModel): Language model for rewriting the query.
+        company_info (List): List of company names and symbols whose information are available.
+        company_symbols (List, optional): List of the symbols of the available companies. Defaults to None.
+        filter_config (dict, optional): Configuration for the search filters. Defaults to None, which disables filtering.
+
+    Returns:
+        State: An updated state with the rewritten user question, user intention and search filters.
+    """
+    rewrite_chain, rewrite_input = build_rewrite_chain(state, rewrite_llm, company_info)
+    rewrite_output = await rewrite_chain.ainvoke(rewrite_input)
 
+    return parse_rewrite_output(rewrite_output, company_symbols, filter_config)
+
+
+def build_rewrite_chain(state : State, rewrite_llm : BaseChatModel, company_info : List) -> tuple:
+    """
+    Builds the query rewriting chain and its input.
 
     Args:
         state (State): Graph state containing conversation messages.
@@ -47,7 +90,7 @@ def rewrite_query(state : State, rewrite_llm : BaseChatModel , company_info : Li
         company_info (List): List of company names and symbols whose information are available.
 
     Returns:
-        State: An updated state with the rewritten user question and user intention.
+        tuple: The rewriting chain and its input.
     """
     # Trim conversation history to select the last 10 messages
     messages = trim_messages(messages = state.messages, token_counter = len,  max_tokens = 10, start_on = "human")
@@ -59,11 +102,34 @@ def rewrite_query(state : State, rewrite_llm : BaseChatModel , company_info : Li
     )
     # Rewrite the user query using the language model and prompt template
     rewrite_chain = rewrite_pt | rewrite_llm.with_structured_output(RewriteOutput)
-    rewrite_output = rewrite_chain.invoke({"companies" : ",".join(company_info), "conversation_history" : messages})
 
+    return rewrite_chain, {"companies" : ",".join(company_info), "conversation_history" : messages}
+
+
+def parse_rewrite_output(rewrite_output : RewriteOutput, company_symbols : List = None, filter_config : dict = None) -> State:
+    """
+    Turns the output of the rewriting chain into a state update.
+
+    Args:
+        rewrite_output (RewriteOutput): Output of the rewriting chain.
+        company_symbols (List, optional): List of the symbols of the available companies. Defaults to None.
+        filter_config (dict, optional): Configuration for the search filters. Defaults to None, which disables filtering.
+
+    Returns:
+        State: An updated state with the rewritten user question, user intention and search filters.
+    """
     # Extract rewritten query and user intention from the output
     rewritten_query = rewrite_output.rewritten_query
     user_intention = rewrite_output.user_intention
+    search_filters = {}
+
+    if filter_config is not None:
+        search_filters = build_search_filters(
+            company_symbols = rewrite_output.company_symbols if filter_config.filter_companies else [],
+            report_years = rewrite_output.report_years if filter_config.filter_years else [],
+            available_symbols = company_symbols or [],
+            year_window = filter_config.year_window
+        )
 
-    return {"user_question" : rewritten_query, "user_intention" : user_intention}
+    return {"user_question" : rewritten_query, "user_intention" : user_intention, "search_filters" : search_filters}
 
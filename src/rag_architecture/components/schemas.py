@@ -14,15 +14,19 @@ class State(BaseModel):
     messages: Annotated[List[BaseMessage], add_messages] = Field([], title = 'Conversion History', description = 'A list of historical messages between the user and the system.')
     user_question : str = Field("", title="User's Question", description = "The question asked by the user to the RAG system.")
     user_intention: Literal['relevant', 'irrelevant', 'vague', 'unclear', 'general'] = Field('relevant', description = "Intention of the user's question")
+    search_filters : dict = Field({}, title = "Search Filters", description = "The company symbols and report years the retrieval is restricted to")
     retrieved_docs : List[Document] = Field([], title = "Retrieved Documents", description = "A list of documents retrieved to help answer the user's question")
     formatted_docs : str  = Field("", title = "Formatted Documents", description = "The retrieved documents formatted into a readable string")
     answer: str = Field("", title = "Question's Answer", description = "The response provided by the RAG system to the user's question")
     citations: List[str] = Field([], title = "Answer Citation" , description = "The citations from which the answer to the user question was derived from.")
+    answer_cache_hit: bool = Field(False, title = "Answer Cache Hit", description = "Whether the answer was taken from the semantic answer cache")
 
 class RewriteOutput(BaseModel):
     """ Schema for the output of the rewrite query step. """
     rewritten_query : str = Field(..., description = "Rewritten user query that is self-contained and independent of prior conversation history. **DO NOT fix typos, garbled text or incoherent phrasing in any way**. I will penalised you if I catch you fixing  typos, garbled text or incoherent phrasing and imprison you.")
     user_intention: Literal['relevant', 'irrelevant', 'vague', 'unclear', 'general'] = Field(..., description = "User's intention based on the rewritten query. This can either be 'relevant', 'irrelevant', 'vague', 'unclear' or 'general'.")
+    company_symbols: List[str] = Field([], description = "Symbols, taken from the provided company list, of the companies the rewritten query is about. Leave empty if the query does not clearly refer to specific companies.")
+    report_years: List[int] = Field([], description = "Fiscal years the rewritten query asks about (e.g. [2015] for 'What is the total revenue of JPMorgan in 2015?'). Leave empty if the query does not mention specific years.")
     
 class FinalAnswer(BaseModel):
     """
@@ -0,0 +1,84 @@
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStoreRetriever
+from typing_extensions import List
+
+
+def build_search_filters(company_symbols : List[str], report_years : List[int], available_symbols : List[str], year_window : int = 0) -> dict:
+    """
+    Builds the metadata filters of a search from the companies and years extracted from the user's question.
+
+    Args:
+        company_symbols (List[str]): The company symbols mentioned in the question.
+        report_years (List[int]): The years mentioned in the question.
+        available_symbols (List[str]): The symbols of the companies whose reports are indexed.
+        year_window (int, optional): Number of following report years also searched for every year, since annual reports
+            restate the figures of the previous years. Defaults to 0.
+
+    Returns:
+        dict: Mapping of the company_symbol and report_year metadata to their accepted values. Keys without a valid value are left out.
+    """
+    symbol_map = {symbol.upper() : symbol for symbol in available_symbols}
+    filters = {}
+
+    # Drop the symbols that are not indexed, a wrong symbol would otherwise hide every chunk
+    symbols = sorted({symbol_map[symbol.upper()] for symbol in company_symbols if symbol.upper() in symbol_map})
+    if len(symbols) > 0:
+        filters['company_symbol'] = symbols
+
+    years = sorted({str(year + offset) for year in report_years for offset in range(year_window + 1)})
+    if len(years) > 0:
+        filters['report_year'] = years
+
+    return filters
+
+
+def to_chroma_where(filters : dict) -> dict:
+    """
+    Converts search filters to a Chroma where clause.
+
+    Args:
+        filters (dict): Mapping of metadata keys to their accepted values.
+
+    Returns:
+        dict: The where clause, or None if there is nothing to filter.
+    """
+    conditions = [{key : {"$in" : list(values)}} for key, values in filters.items() if values]
+
+    if len(conditions) == 0:
+        return None
+
+    return conditions[0] if len(conditions) == 1 else {"$and" : conditions}
+
+
+class FilteredVectorStoreRetriever(VectorStoreRetriever):
+    """
+    Vector store retriever applying search filters as a native Chroma where clause, or as they are for vector stores
+    accepting search filters (e.g. CompressedFAISS).
+    """
+
+    def filter_kwargs(self, filters : dict, kwargs : dict) -> dict:
+        """
+        Adds the search filters to the search arguments, in the format of the vector store.
+
+        Args:
+            filters (dict): Mapping of metadata keys to their accepted values.
+            kwargs (dict): The other search arguments.
+
+        Returns:
+            dict: The search arguments with the filter.
+        """
+        if getattr(self.vectorstore, 'accepts_search_filters', False):
+            if filters: kwargs['filter'] = filters
+        else:
+            where = to_chroma_where(filters or {})
+            if where is not None: kwargs['filter'] = where
+
+        return kwargs
+
+    def _get_relevant_documents(self, query : str, *, run_manager : CallbackManagerForRetrieverRun, filters : dict = None, **kwargs) -> list[Document]:
+        return super()._get_relevant_documents(query, run_manager = run_manager, **self.filter_kwargs(filters, kwargs))
+
+    async def _aget_relevant_documents(self, query : str, *, run_manager : AsyncCallbackManagerForRetrieverRun, filters : dict = None, **kwargs) -> list[Document]:
+        return await super()._aget_relevant_documents(query, run_manager = run_manager, **self.filter_kwargs(filters, kwargs))
+
@@ -18,6 +18,20 @@ def route_query(state: State) -> Literal['retrieve_content', 'generate_response'
     else:
         return "generate_response"
     
+def route_cached_answer(state: State) -> Literal['retrieve_content', '__end__']:
+    """
+    Ends the graph if the answer was found in the semantic answer cache, otherwise routes to retrieval.
+    Args:
+        state (State): Graph state containing the answer cache outcome.
+
+    Returns:
+        Literal['retrieve_content', '__end__']: The next node to route to.
+    """
+    if state.answer_cache_hit:
+        return "__end__"
+
+    return "retrieve_content"
+
 def should_continue(state : State) -> Literal['extract_answer', 'tools']:
     """ 
     Decides whether to extract the final answer or invoke tools based on the last message.
@@ -1,18 +1,27 @@
-from src.rag_architecture.components.retrieve_content import retrieve_content
-from src.rag_architecture.components.generate_answer import generate_answer
+from src.rag_architecture.components.retrieve_content import retrieve_content, aretrieve_content
+from src.rag_architecture.components.generate_answer import generate_answer, agenerate_answer
 from src.rag_architecture.components.extract_answer import extract_answer
-from src.rag_architecture.components.rewrite_query import rewrite_query
+from src.rag_architecture.components.rewrite_query import rewrite_query, arewrite_query
 from src.rag_architecture.components.generate_response import generate_response
 from src.rag_architecture.components.schemas import State, FinalAnswer
 from langgraph.graph import StateGraph, START, END
-import yfinance as yf
+from src.company_registry import get_company_registry, get_report_symbols
 from typing_extensions import Dict
 from src.mapper import get_class
+from src.stopwatch import Stopwatch
+from src.index_ingestion.embedding_cache import create_embedding
+from src.index_ingestion.text_utils import preprocess_text
+from src.index_ingestion.chunk_store import ChunkStore, ChunkStoreRetriever, CHUNK_ID_KEY
 import pickle
-import os
 from langgraph.prebuilt import ToolNode
-from langchain.retrievers.ensemble import EnsembleRetriever
-from src.rag_architecture.components.utils import calculator, should_continue, route_query
+from langchain_core.runnables import RunnableLambda
+from src.rag_architecture.components.search_filters import FilteredVectorStoreRetriever
+from src.rag_architecture.components.hybrid_retriever import HybridRetriever
+from src.rag_architecture.components.retrieval_cache import RetrievalCache, IndexVersion
+from src.rag_architecture.components.adaptive_depth import AdaptiveDepth
+from src.rag_architecture.components.context_packer import ContextPacker, pack_context
+from src.rag_architecture.components.utils import calculator, should_continue, route_query, route_cached_answer
+from src.rag_architecture.components.answer_cache import SemanticAnswerCache, lookup_answer, store_answer
 from langchain.retrievers.contextual_compression import ContextualCompressionRetriever
 from dotenv import load_dotenv
 load_dotenv()
@@ -28,6 +37,13 @@ class GraphConstructor:
         lexicalstore_config : dict,
         ensemble_config : dict,
         rerank_config: dict = None,
+        chunkstore_path: str = 'storage/chunkstore.db',
+        filter_config: dict = None,
+        cache_config: dict = None,
+        manifest_path: str = 'storage/ingestion_manifest.json',
+        depth_config: dict = None,
+        context_config: dict = None,
+        max_concurrent_searches: int = 1,
     ):
         """
         Initializes the GraphConstructor with the specified configurations.
@@ -39,15 +55,28 @@ class GraphConstructor:
             lexicalstore_config (dict): Configuration for the lexical store.
             ensemble_config (dict): Configuration for the ensemble retriever.
             rerank_config (dict, optional): Configuration for the reranker. Defaults to None.
+            chunkstore_path (str, optional): Path to the chunk store holding the text and metadata of the chunks.
+            filter_config (dict, optional): Configuration for the company and year search filters. Defaults to None, which disables filtering.
+            cache_config (dict, optional): Configuration for the retrieval cache. Defaults to None, which disables caching.
+            manifest_path (str, optional): Path to the ingestion manifest, whose index version invalidates the retrieval cache.
+            depth_config (dict, optional): Configuration for the adaptive retrieval depth. Defaults to None, which keeps every retrieved document.
+            context_config (dict, optional): Configuration for the context packer. Defaults to None, which passes every retrieved document in full.
+            max_concurrent_searches (int, optional): Number of searches running at the same time, sizing the thread pool of the hybrid retriever. Defaults to 1.
         """
         # Defining the tools that the generator model can use
         tools = [calculator, FinalAnswer]
+        # Time spent importing and initializing every component, reported by the startup profiler
+        stopwatch = Stopwatch()
+        self.init_times = stopwatch.times
 
         # Initialize embedding and vectorstore based on the provided configurations
-        embedding = get_class('embedding', vectorstore_config.embedding_class)(**vectorstore_config.embedding_params)
-        vectorstore = get_class('vectorstore', vectorstore_config.vectorstore_class)(embedding_function = embedding, persist_directory=vectorstore_config.vectorstore_path, **vectorstore_config.vectorstore_params)
+        # Query embeddings go through the embedding cache when one is configured, so repeated questions skip the provider
+        self.embedding = create_embedding(vectorstore_config)
+        stopwatch.lap('embedding')
+        self.vectorstore = get_class('vectorstore', vectorstore_config.vectorstore_class)(embedding_function = self.embedding, persist_directory=vectorstore_config.vectorstore_path, **vectorstore_config.vectorstore_params)
         # Initialize retriever from the vectorstore
-        vs_retriever = vectorstore.as_retriever(**vectorstore_config.retriever_params)
+        vs_retriever = FilteredVectorStoreRetriever(vectorstore=self.vectorstore, **vectorstore_config.retriever_params)
+        stopwatch.lap('vectorstore')
 
         self.perform_rerank = rerank_config is not None
 
@@ -55,50 +84,124 @@ class GraphConstructor:
         llm = get_class('llm', generator_config.generator_class)(**generator_config.generator_params)
         # Bind tools to the language model
         llm_w_tools = llm.bind_tools(tools, tool_choice='any', parallel_tool_calls=False)
+        stopwatch.lap('llm')
 
-        # Initialize lexical retriever
-        f = open(lexicalstore_config.lexicalstore_path, 'rb')
-        lexical_retriever = pickle.load(f)
-        lexical_retriever.k = lexicalstore_config.lexicalstore_params.k
+        # Initialize lexical retriever, memory-mapping its index when the lexical store supports it instead of unpickling it
+        lexicalstore_cls = get_class('lexicalstore', lexicalstore_config.lexicalstore_class)
+        if hasattr(lexicalstore_cls, 'load'):
+            self.lexical_retriever = lexicalstore_cls.load(lexicalstore_config.lexicalstore_path, preprocess_func = preprocess_text)
+        else:
+            f = open(lexicalstore_config.lexicalstore_path, 'rb')
+            self.lexical_retriever = pickle.load(f)
+        self.lexical_retriever.k = lexicalstore_config.lexicalstore_params.k
+        stopwatch.lap('lexicalstore')
+
+        # Both retrievers run concurrently and return chunk references, fused by chunk id, and only the fused chunks are read from the chunk store
+        self.hybrid_retriever = HybridRetriever(
+            retrievers=[self.lexical_retriever, vs_retriever],
+            weights=[ensemble_config.lexicalstore_weight, ensemble_config.vectorstore_weight],
+            names=['lexical', 'dense'],
+            timeouts=[ensemble_config.get('lexicalstore_timeout'), ensemble_config.get('vectorstore_timeout')],
+            id_key=CHUNK_ID_KEY,
+            max_concurrent_searches=max_concurrent_searches
+        )
+        self.candidate_retriever = ChunkStoreRetriever(base_retriever=self.hybrid_retriever, chunk_store=ChunkStore(chunkstore_path, read_only=True))
+        retriever = self.candidate_retriever
+        stopwatch.lap('chunkstore')
 
         if self.perform_rerank:
             # Initialize reranker and contextual compression retriever after defining the ensemble retriever
-            reranker = get_class('reranker', rerank_config.rerank_class)(**rerank_config.rerank_params)
-            ensemble_retriever = EnsembleRetriever(retrievers=[lexical_retriever, vs_retriever], weights=[ensemble_config.lexicalstore_weight, ensemble_config.vectorstore_weight])
+            reranker = self.init_reranker(rerank_config.rerank_class, rerank_config.rerank_params)
             retriever = ContextualCompressionRetriever(
-                base_compressor=reranker, base_retriever=ensemble_retriever
+                base_compressor=reranker, base_retriever=retriever
             )
-        else:
-            # Initialize ensemble retriever without reranking
-            retriever = EnsembleRetriever(retrievers=[lexical_retriever, vs_retriever], weights=[ensemble_config.lexicalstore_weight, ensemble_config.vectorstore_weight])
+            stopwatch.lap('reranker')
 
         # Prepare company information for query rewriting and response generation
-        report_dir = os.path.join(base_input_dir, 'reports')
-        company_symbols = [name for name in os.listdir(report_dir) if os.path.isdir(os.path.join(report_dir, name))]
-        company_names = [yf.Ticker(symbol).info.get("longName") for symbol in company_symbols]
+        company_symbols = get_report_symbols(base_input_dir)
+        company_registry = get_company_registry()
+        company_names = [company_registry.get_name(symbol) for symbol in company_symbols]
         company_info = [f"{company_name} ({company_symbol})" for company_name, company_symbol in zip(company_names, company_symbols)]
+        stopwatch.lap('company_registry')
 
         # Initialize nodes in the graph
-        self.rewrite_query = self.init_node(rewrite_query, rewrite_llm = llm, company_info=company_info)
-        self.retrieve_content =  self.init_node(retrieve_content, retriever = retriever)
-        self.generate_answer = self.init_node(generate_answer, generator_llm = llm_w_tools)
+        self.rewrite_query = self.init_node(rewrite_query, arewrite_query, rewrite_llm = llm, company_info=company_info, company_symbols=company_symbols, filter_config=filter_config)
+        # Cache the retrieved documents of recent queries, cleared whenever the ingestion updates the index
+        self.retrieval_cache = None
+        if cache_config is not None and cache_config.get('retrieval_cache') is not None:
+            self.retrieval_cache = RetrievalCache(**cache_config.retrieval_cache, version_func = IndexVersion(manifest_path))
+
+        # Keep only the documents ranked above the point where their scores drop
+        self.adaptive_depth = AdaptiveDepth(**depth_config) if depth_config is not None else None
+        # Merge the overlapping chunks and fit them in a token budget before the answer generation
+        self.context_packer = ContextPacker(**context_config) if context_config is not None else None
+        self.retrieve_content =  self.init_node(retrieve_content, aretrieve_content, retriever = retriever, retrieval_cache = self.retrieval_cache, adaptive_depth = self.adaptive_depth, reorder = self.context_packer is None)
+        if self.context_packer is not None:
+            self.pack_context = self.init_node(pack_context, context_packer = self.context_packer)
+
+        # Opt-in cache answering paraphrases of previous questions without retrieval and generation
+        self.answer_cache = None
+        if cache_config is not None and cache_config.get('answer_cache') is not None and cache_config.answer_cache.enabled:
+            self.answer_cache = SemanticAnswerCache(
+                embedding = self.embedding,
+                similarity_threshold = cache_config.answer_cache.similarity_threshold,
+                max_size = cache_config.answer_cache.max_size,
+                version_func = IndexVersion(manifest_path)
+            )
+            self.lookup_answer = self.init_node(lookup_answer, answer_cache = self.answer_cache)
+            self.store_answer = self.init_node(store_answer, answer_cache = self.answer_cache)
+
+        self.generate_answer = self.init_node(generate_answer, agenerate_answer, generator_llm = llm_w_tools)
         self.extract_answer = self.init_node(extract_answer)
         self.generate_response = self.init_node(generate_response, company_info=company_info)
         self.tool_node = ToolNode(tools=tools)
+        stopwatch.lap('nodes')
+
+    def init_reranker(self, rerank_class : str, rerank_params : dict):
+        """
+        Initializes a reranker. Local rerankers scoring the candidates with the existing indexes receive the vector
+        store, embedding and lexical retriever.
 
-    def init_node(self, node_function : callable, **kwargs : Dict) -> callable:
+        Args:
+            rerank_class (str): Name of the reranker class.
+            rerank_params (dict): Parameters of the reranker.
+
+        Returns:
+            BaseDocumentCompressor: The reranker.
+        """
+        reranker_cls = get_class('reranker', rerank_class)
+
+        if getattr(reranker_cls, 'uses_indexes', False):
+            return reranker_cls(vectorstore = self.vectorstore, embedding = self.embedding, lexical_retriever = self.lexical_retriever, **rerank_params)
+
+        return reranker_cls(**rerank_params)
+
+    def close(self):
+        """ Closes the database connections opened while loading the indexes, so forked workers open their own. """
+        self.candidate_retriever.chunk_store.close()
+        if hasattr(self.vectorstore, 'close'): self.vectorstore.close()
+
+    def init_node(self, node_function : callable, async_node_function : callable = None, **kwargs : Dict) -> callable:
         """
         Initializes a node function with additional keyword arguments.
         Args:
             node_function (callable): The node function to be wrapped.
+            async_node_function (callable, optional): Async version of the node function, used when the graph runs asynchronously. Defaults to None,
+                running the node function in a thread.
 
         Returns:
             callable: The wrapped node function with additional arguments.
         """
         def wrapped_node(state : State):
             return node_function(state, **kwargs)
-        
-        return wrapped_node
+
+        if async_node_function is None:
+            return wrapped_node
+
+        async def async_wrapped_node(state : State):
+            return await async_node_function(state, **kwargs)
+
+        return RunnableLambda(wrapped_node, afunc = async_wrapped_node, name = node_function.__name__)
     
     def connect_nodes(self) -> StateGraph:
         """        
@@ -118,12 +221,27 @@ class GraphConstructor:
 
         # Defining edges and conditional flows between nodes
         workflow.add_edge(START, 'rewrite_query')
-        workflow.add_conditional_edges('rewrite_query', route_query)
-        workflow.add_edge('retrieve_content', 'generate_answer')
+        if self.context_packer is not None:
+            workflow.add_node('pack_context', self.pack_context)
+            workflow.add_edge('retrieve_content', 'pack_context')
+            workflow.add_edge('pack_context', 'generate_answer')
+        else:
+            workflow.add_edge('retrieve_content', 'generate_answer')
         workflow.add_conditional_edges('generate_answer', should_continue)
         workflow.add_edge('tools', 'generate_answer')
         workflow.add_edge('generate_response', END)
-        workflow.add_edge('extract_answer', END)
+
+        if self.answer_cache is not None:
+            # Relevant questions first look for a cached answer, and new answers are stored in the cache
+            workflow.add_node('lookup_answer', self.lookup_answer)
+            workflow.add_node('store_answer', self.store_answer)
+            workflow.add_conditional_edges('rewrite_query', route_query, {'retrieve_content' : 'lookup_answer', 'generate_response' : 'generate_response'})
+            workflow.add_conditional_edges('lookup_answer', route_cached_answer)
+            workflow.add_edge('extract_answer', 'store_answer')
+            workflow.add_edge('store_answer', END)
+        else:
+            workflow.add_conditional_edges('rewrite_query', route_query)
+            workflow.add_edge('extract_answer', END)
 
         return workflow
     
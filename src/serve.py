@@ -0,0 +1,138 @@
+import os
+# The provider clients open their gRPC channels before the workers are forked, which gRPC only supports with fork support enabled
+os.environ.setdefault("GRPC_ENABLE_FORK_SUPPORT", "1")
+os.environ.setdefault("GRPC_POLL_STRATEGY", "poll")
+
+import argparse
+import gc
+import signal
+import socket
+import uvicorn
+from config import settings
+from src.mapper import get_class
+
+
+def is_fork_safe(vectorstore_config : dict) -> bool:
+    """
+    Checks whether the configured vector store can be loaded once and shared by forked workers.
+
+    Args:
+        vectorstore_config (dict): Configuration for the vector store.
+
+    Returns:
+        bool: Whether the vector store and, for a sharded store, its shards are fork safe.
+    """
+    vectorstore_classes = [vectorstore_config.vectorstore_class]
+    # A sharded store is only as fork safe as its shards
+    if vectorstore_config.vectorstore_class == 'ShardedVectorStore':
+        vectorstore_classes.append(vectorstore_config.vectorstore_params.get('shard_class', 'Chroma'))
+
+    return all(getattr(get_class('vectorstore', vectorstore_class), 'fork_safe', False) for vectorstore_class in vectorstore_classes)
+
+
+def open_socket(host : str, port : int) -> socket.socket:
+    """
+    Opens the listening socket shared by the workers.
+
+    Args:
+        host (str): Host to bind.
+        port (int): Port to bind.
+
+    Returns:
+        socket.socket: The listening socket.
+    """
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def fork_worker(app, sock : socket.socket) -> int:
+    """
+    Forks a worker serving the app on the shared socket.
+
+    Args:
+        app: The FastAPI app, already loaded in the parent process.
+        sock (socket.socket): The listening socket.
+
+    Returns:
+        int: The pid of the worker.
+    """
+    pid = os.fork()
+    if pid > 0:
+        return pid
+
+    # The worker gets uvicorn's signal handlers instead of the ones of the parent
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    try:
+        uvicorn.Server(uvicorn.Config(app, log_level = "info")).run(sockets = [sock])
+    finally:
+        os._exit(0)
+
+
+def serve(host : str, port : int, num_workers : int):
+    """
+    Serves the app with workers forked from a parent which loaded the indexes, the graph and the provider clients
+    once. The read-only index data is either memory-mapped (BM25 and FAISS arrays, embedding cache) or allocated
+    before the fork and never written, so every worker reads the same physical pages. Workers that die are replaced.
+
+    Args:
+        host (str): Host to bind.
+        port (int): Port to bind.
+        num_workers (int): Number of workers.
+    """
+    if not is_fork_safe(settings.vectorstore_config):
+        print(f"WARNING: {settings.vectorstore_config.vectorstore_class} cannot be shared by forked workers, every worker loads its own indexes")
+        uvicorn.run("src.app:app", host = host, port = port, workers = num_workers)
+        return
+
+    from src.app import app, graph_constructor
+
+    # SQLite connections must not cross a fork, the workers open their own on first use
+    graph_constructor.close()
+    sock = open_socket(host, port)
+
+    # Move every loaded object out of the garbage collector's generations, so collections in the workers do not
+    # write to the pages of the shared objects and copy them
+    gc.collect()
+    gc.freeze()
+
+    workers = {fork_worker(app, sock) for _ in range(num_workers)}
+    print(f"INFO: Serving on {host}:{port} with {num_workers} forked workers {sorted(workers)}")
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while len(workers) > 0:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+
+        workers.discard(pid)
+        if not stopping:
+            print(f"WARNING: Worker {pid} exited with status {status}, forking a new worker")
+            workers.add(fork_worker(app, sock))
+
+    sock.close()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description = "Serves the RAG chatbot with forked workers sharing the loaded indexes.")
+    arg_parser.add_argument("--host", default = "0.0.0.0", help = "Host to bind")
+    arg_parser.add_argument("--port", type = int, default = 8000, help = "Port to bind")
+    arg_parser.add_argument("--workers", type = int, default = settings.serving_config.num_workers, help = "Number of workers")
+    args = arg_parser.parse_args()
+
+    serve(args.host, args.port, args.workers)
@@ -0,0 +1,48 @@
+import importlib
+import time
+from src import mapper
+
+
+def time_import(module_name : str) -> float:
+    """
+    Imports a module and times it.
+
+    Args:
+        module_name (str): The module.
+
+    Returns:
+        float: The import time in seconds, 0 if the module was already imported.
+    """
+    t0 = time.perf_counter()
+    importlib.import_module(module_name)
+    return time.perf_counter() - t0
+
+
+if __name__ == "__main__":
+    # Modules are imported in dependency order, so each line only counts what the previous lines did not import
+    module_times = {
+        "settings" : time_import("config"),
+        "keyword preprocessing (NLTK data)" : time_import("src.index_ingestion.text_utils"),
+        "graph modules (LangChain, LangGraph)" : time_import("src.rag_architecture.graph_constructor"),
+        "FastAPI" : time_import("fastapi")
+    }
+    # Importing the app builds the graph, which imports the configured providers and loads the indexes
+    app_time = time_import("src.app")
+
+    from src.app import graph_constructor
+    init_times = graph_constructor.init_times
+
+    print(f"{'component':<40} {'import':>10} {'init':>10}")
+    for name, import_time in module_times.items():
+        print(f"{name:<40} {1000 * import_time:>8.0f}ms {'':>10}")
+    for name, step_times in init_times.items():
+        print(f"{name:<40} {1000 * step_times['import']:>8.0f}ms {1000 * step_times['init']:>8.0f}ms")
+
+    # The rest of the app import is the graph compilation and the endpoints
+    graph_time = sum(step_times['import'] + step_times['init'] for step_times in init_times.values())
+    print(f"{'graph compilation and app':<40} {'':>10} {1000 * (app_time - graph_time):>8.0f}ms")
+    print(f"{'total':<40} {1000 * (sum(module_times.values()) + app_time):>8.0f}ms")
+
+    print("\nProviders imported by the mapper")
+    for name, import_time in mapper.import_times.items():
+        print(f"  {name:<38} {1000 * import_time:>8.0f}ms")
@@ -0,0 +1,27 @@
+import time
+from src import mapper
+
+
+class Stopwatch:
+    """
+    Class to time consecutive initialization steps, separating the time spent importing providers through the mapper
+    from the time spent initializing the components.
+    """
+
+    def __init__(self):
+        """ Initializes the Stopwatch, starting the first step. """
+        self.times = {}
+        self.start = time.perf_counter()
+        self.start_import = sum(mapper.import_times.values())
+
+    def lap(self, name : str):
+        """
+        Ends the current step and starts the next one.
+
+        Args:
+            name (str): Name of the ended step.
+        """
+        end, end_import = time.perf_counter(), sum(mapper.import_times.values())
+        import_time = end_import - self.start_import
+        self.times[name] = {"import" : import_time, "init" : end - self.start - import_time}
+        self.start, self.start_import = end, end_import
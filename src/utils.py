@@ -1,4 +1,5 @@
 import pandas as pd
+from src.index_ingestion.text_utils import expand_page_num
 from typing_extensions import Optional
 
 
@@ -41,11 +42,7 @@ def correct_page_retrieved(row : pd.Series) -> Optional[bool]:
     page_number = row['page_number']
 
     for context in retrieved_contexts:
-        if '-' in context.metadata['page_num']:
-            start_page, end_page = map(int, context.metadata['page_num'].split('-'))
-            expanded_pages = list(range(start_page, end_page + 1))
-        else:
-            expanded_pages = [int(context.metadata['page_num'])]
+        expanded_pages = expand_page_num(context.metadata['page_num'])
 
         if (
             company_symbol == context.metadata['company_symbol'] 
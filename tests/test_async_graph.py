@@ -0,0 +1,63 @@
+import asyncio
+from functools import partial
+from langchain.retrievers.contextual_compression import ContextualCompressionRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.documents.compressor import BaseDocumentCompressor
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import RunnableLambda
+from langgraph.graph import StateGraph, START, END
+from typing_extensions import List
+from src.index_ingestion.chunk_store import ChunkStore, ChunkStoreRetriever, chunk_reference
+from src.rag_architecture.components.hybrid_retriever import HybridRetriever
+from src.rag_architecture.components.retrieve_content import retrieve_content, aretrieve_content
+from src.rag_architecture.components.schemas import State
+
+
+class StubRetriever(BaseRetriever):
+    """ Retriever returning fixed chunk references, only from the sync implementation like the retrievers of the graph. """
+
+    chunk_ids : List[str]
+    received_filters : List[dict] = []
+
+    def _get_relevant_documents(self, query : str, *, run_manager : CallbackManagerForRetrieverRun, filters : dict = None) -> list[Document]:
+        self.received_filters.append(filters)
+        return [chunk_reference(chunk_id) for chunk_id in self.chunk_ids]
+
+
+class FirstDocuments(BaseDocumentCompressor):
+    """ Compressor keeping the first documents, in place of the reranker. """
+
+    top_n : int = 2
+
+    def compress_documents(self, documents, query, callbacks = None):
+        return list(documents)[:self.top_n]
+
+
+def build_graph(retriever : BaseRetriever):
+    """ Builds a graph of the retrieve_content node, wrapped with its async version like in the GraphConstructor. """
+    workflow = StateGraph(State)
+    workflow.add_node('retrieve_content', RunnableLambda(partial(retrieve_content, retriever = retriever), afunc = partial(aretrieve_content, retriever = retriever)))
+    workflow.add_edge(START, 'retrieve_content')
+    workflow.add_edge('retrieve_content', END)
+    return workflow.compile()
+
+
+def test_graph_ainvoke_retrieves_with_filters(tmp_path):
+    chunk_store = ChunkStore(str(tmp_path / "chunks.db"))
+    chunk_store.add([Document(id = chunk_id, page_content = f"text of {chunk_id}", metadata = {"page_num" : "1"}) for chunk_id in ["a", "b", "c"]])
+
+    lexical, dense = StubRetriever(chunk_ids = ["a", "b"]), StubRetriever(chunk_ids = ["b", "c"])
+    hybrid_retriever = HybridRetriever(retrievers = [lexical, dense], weights = [0.5, 0.5], names = ["lexical", "dense"], timeouts = [5, 5])
+    retriever = ContextualCompressionRetriever(
+        base_compressor = FirstDocuments(),
+        base_retriever = ChunkStoreRetriever(base_retriever = hybrid_retriever, chunk_store = ChunkStore(str(tmp_path / "chunks.db"), read_only = True))
+    )
+
+    filters = {"company_symbol" : ["AAPL"]}
+    result = asyncio.run(build_graph(retriever).ainvoke({"user_question" : "revenue", "search_filters" : filters}))
+
+    assert lexical.received_filters == [filters]
+    assert dense.received_filters == [filters]
+    assert sorted(doc.id for doc in result['retrieved_docs']) == ["a", "b"]
+    assert "text of b" in result['formatted_docs']
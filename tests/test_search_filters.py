@@ -0,0 +1,51 @@
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from typing_extensions import List
+from src.index_ingestion.chunk_store import ChunkStore, ChunkStoreRetriever, chunk_reference
+from src.rag_architecture.components.hybrid_retriever import HybridRetriever
+from src.rag_architecture.components.search_filters import build_search_filters, to_chroma_where
+
+
+class RecordingRetriever(BaseRetriever):
+    """ Retriever returning fixed chunk references and recording the search filters it received. """
+
+    chunk_ids : List[str]
+    received_filters : List[dict] = []
+
+    def _get_relevant_documents(self, query : str, *, run_manager : CallbackManagerForRetrieverRun, filters : dict = None) -> list[Document]:
+        self.received_filters.append(filters)
+        return [chunk_reference(chunk_id) for chunk_id in self.chunk_ids]
+
+
+def test_build_search_filters_drops_unknown_symbols_and_widens_years():
+    filters = build_search_filters(["aapl", "XXXX"], [2022], available_symbols = ["AAPL", "MSFT"], year_window = 1)
+
+    assert filters == {"company_symbol" : ["AAPL"], "report_year" : ["2022", "2023"]}
+    assert build_search_filters(["XXXX"], [], available_symbols = ["AAPL"]) == {}
+
+
+def test_to_chroma_where():
+    assert to_chroma_where({}) is None
+    assert to_chroma_where({"company_symbol" : ["AAPL"]}) == {"company_symbol" : {"$in" : ["AAPL"]}}
+    assert to_chroma_where({"company_symbol" : ["AAPL"], "report_year" : ["2022"]}) == {
+        "$and" : [{"company_symbol" : {"$in" : ["AAPL"]}}, {"report_year" : {"$in" : ["2022"]}}]
+    }
+
+
+def test_filters_reach_every_retriever(tmp_path):
+    chunk_store = ChunkStore(str(tmp_path / "chunks.db"))
+    chunk_store.add([Document(id = chunk_id, page_content = chunk_id, metadata = {}) for chunk_id in ["a", "b", "c"]])
+
+    lexical, dense = RecordingRetriever(chunk_ids = ["a", "b"]), RecordingRetriever(chunk_ids = ["b", "c"])
+    hybrid_retriever = HybridRetriever(retrievers = [lexical, dense], weights = [0.5, 0.5], names = ["lexical", "dense"], timeouts = [None, None])
+    retriever = ChunkStoreRetriever(base_retriever = hybrid_retriever, chunk_store = chunk_store)
+
+    filters = {"company_symbol" : ["AAPL"], "report_year" : ["2022"]}
+    docs = retriever.invoke("revenue", filters = filters)
+
+    assert lexical.received_filters == [filters]
+    assert dense.received_filters == [filters]
+    # The chunk found by both retrievers is ranked first
+    assert [doc.id for doc in docs][0] == "b"
+    assert sorted(doc.id for doc in docs) == ["a", "b", "c"]